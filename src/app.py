@@ -1,78 +1,159 @@
 #!/usr/bin/env python 
 
 import os
-from fx import process_instrumental, process_vocals, sum_audio, process_buss
-import numpy as np
-from utils import open_file, save_file
+import argparse
+from fx import (process_song, process_song_streaming, SongChains, buffer_stats, buffer_arena, DEFAULT_BLOCK_SIZE,
+                DEFAULT_LOUDNESS_TARGET, DEFAULT_TRUE_PEAK_CEILING)
+from stage_cache import StageCache, STAGE_CACHE_DIR
+from segments import process_song_segmented, describe, SEGMENT_SETTLE_SECONDS
+from utils import OUTPUT_FORMATS, SAMPLE_FORMATS, DEFAULT_SAMPLE_FORMAT, output_format
+from dsp_scripts.precision import PRECISIONS, set_precision, get_precision
+from dsp_scripts.qc import write_report
+import profiling
 
 # Define input and output file paths.
 vocal_file = "../input_files/v.wav"
 instrumental_file = "../input_files/i.wav"
-output_vocal_file = "../output/processed_vocal.wav"
-output_instrumental_file = "../output/processed_instrumental.wav"
-output_summed_file = "../output/summed.wav"
-output_buss_file = "../output/processed_buss.wav"
+output_dir = "../output"
 samplerate = 44100.0
 
-# Ensure the output directory exists
-output_dir = os.path.dirname(output_instrumental_file)
-os.makedirs(output_dir, exist_ok=True)
-
-inst_audio = open_file(instrumental_file, samplerate)
-print("Inst Shape at input:", inst_audio.shape)
-print("Inst Type at input:", inst_audio.dtype)
-print("Inst Max at input:", np.max(inst_audio))
-print("Inst Min at input:", np.min(inst_audio))
-
-inst_processed = process_instrumental(inst_audio, samplerate)
-print("Inst Shape after processing:", inst_processed.shape)
-print("Inst Type after processing:", inst_processed.dtype)
-print("Inst Max after processing:", np.max(inst_processed))
-print("Inst Min after processing:", np.min(inst_processed))
-
-vocal_audio = open_file(vocal_file, samplerate)
-print("Vox Shape at input:", vocal_audio.shape)
-print("Vox Type at input:", vocal_audio.dtype)
-print("Vox Max at input:", np.max(vocal_audio))
-print("Vox Min at input:", np.min(vocal_audio))
-
-vocal_processed = process_vocals(vocal_audio, samplerate) 
-print("Vox Shape after processing:", vocal_processed.shape)
-print("Vox Type after processing:", vocal_processed.dtype)
-print("Vox Max after processing:", np.max(vocal_processed))
-print("Vox Min after processing:", np.min(vocal_processed))
-
-summed_audios = sum_audio(inst_processed, vocal_processed)
-print("summed_audios shape:", summed_audios.shape)
-
-#reshape data
-summed_audios = np.squeeze(summed_audios)  # Remove dimensions of size 1
-print("Summed audio After squeeze:", summed_audios.shape)
-
-if len(summed_audios.shape) == 1:  # If mono (N,)
-    print("audios were mono, stacking to make stereo")
-    summed_audios = np.stack([summed_audios, summed_audios], axis=1)  # Convert to (N,2)
-
-print("Shape before compression:", summed_audios.shape)
-summed_audios = summed_audios.astype(np.float32)
-print("Converted audio to float32")
-
-print(f"Before Buss Comp: Audio dtype: {summed_audios.dtype}, Shape: {summed_audios.shape}, Size (MB): {summed_audios.nbytes / 1e6:.2f}MB")
-buss = process_buss(summed_audios, samplerate)
-print(f"Buss output Audio dtype: {buss.dtype}, Shape: {buss.shape}, Size (MB): {buss.nbytes / 1e6:.2f}MB")
-
-print("Processed files saving:")
-save_file(inst_processed, samplerate, output_instrumental_file, channels=2)
-print(f"  Instrumental: {output_instrumental_file}")
-save_file(vocal_processed, samplerate, output_vocal_file, channels=2)
-print(f"  Vocals: {output_vocal_file}")
-save_file(summed_audios, samplerate, output_summed_file, channels=2)
-print(f"  Summed: {output_summed_file}")
-save_file(buss, samplerate, output_buss_file, channels=2)
-print(f"  Buss: {output_buss_file}")
-
-
-
-
-
-
+def main():
+    parser = argparse.ArgumentParser(description="Post-process a vocal/instrumental pair.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Render block by block so memory use is bounded by the block size instead of the song length.")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help=f"Frames per block in streaming mode (default: {DEFAULT_BLOCK_SIZE}).")
+    parser.add_argument("--precision", choices=PRECISIONS, default=get_precision(),
+                        help="Numeric precision of the DSP kernels (default: float64, or $DSP_PRECISION). "
+                             "See python -m dsp_scripts.accuracy for what float32/fast cost in accuracy.")
+    parser.add_argument("--fused-eq", action="store_true",
+                        help="Run the EQ filters as fused biquad cascades (same output as Pedalboard, fewer passes).")
+    parser.add_argument("--preset", metavar="FILE",
+                        help="Chain preset (.json, or .yaml with PyYAML) to render with (default: ../presets/default.json).")
+    parser.add_argument("--format", choices=tuple(OUTPUT_FORMATS), default="wav",
+                        help="Container of the output files (default: wav).")
+    parser.add_argument("--sample-format", choices=tuple(SAMPLE_FORMATS), default=DEFAULT_SAMPLE_FORMAT,
+                        help=f"Sample format of the output files (default: {DEFAULT_SAMPLE_FORMAT}). FLAC is int16 or int24.")
+    parser.add_argument("--flac-level", type=int, choices=range(9), metavar="0-8",
+                        help="FLAC compression level, 0 fastest to 8 smallest (default: Pedalboard's).")
+    parser.add_argument("--loudness-target", nargs="?", type=float, const=DEFAULT_LOUDNESS_TARGET, metavar="LUFS",
+                        help="Normalize the summed and buss outputs to this integrated loudness (BS.1770) as they are written, "
+                             f"instead of peak normalizing the sum (default LUFS: {DEFAULT_LOUDNESS_TARGET:g}).")
+    parser.add_argument("--true-peak-ceiling", type=float, default=DEFAULT_TRUE_PEAK_CEILING, metavar="DBTP",
+                        help=f"True peak the loudness normalization stays under (default: {DEFAULT_TRUE_PEAK_CEILING:g} dBTP).")
+    parser.add_argument("--measure-loudness", action="store_true",
+                        help="Measure the loudness and true peak of the summed and buss outputs (implied by --loudness-target).")
+    parser.add_argument("--qc", nargs="?", const=f"{output_dir}/qc.json", metavar="FILE",
+                        help="Measure clipping, DC offset, stereo correlation and spectral tilt of every output, and the "
+                             f"compressor/exciter gain reduction, as they are rendered; save the report to FILE (default: {output_dir}/qc.json).")
+    parser.add_argument("--stage-cache", nargs="?", const=STAGE_CACHE_DIR, metavar="DIR",
+                        help="Cache every stage's output and only re-run the stages whose input, preset entry or code changed "
+                             f"(default DIR: {STAGE_CACHE_DIR}). Whole-file renders only.")
+    parser.add_argument("--stage-cache-max-mb", type=float,
+                        help="Size cap of the stage cache; least recently used entries go first (default: 4096, or $STAGE_CACHE_MAX_MB).")
+    parser.add_argument("--segments", type=int, metavar="N",
+                        help="Split every chain into N segments rendered on N worker processes, for long songs on many cores "
+                             "(see segments.py). Whole-file renders only.")
+    parser.add_argument("--segment-settle", type=float, default=SEGMENT_SETTLE_SECONDS, metavar="SECONDS",
+                        help=f"Pre-roll of stages with decaying state in segment mode (default: {SEGMENT_SETTLE_SECONDS:g}).")
+    parser.add_argument("--exact-segments", action="store_true",
+                        help="Only split chains whose segments join bit-exactly; render the others in one piece.")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Record wall/CPU time, allocations and shapes of every stage and save them to FILE.")
+    parser.add_argument("--profile-format", choices=("json", "chrome"), default="json",
+                        help="json: events and per-stage totals; chrome: a trace for chrome://tracing or Perfetto.")
+    args = parser.parse_args()
+
+    output_vocal_file = f"{output_dir}/processed_vocal.{args.format}"
+    output_instrumental_file = f"{output_dir}/processed_instrumental.{args.format}"
+    output_summed_file = f"{output_dir}/summed.{args.format}"
+    output_buss_file = f"{output_dir}/processed_buss.{args.format}"
+    try:
+        output_format(output_buss_file, args.sample_format, args.flac_level)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.stage_cache and args.stream:
+        parser.error("--stage-cache works on whole-file renders, not with --stream.")
+    if args.segments is not None and (args.stream or args.stage_cache):
+        parser.error("--segments works on whole-file renders, not with --stream or --stage-cache.")
+    if args.segments is not None and args.segments < 1:
+        parser.error("--segments must be at least 1.")
+
+    # Ensure the output directory exists
+    os.makedirs(output_dir, exist_ok=True)
+
+    set_precision(args.precision)
+    if args.profile:
+        profiling.enable()
+    chains = SongChains(samplerate, fused_eq=args.fused_eq, preset=args.preset)
+    loudness = {"loudness_target": args.loudness_target, "true_peak_ceiling": args.true_peak_ceiling,
+                "loudness_report": {} if args.measure_loudness or args.loudness_target is not None else None,
+                "qc_report": {} if args.qc else None}
+
+    if args.stream:
+        frames = process_song_streaming(instrumental_file, vocal_file,
+                                        output_instrumental_file, output_vocal_file, output_summed_file, output_buss_file,
+                                        samplerate, block_size=args.block_size, chains=chains,
+                                        sample_format=args.sample_format, compression_level=args.flac_level, **loudness)
+        print(f"Streamed {frames} frames in blocks of {args.block_size}, files saved:")
+    elif args.segments:
+        for name, (mode, history) in describe(chains, args.segment_settle).items():
+            print(f"  {name}: {mode} split, {history:.2f} s pre-roll")
+        frames = process_song_segmented(instrumental_file, vocal_file,
+                                        output_instrumental_file, output_vocal_file, output_summed_file, output_buss_file,
+                                        samplerate, chains=chains, workers=args.segments,
+                                        settle_seconds=args.segment_settle, allow_approximate=not args.exact_segments,
+                                        sample_format=args.sample_format, compression_level=args.flac_level, **loudness)
+        print(f"Processed {frames} frames in {args.segments} segments, files saved:")
+    else:
+        cache = None
+        if args.stage_cache:
+            cache = StageCache(args.stage_cache, None if args.stage_cache_max_mb is None else int(args.stage_cache_max_mb * 2**20))
+        # Instrumental and vocal branches run concurrently, see fx.process_song.
+        frames = process_song(instrumental_file, vocal_file,
+                              output_instrumental_file, output_vocal_file, output_summed_file, output_buss_file,
+                              samplerate, chains=chains,
+                              sample_format=args.sample_format, compression_level=args.flac_level, cache=cache, **loudness)
+        if cache is not None:
+            print(f"Stage cache: {cache.hits} hits, {cache.misses} misses")
+        print(f"Processed {frames} frames, files saved:")
+    print(f"  Instrumental: {output_instrumental_file}")
+    print(f"  Vocals: {output_vocal_file}")
+    print(f"  Summed: {output_summed_file}")
+    print(f"  Buss: {output_buss_file}")
+    if loudness["loudness_report"]:
+        for name, measured in loudness["loudness_report"].items():
+            print(f"Loudness of {name}: {measured['integrated_lufs']:.1f} LUFS, {measured['true_peak_dbtp']:.1f} dBTP, "
+                  f"LRA {measured['loudness_range_lu']:.1f} LU; written at {measured['output_integrated_lufs']:.1f} LUFS, "
+                  f"{measured['output_true_peak_dbtp']:.1f} dBTP ({measured['gain_db']:+.1f} dB)")
+    if args.qc:
+        report = loudness["qc_report"]
+        for name, measured in report["outputs"].items():
+            correlation = measured["correlation"]["overall"] if measured["correlation"] else None
+            tilt = measured["spectral_tilt"]["db_per_octave"]
+            print(f"QC of {name}: {measured['clipped_runs']} clipped runs, DC {max(map(abs, measured['dc_offset'])):.5f}, "
+                  f"correlation {'n/a' if correlation is None else f'{correlation:+.2f}'}, "
+                  f"tilt {'n/a' if tilt is None else f'{tilt:+.1f}'} dB/oct")
+        for chain, stages in report.get("stages", {}).items():
+            for name, trace in stages.items():
+                if trace["windows"]:
+                    print(f"QC of {chain}.{name}: gain reduction mean {trace['mean_db']:.1f} dB, max {trace['max_db']:.1f} dB, "
+                          f"active {trace['active_fraction'] * 100:.0f}% of the time")
+        write_report(dict(report, vocal=vocal_file, instrumental=instrumental_file), args.qc)
+        print(f"QC report saved to {args.qc}")
+
+    if args.profile:
+        profiler = profiling.disable()
+        profiler.print_summary()
+        copies = buffer_stats.summary()
+        print(f"Buffer copies: {copies['copies']}, dtype conversions: {copies['conversions']} "
+              f"({copies['bytes_copied'] / 2**20:.1f} MiB)")
+        pooled = buffer_arena.summary()
+        print(f"Buffer arena: {pooled['hits']} reused, {pooled['misses']} allocated "
+              f"({pooled['bytes_allocated'] / 2**20:.1f} MiB)")
+        profiler.save(args.profile, args.profile_format)
+        print(f"Profile saved to {args.profile}")
+
+# Segment mode's worker processes import this module; only the main process renders.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# Batch post-processing of many vocal/instrumental pairs on a pool of warm worker processes.
+#
+# Each worker compiles the numba kernels and builds the chains once, then reuses them (reset
+# between songs) for every track it is handed. Tracks can pick their own preset; a worker
+# builds the chains for each preset it meets once and keeps them (see fx.get_chains).
+#
+# Input is either a directory with one sub-directory per song, each holding v.wav and i.wav
+# (the same layout as input_files/) and optionally a preset.json, or a CSV manifest with
+# columns: name,vocal,instrumental[,preset] (relative paths are resolved against the
+# manifest's directory). Tracks without a preset use --preset.
+# Outputs go to <out>/<name>/ with the same file names app.py uses.
+#
+#   python batch.py ../batch_input --out ../batch_output --jobs 8
+
+import os
+import csv
+import time
+import argparse
+import traceback
+import multiprocessing
+import numba
+from dsp_scripts import warmup
+from dsp_scripts.precision import PRECISIONS, set_precision, get_precision
+from dsp_scripts.qc import write_report
+from fx import (get_chains, process_song, process_song_streaming, DEFAULT_BLOCK_SIZE,
+                DEFAULT_LOUDNESS_TARGET, DEFAULT_TRUE_PEAK_CEILING)
+from stage_cache import StageCache, STAGE_CACHE_DIR
+from utils import OUTPUT_FORMATS, SAMPLE_FORMATS, DEFAULT_SAMPLE_FORMAT, output_format
+
+samplerate = 44100.0
+
+# Per-process state, set up once by init_worker.
+_options = None
+_cache = None
+
+def find_jobs(source):
+    """
+    Build the list of (name, vocal_file, instrumental_file, preset_file) jobs from a directory
+    or CSV manifest. preset_file is None for tracks without their own preset.
+    """
+    jobs = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            song_dir = os.path.join(source, name)
+            vocal_file = os.path.join(song_dir, "v.wav")
+            instrumental_file = os.path.join(song_dir, "i.wav")
+            preset_file = os.path.join(song_dir, "preset.json")
+            if os.path.isfile(vocal_file) and os.path.isfile(instrumental_file):
+                jobs.append((name, vocal_file, instrumental_file,
+                             preset_file if os.path.isfile(preset_file) else None))
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, newline="") as f:
+            for row in csv.DictReader(f):
+                jobs.append((row["name"],
+                             os.path.join(base_dir, row["vocal"]),
+                             os.path.join(base_dir, row["instrumental"]),
+                             os.path.join(base_dir, row["preset"]) if row.get("preset") else None))
+    return jobs
+
+def output_files(song_dir, ext):
+    # (instrumental, vocal, summed, buss) output paths of a song, named like app.py's.
+    return (os.path.join(song_dir, f"processed_instrumental.{ext}"),
+            os.path.join(song_dir, f"processed_vocal.{ext}"),
+            os.path.join(song_dir, f"summed.{ext}"),
+            os.path.join(song_dir, f"processed_buss.{ext}"))
+
+def init_worker(options):
+    global _options, _cache
+    # The pool already uses every core; keep numba's parallel kernels to this worker's share.
+    numba.set_num_threads(min(options["threads"], numba.config.NUMBA_NUM_THREADS))
+    set_precision(options["precision"])
+    warmup()
+    get_chains(samplerate, preset=options["preset"], fused_eq=options["fused_eq"])
+    if options["stage_cache"]:
+        _cache = StageCache(options["stage_cache"], options["stage_cache_max_bytes"])
+    _options = options
+
+def run_job(job):
+    """
+    Render one song in a worker. Errors are caught and reported so one bad track doesn't stop the batch.
+
+    Returns:
+        dict: name, ok, error, seconds (render wall time), audio_seconds (length of the output),
+              loudness (output name -> loudness measurement, None unless measured) and qc
+              (path of the song's QC report, None unless asked for).
+    """
+    name, vocal_file, instrumental_file, preset_file = job
+    song_dir = os.path.join(_options["out"], name)
+    outputs = output_files(song_dir, _options["container"])
+    encoding = {"sample_format": _options["sample_format"], "compression_level": _options["compression_level"],
+                "loudness_target": _options["loudness_target"], "true_peak_ceiling": _options["true_peak_ceiling"],
+                "loudness_report": {} if _options["measure_loudness"] or _options["loudness_target"] is not None else None,
+                "qc_report": {} if _options["qc"] else None}
+    start = time.perf_counter()
+    try:
+        os.makedirs(song_dir, exist_ok=True)
+        chains = get_chains(samplerate, preset=preset_file or _options["preset"], fused_eq=_options["fused_eq"])
+        if _options["stream"]:
+            frames = process_song_streaming(instrumental_file, vocal_file, *outputs, samplerate,
+                                            block_size=_options["block_size"], chains=chains, **encoding)
+        else:
+            frames = process_song(instrumental_file, vocal_file, *outputs, samplerate, chains=chains,
+                                  max_workers=_options["threads"], cache=_cache, **encoding)
+        qc_file = None
+        if _options["qc"]:
+            qc_file = os.path.join(song_dir, "qc.json")
+            write_report(dict(encoding["qc_report"], name=name, vocal=vocal_file, instrumental=instrumental_file), qc_file)
+        return {"name": name, "ok": True, "error": None,
+                "seconds": time.perf_counter() - start, "audio_seconds": frames / samplerate,
+                "loudness": encoding["loudness_report"], "qc": qc_file}
+    except Exception:
+        return {"name": name, "ok": False, "error": traceback.format_exc(),
+                "seconds": time.perf_counter() - start, "audio_seconds": 0.0, "loudness": None, "qc": None}
+
+def worker_options(out, stream=False, block_size=DEFAULT_BLOCK_SIZE, threads=1, precision=None, fused_eq=False,
+                   preset=None, container="wav", sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None,
+                   stage_cache=None, stage_cache_max_bytes=None,
+                   loudness_target=None, true_peak_ceiling=DEFAULT_TRUE_PEAK_CEILING, measure_loudness=False, qc=False):
+    # The options dict init_worker takes.
+    return {"out": out, "stream": stream, "block_size": block_size, "threads": threads,
+            "precision": precision or get_precision(), "fused_eq": fused_eq, "preset": preset,
+            "container": container, "sample_format": sample_format, "compression_level": compression_level,
+            "stage_cache": stage_cache, "stage_cache_max_bytes": stage_cache_max_bytes,
+            "loudness_target": loudness_target, "true_peak_ceiling": true_peak_ceiling, "measure_loudness": measure_loudness,
+            "qc": qc}
+
+def run_batch(jobs, out, n_jobs, stream=False, block_size=DEFAULT_BLOCK_SIZE, threads=1, precision=None, fused_eq=False,
+              preset=None, container="wav", sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None,
+              stage_cache=None, stage_cache_max_bytes=None,
+              loudness_target=None, true_peak_ceiling=DEFAULT_TRUE_PEAK_CEILING, measure_loudness=False, qc=False):
+    """
+    Render every job on a pool of n_jobs worker processes that stay alive for the whole batch.
+
+    Returns:
+        tuple: (list of per-job result dicts, wall-clock seconds for the batch)
+    """
+    options = worker_options(out, stream, block_size, threads, precision, fused_eq, preset,
+                             container, sample_format, compression_level, stage_cache, stage_cache_max_bytes,
+                             loudness_target, true_peak_ceiling, measure_loudness, qc)
+    results = []
+    start = time.perf_counter()
+    with multiprocessing.Pool(n_jobs, initializer=init_worker, initargs=(options,)) as pool:
+        for result in pool.imap_unordered(run_job, jobs):
+            status = "ok" if result["ok"] else "FAILED"
+            if result["loudness"]:
+                buss = result["loudness"]["buss"]
+                status += f", buss {buss['output_integrated_lufs']:.1f} LUFS {buss['output_true_peak_dbtp']:.1f} dBTP"
+            print(f"[{len(results) + 1}/{len(jobs)}] {result['name']}: {status} ({result['seconds']:.2f}s)")
+            if not result["ok"]:
+                print(result["error"])
+            results.append(result)
+    return results, time.perf_counter() - start
+
+def print_summary(results, wall_seconds):
+    succeeded = [r for r in results if r["ok"]]
+    audio_seconds = sum(r["audio_seconds"] for r in succeeded)
+    print("Batch summary:")
+    print(f"  Tracks: {len(succeeded)} ok, {len(results) - len(succeeded)} failed")
+    print(f"  Wall time: {wall_seconds:.2f}s")
+    if wall_seconds > 0:
+        print(f"  Throughput: {len(succeeded) * 60.0 / wall_seconds:.1f} tracks/minute")
+        print(f"  Realtime factor: {audio_seconds / wall_seconds:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-process many vocal/instrumental pairs on a worker pool.")
+    parser.add_argument("source", help="Directory of song folders (each with v.wav and i.wav) or a CSV manifest (name,vocal,instrumental).")
+    parser.add_argument("--out", default="../batch_output", help="Output directory (default: ../batch_output).")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes (default: CPU count).")
+    parser.add_argument("--stream", action="store_true", help="Render each song block by block (see app.py --stream).")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="Frames per block in streaming mode.")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Threads per worker for the concurrent instrumental/vocal branches (default: 1, the pool already uses every core).")
+    parser.add_argument("--precision", choices=PRECISIONS, default=get_precision(),
+                        help="Numeric precision of the DSP kernels (see app.py --precision).")
+    parser.add_argument("--fused-eq", action="store_true", help="Run the EQ filters as fused biquad cascades (see app.py --fused-eq).")
+    parser.add_argument("--preset", help="Chain preset for tracks that don't name their own (default: ../presets/default.json).")
+    parser.add_argument("--format", choices=tuple(OUTPUT_FORMATS), default="wav", help="Container of the output files (default: wav).")
+    parser.add_argument("--sample-format", choices=tuple(SAMPLE_FORMATS), default=DEFAULT_SAMPLE_FORMAT,
+                        help="Sample format of the output files (see app.py --sample-format).")
+    parser.add_argument("--flac-level", type=int, choices=range(9), metavar="0-8", help="FLAC compression level (see app.py --flac-level).")
+    parser.add_argument("--loudness-target", nargs="?", type=float, const=DEFAULT_LOUDNESS_TARGET, metavar="LUFS",
+                        help="Loudness normalize the summed and buss outputs (see app.py --loudness-target).")
+    parser.add_argument("--true-peak-ceiling", type=float, default=DEFAULT_TRUE_PEAK_CEILING, metavar="DBTP",
+                        help="True peak the loudness normalization stays under (see app.py --true-peak-ceiling).")
+    parser.add_argument("--measure-loudness", action="store_true", help="Measure the outputs' loudness (see app.py --measure-loudness).")
+    parser.add_argument("--qc", action="store_true", help="Save a QC report of every song as qc.json next to its outputs (see app.py --qc).")
+    parser.add_argument("--stage-cache", nargs="?", const=STAGE_CACHE_DIR, metavar="DIR",
+                        help="Cache stage outputs and only re-run what changed (see app.py --stage-cache). Not with --stream.")
+    parser.add_argument("--stage-cache-max-mb", type=float, help="Size cap of the stage cache (see app.py --stage-cache-max-mb).")
+    args = parser.parse_args()
+    if args.stage_cache and args.stream:
+        parser.error("--stage-cache works on whole-file renders, not with --stream.")
+    try:
+        output_format("out." + args.format, args.sample_format, args.flac_level)
+    except ValueError as e:
+        parser.error(str(e))
+
+    jobs = find_jobs(args.source)
+    if not jobs:
+        parser.error(f"No vocal/instrumental pairs found in {args.source}")
+
+    results, wall_seconds = run_batch(jobs, args.out, args.jobs, stream=args.stream, block_size=args.block_size, threads=args.threads,
+                                      precision=args.precision, fused_eq=args.fused_eq, preset=args.preset,
+                                      container=args.format, sample_format=args.sample_format, compression_level=args.flac_level,
+                                      stage_cache=args.stage_cache,
+                                      stage_cache_max_bytes=None if args.stage_cache_max_mb is None else int(args.stage_cache_max_mb * 2**20),
+                                      loudness_target=args.loudness_target, true_peak_ceiling=args.true_peak_ceiling,
+                                      measure_loudness=args.measure_loudness, qc=args.qc)
+    print_summary(results, wall_seconds)
+    if not all(r["ok"] for r in results):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# Benchmark suite for the DSP kernels and the fx chains, on synthetic signals.
+#
+# Every case runs on several signal lengths and layouts (mono/stereo, float32/float64) and reports:
+#   first_call_seconds   the first call: numba JIT compilation (or loading it from the cache)
+#                        plus one run. import_seconds holds the compile time of the kernels with
+#                        explicit signatures, which happens when their module is imported.
+#   jit_seconds          first_call_seconds minus the steady-state time
+#   median/min_seconds   steady state over --repeats runs
+#   samples_per_second   frames * channels per steady-state second
+#   realtime_factor      seconds of audio per steady-state second
+#   peak_memory_bytes    peak memory allocated during one run, traced with tracemalloc. That
+#                        covers NumPy and numba arrays (numba allocates through Python's raw
+#                        allocator) but not Pedalboard's internal C++ buffers.
+#
+# Results are written as JSON; --compare prints the speed change against an earlier file.
+# Use --cold to compile into an empty numba cache so first_call_seconds is the real JIT cost.
+#
+#   python benchmark.py --out ../bench/HEAD.json --compare ../bench/previous.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+
+samplerate = 44100.0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the DSP kernels and the fx chains.")
+    parser.add_argument("--out", default="benchmark.json", help="JSON file to write (default: benchmark.json).")
+    parser.add_argument("--seconds", default="1,10,60", help="Comma-separated signal lengths in seconds (default: 1,10,60).")
+    parser.add_argument("--repeats", type=int, default=5, help="Steady-state runs per case (default: 5).")
+    parser.add_argument("--only", default="", help="Comma-separated case names to run (default: all).")
+    parser.add_argument("--precision", default=None, help="Kernel precision (see app.py --precision).")
+    parser.add_argument("--cold", action="store_true", help="Use an empty numba cache to measure real compile times.")
+    parser.add_argument("--compare", help="Earlier results file to compare against.")
+    return parser.parse_args()
+
+def signal(frames, channels, dtype, seed=0):
+    # Noise under a slow envelope, so the dynamics processors actually work.
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    t = np.arange(frames) / samplerate
+    envelope = 0.5 + 0.45 * np.sin(2 * np.pi * 0.5 * t)
+    return (rng.standard_normal((frames, channels)) * 0.3 * envelope[:, None]).astype(dtype)
+
+def cases():
+    """
+    name -> (layouts, setup). setup(frames, channels, dtype) returns the function to time.
+    layouts lists the (channels, dtype) combinations the case accepts.
+    """
+    import numpy as np
+    from dsp_scripts.buss_compressor import buss_compressor
+    from dsp_scripts.distortion_exciter import distortion_exciter
+    from dsp_scripts.saturator import dynamic_saturator
+    from dsp_scripts.stereo_upmix import MonoToStereoUpmixer
+    from dsp_scripts.sum_audio import sum_audio_arrays
+    from dsp_scripts.mixer import mix_stems
+    from fx import process_instrumental, process_vocals, process_buss, instrumental_fxchain, vocal_fxchain
+    from fused_eq import fuse_eq
+
+    all_layouts = [(c, d) for c in (1, 2) for d in (np.float32, np.float64)]
+    mono = [(1, np.float32), (1, np.float64)]
+    stereo = [(2, np.float32), (2, np.float64)]
+
+    def compressor(frames, channels, dtype):
+        audio = signal(frames, channels, dtype)
+        return lambda: buss_compressor(samplerate, audio, -4.8, 4.0, 2000.0, 132.0, 100.0)
+
+    def exciter(frames, channels, dtype):
+        audio = signal(frames, channels, dtype)
+        # In place; re-processing the same buffer costs the same.
+        return lambda: distortion_exciter(audio, samplerate, 16.0, 33.0, 4800.0, -6.0, 0.0)
+
+    def saturator(frames, channels, dtype):
+        audio = signal(frames, channels, dtype)
+        return lambda: dynamic_saturator(audio, 80)
+
+    def upmixer(frames, channels, dtype):
+        audio = signal(frames, channels, dtype)[:, 0].copy()
+        upmix = MonoToStereoUpmixer(samplerate, 100)
+        return lambda: upmix.process_buffer(audio)
+
+    def summer(frames, channels, dtype):
+        audio1 = signal(frames, channels, dtype, seed=1)
+        audio2 = signal(frames, channels, dtype, seed=2)
+        return lambda: sum_audio_arrays(audio1, audio2)
+
+    # Four panned stems (drums, bass, other, vocals) of different lengths into one buffer.
+    def mixer(frames, channels, dtype):
+        stems = [np.ascontiguousarray(signal(frames - 1000 * i, channels, dtype, seed=i).T) for i in range(4)]
+        out = np.empty((2, frames), dtype=np.float32)
+        return lambda: mix_stems(stems, [0.0, -3.0, -6.0, 0.0], [0.0, 0.0, -0.3, 0.2], channels=2, out=out)
+
+    # The chains take (channels, frames) buffers, see the buffer contract in fx.py.
+    def instrumental(frames, channels, dtype):
+        audio = np.ascontiguousarray(signal(frames, channels, dtype).T)
+        # The exciter works in place, so every run gets a fresh copy.
+        return lambda: process_instrumental(audio.copy(), samplerate)
+
+    def vocals(frames, channels, dtype):
+        audio = np.ascontiguousarray(signal(frames, channels, dtype).T)
+        return lambda: process_vocals(audio, samplerate)
+
+    def buss(frames, channels, dtype):
+        audio = np.ascontiguousarray(signal(frames, channels, dtype).T)
+        return lambda: process_buss(audio, samplerate)
+
+    # The instrumental and vocal Pedalboard chains against their fused-EQ versions.
+    def board(builder, fused):
+        def setup(frames, channels, dtype):
+            audio = np.ascontiguousarray(signal(frames, channels, dtype).T)
+            fxchain = fuse_eq(builder()) if fused else builder()
+            return lambda: fxchain(audio, samplerate)
+        return setup
+
+    return {
+        "buss_compressor": (all_layouts, compressor),
+        "distortion_exciter": (all_layouts, exciter),
+        "dynamic_saturator": (all_layouts, saturator),
+        "MonoToStereoUpmixer": (mono, upmixer),
+        "sum_audio_arrays": (all_layouts, summer),
+        "mix_stems": (all_layouts, mixer),
+        "process_instrumental": (mono, instrumental),
+        "process_vocals": (mono, vocals),
+        "process_buss": (stereo, buss),
+        "instrumental_fxchain": (mono, board(instrumental_fxchain, False)),
+        "instrumental_fxchain_fused": (mono, board(instrumental_fxchain, True)),
+        "vocal_fxchain": (mono, board(vocal_fxchain, False)),
+        "vocal_fxchain_fused": (mono, board(vocal_fxchain, True)),
+    }
+
+def measure(run, repeats):
+    """
+    Time the first call, then repeats steady-state calls, then one more under tracemalloc.
+
+    Returns:
+        dict: first_call_seconds, median_seconds, min_seconds, peak_memory_bytes.
+    """
+    start = time.perf_counter()
+    run()
+    first_call = time.perf_counter() - start
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    times.sort()
+
+    # Memory is measured on a separate run, tracemalloc slows allocations down.
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"first_call_seconds": first_call, "median_seconds": times[len(times) // 2],
+            "min_seconds": times[0], "peak_memory_bytes": peak}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, previous):
+    old = {(r["case"], r["channels"], r["dtype"], r["frames"]): r for r in previous["results"]}
+    print(f"Compared with {previous['meta'].get('commit')} (speed ratio > 1 is faster now):")
+    for r in results:
+        key = (r["case"], r["channels"], r["dtype"], r["frames"])
+        if key in old:
+            ratio = old[key]["median_seconds"] / r["median_seconds"]
+            flag = "  <-- slower" if ratio < 0.9 else ""
+            print(f"  {r['case']:22s} {r['channels']}ch {r['dtype']:8s} {r['frames']:9d} frames {ratio:6.2f}x{flag}")
+
+def main():
+    args = parse_args()
+    if args.cold:
+        # Must be set before numba is imported.
+        os.environ["NUMBA_CACHE_DIR"] = tempfile.mkdtemp(prefix="numba_cold_")
+
+    # The kernels with explicit signatures compile (or load from the cache) on import.
+    start = time.perf_counter()
+    import numpy as np
+    import numba
+    from dsp_scripts.precision import set_precision, get_precision
+    if args.precision:
+        set_precision(args.precision)
+    all_cases = cases()
+    import_seconds = time.perf_counter() - start
+
+    only = [name for name in args.only.split(",") if name]
+    lengths = [float(s) for s in args.seconds.split(",")]
+    results = []
+    for name, (layouts, setup) in all_cases.items():
+        if only and name not in only:
+            continue
+        for seconds in lengths:
+            frames = int(seconds * samplerate)
+            for channels, dtype in layouts:
+                m = measure(setup(frames, channels, dtype), args.repeats)
+                m.update({
+                    "case": name, "channels": channels, "dtype": np.dtype(dtype).name, "frames": frames,
+                    "jit_seconds": max(m["first_call_seconds"] - m["median_seconds"], 0.0),
+                    "samples_per_second": frames * channels / m["median_seconds"],
+                    "realtime_factor": seconds / m["median_seconds"],
+                })
+                results.append(m)
+                print(f"{name:22s} {channels}ch {m['dtype']:8s} {seconds:6.1f}s  "
+                      f"{m['realtime_factor']:9.1f}x realtime  {m['samples_per_second'] / 1e6:8.2f} Msamples/s  "
+                      f"jit {m['jit_seconds'] * 1000:8.1f} ms  peak {m['peak_memory_bytes'] / 2**20:7.1f} MiB")
+
+    meta = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": numba.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numba_threads": numba.get_num_threads(),
+        "precision": get_precision(),
+        "cold_cache": args.cold,
+        "import_seconds": import_seconds,
+        "repeats": args.repeats,
+        "samplerate": samplerate,
+    }
+    out_dir = os.path.dirname(args.out)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Imports (kernel compile/cache load): {import_seconds:.2f}s. Results saved to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    sys.exit(main())
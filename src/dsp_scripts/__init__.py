@@ -0,0 +1,110 @@
+# Carmine Silano
+# Custom DSP scripts used by the fx chains.
+#
+# How the numba kernels are compiled:
+#
+# - Kernels that run on audio buffers have explicit signatures (float32, the Pedalboard
+#   buffers, and float64, usually of any layout), so they are compiled at import and a call
+#   with other argument types (an int parameter from a preset, a transposed view) converts
+#   instead of compiling again. Each module notes what its signatures cover.
+# - Everything is compiled with cache=True: the machine code is written next to the sources
+#   (or to $NUMBA_CACHE_DIR) and reused by later runs, so only the very first run pays for
+#   compilation.
+# - nogil lets the kernels run alongside Pedalboard on other threads.
+# - Parallel kernels (parallel=True) have no explicit signatures and compile on first use
+#   instead: compiling one at import sets up numba's thread pool, and a process that forks
+#   afterwards (e.g. batch.py's worker pool) then hangs at exit once a child has run it.
+#
+# warmup() forces every kernel to compile or load from the cache up front, e.g. while
+# building a container image, so the first song a process renders doesn't pay for JIT
+# compilation.
+
+import os
+import time
+import numba
+
+# The parallel kernels get launched from worker threads (fx.process_song). With numba's TBB
+# layer that leaves the process hanging at exit, so prefer OpenMP when it is available.
+# NUMBA_THREADING_LAYER / NUMBA_THREADING_LAYER_PRIORITY in the environment still win.
+if "NUMBA_THREADING_LAYER" not in os.environ and "NUMBA_THREADING_LAYER_PRIORITY" not in os.environ:
+    numba.config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+
+def warmup(precision=None):
+    """
+    Compile (or load from the on-disk cache) every numba kernel for float32 and float64 stereo,
+    in the given precision (see precision.py; default the current setting).
+
+    Returns:
+        dict: Seconds spent per kernel, keyed by kernel name.
+    """
+    import numpy as np
+    timings = {}
+
+    start = time.perf_counter()
+    from dsp_scripts.buss_compressor import buss_compressor, BussCompressor
+    from dsp_scripts.distortion_exciter import distortion_exciter, DistortionExciter
+    from dsp_scripts.stereo_upmix import MonoToStereoUpmixer
+    from dsp_scripts.saturator import dynamic_saturator, PARALLEL_MIN_SAMPLES
+    from dsp_scripts.precision import is_fast
+    from dsp_scripts.sos_eq import SOSEqualizer, peak
+    from dsp_scripts.loudness import LoudnessMeter
+    from dsp_scripts.mixer import mix_stems
+    from dsp_scripts.qc import QCMeter, GainTrace
+    timings["import"] = time.perf_counter() - start
+    approx_sine = is_fast(precision)
+
+    for dtype in (np.float32, np.float64):
+        stereo = np.zeros((16, 2), dtype=dtype)
+        mono = np.zeros((1, 16), dtype=dtype)
+
+        start = time.perf_counter()
+        buss_compressor(44100.0, stereo, -20.0, 4.0, 20000.0, 250.0, 100.0)
+        buss_compressor(44100.0, stereo, -20.0, 4.0, 20000.0, 250.0, 100.0, False)
+        for linked in (True, False):
+            for control_rate in (1, 16):
+                compressor = BussCompressor(44100.0, linked=linked, precision=precision, control_rate=control_rate)
+                compressor.process_block(stereo)
+                # The traced kernel, for QC, on the chains' (channels, frames) buffers.
+                compressor.process_block(np.ascontiguousarray(stereo.T), channels_first=True,
+                                         gains=np.empty((compressor.gain_rows(2), 16), dtype=np.float32))
+        timings["buss_compressor_" + np.dtype(dtype).name] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        distortion_exciter(stereo, 44100.0, 16.4, 33.0, 5000.0, -6.0, 0.0)
+        distortion_exciter(stereo, 44100.0, 16.4, 33.0, 5000.0, -6.0, 0.0, False)
+        for linked in (True, False):
+            exciter = DistortionExciter(44100.0, linked=linked, precision=precision)
+            exciter.process_block(stereo)
+            exciter.process_block(np.ascontiguousarray(stereo.T), channels_first=True,
+                                  gains=np.empty((exciter.gain_rows(2), 16), dtype=np.float32))
+        timings["distortion_exciter_" + np.dtype(dtype).name] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        MonoToStereoUpmixer(44100.0, 1, precision=precision).process_buffer(mono)
+        MonoToStereoUpmixer(44100.0, 1, precision=precision).process_buffer(mono, channels_first=True)
+        timings["process_buffer_stereo_" + np.dtype(dtype).name] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dynamic_saturator(stereo, 100, approx_sine=approx_sine)
+        dynamic_saturator(np.zeros(PARALLEL_MIN_SAMPLES, dtype=dtype), 100, approx_sine=approx_sine)
+        timings["dynamic_saturator_" + np.dtype(dtype).name] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        SOSEqualizer([peak(44100.0, 1000.0, 1.0, 3.0)]).process_block(stereo)
+        timings["sos_cascade_block_" + np.dtype(dtype).name] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        LoudnessMeter(44100.0, 2).process_block(np.ascontiguousarray(stereo.T))
+        timings["loudness_meter_" + np.dtype(dtype).name] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mix_stems([stereo.T, mono], dtype=dtype)
+        mix_stems([np.ascontiguousarray(stereo.T), mono], dtype=dtype)
+        timings["mixer_" + np.dtype(dtype).name] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        QCMeter(44100.0, 2).process_block(np.ascontiguousarray(stereo.T))
+        GainTrace(44100.0).add(np.ones((2, 16), dtype=np.float32))
+        timings["qc_meter_" + np.dtype(dtype).name] = time.perf_counter() - start
+
+    return timings
@@ -0,0 +1,16 @@
+# Run with: python -m dsp_scripts   (from the src directory)
+# Compiles every numba kernel into the on-disk cache and reports how long it took.
+# The first run shows the cold JIT cost, running it again shows the warm cache-load cost.
+
+import time
+start = time.perf_counter()
+from dsp_scripts import warmup
+from dsp_scripts.precision import PRECISIONS
+
+# Every precision, so --precision can be switched without a cold start.
+for precision in PRECISIONS:
+    print(f"[{precision}]")
+    timings = warmup(precision)
+    for name, seconds in timings.items():
+        print(f"{name:32s} {seconds * 1000:9.1f} ms")
+print(f"{'total':32s} {(time.perf_counter() - start) * 1000:9.1f} ms")
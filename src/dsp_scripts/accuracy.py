@@ -0,0 +1,116 @@
+# Run with: python -m dsp_scripts.accuracy   (from the src directory)
+# Renders a synthetic test signal through every kernel in each precision (see precision.py)
+# and compares the result with the float64 reference:
+#
+#   max error   largest absolute sample difference, in dBFS
+#   null test   level of (output - reference) relative to the reference, in dB. This is what
+#               you hear if you flip the polarity of one render and sum it with the other.
+#   speed       realtime factor of the kernel alone (seconds of audio per second of CPU)
+#
+# The reference is float64 audio through the float64 kernels. The other rows feed float32
+# audio, as the fx chains do, so the float64 row shows the cost of the float32 buffers alone.
+# --control-rate K adds buss_compressor/K rows: the compressor with its gain computed every
+# K samples (see buss_compressor.py), against the same per-sample reference.
+
+import time
+import argparse
+import numpy as np
+from dsp_scripts.precision import PRECISIONS, is_fast
+from dsp_scripts.buss_compressor import BussCompressor
+from dsp_scripts.distortion_exciter import DistortionExciter
+from dsp_scripts.stereo_upmix import MonoToStereoUpmixer
+from dsp_scripts.saturator import dynamic_saturator
+
+def test_signal(samplerate, seconds, seed=0):
+    """
+    A stereo (frames, 2) float64 signal that drives the dynamics processors through their whole
+    range: a log sine sweep plus noise, under a slow envelope that swings from -60 to +3 dBFS.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(samplerate * seconds)
+    t = np.arange(n) / samplerate
+    f0, f1 = 40.0, 16000.0
+    sweep = np.sin(2 * np.pi * f0 * seconds / np.log(f1 / f0) * (np.exp(t / seconds * np.log(f1 / f0)) - 1))
+    envelope_db = -28.5 + 31.5 * np.sin(2 * np.pi * 0.7 * t) * np.sin(2 * np.pi * 0.13 * t + 0.5)
+    envelope = 10 ** (envelope_db / 20)
+    left = envelope * (0.7 * sweep + 0.3 * rng.standard_normal(n))
+    right = envelope * (0.5 * sweep + 0.5 * rng.standard_normal(n))
+    return np.stack([left, right], axis=1)
+
+def kernels(samplerate, control_rates=()):
+    """
+    name -> function(audio (frames, 2), precision) returning the processed audio.
+    """
+    def compressor(audio, precision, control_rate=1):
+        return BussCompressor(samplerate, threshold_db=-4.8, ratio=4, attack_us=2000, release_ms=132,
+                              mix_percent=100, precision=precision, control_rate=control_rate).process_block(audio)
+
+    def exciter(audio, precision):
+        return DistortionExciter(samplerate, drive=16, distortion=33, highpass=4800, wet_mix=-6, dry_mix=0,
+                                 precision=precision).process_block(audio.copy())
+
+    def upmixer(audio, precision):
+        return MonoToStereoUpmixer(samplerate, 100, precision=precision).process_buffer(np.ascontiguousarray(audio[:, 0]))
+
+    def saturator(audio, precision):
+        return dynamic_saturator(audio, 80, approx_sine=is_fast(precision))
+
+    found = {"buss_compressor": compressor, "distortion_exciter": exciter,
+             "stereo_upmix": upmixer, "dynamic_saturator": saturator}
+    for k in control_rates:
+        found[f"buss_compressor/{k}"] = lambda audio, precision, k=k: compressor(audio, precision, k)
+    return found
+
+def level_db(x):
+    return 20 * np.log10(max(x, 1e-30))
+
+def compare(output, reference):
+    """
+    Returns:
+        tuple: (max error in dBFS, null test level in dB relative to the reference)
+    """
+    diff = output.astype(np.float64) - reference
+    max_error = np.max(np.abs(diff))
+    null = np.sqrt(np.mean(diff * diff)) / np.sqrt(np.mean(reference * reference))
+    return level_db(max_error), level_db(null)
+
+def run(samplerate=44100.0, seconds=10.0, repeats=3, control_rates=()):
+    """
+    Returns:
+        list: One dict per kernel and precision with max_error_db, null_db and realtime_factor.
+    """
+    audio64 = test_signal(samplerate, seconds)
+    audio32 = audio64.astype(np.float32)
+    results = []
+    found = kernels(samplerate, control_rates)
+    for name, kernel in found.items():
+        # Control-rate rows are measured against the per-sample compressor.
+        reference = found[name.split("/")[0]](audio64, "float64")
+        for precision in PRECISIONS:
+            # First call compiles or loads the kernel from the cache, time the rest.
+            output = kernel(audio32, precision)
+            best = np.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                kernel(audio32, precision)
+                best = min(best, time.perf_counter() - start)
+            max_error_db, null_db = compare(output, reference)
+            results.append({"kernel": name, "precision": precision, "max_error_db": max_error_db,
+                            "null_db": null_db, "realtime_factor": seconds / best})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare every kernel's precision modes with the float64 reference.")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Length of the test signal (default: 10).")
+    parser.add_argument("--samplerate", type=float, default=44100.0)
+    parser.add_argument("--control-rate", type=int, nargs="+", default=[], metavar="K",
+                        help="Also measure the compressor with its gain computed every K samples.")
+    args = parser.parse_args()
+
+    print(f"{'kernel':20s} {'precision':10s} {'max error':>12s} {'null test':>12s} {'speed':>10s}")
+    for r in run(args.samplerate, args.seconds, control_rates=args.control_rate):
+        print(f"{r['kernel']:20s} {r['precision']:10s} {r['max_error_db']:8.1f} dBFS {r['null_db']:9.1f} dB "
+              f"{r['realtime_factor']:9.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Fast float32 approximations of exp and log for the "fast" precision mode (see precision.py).
+#
+# Both work on the IEEE-754 bit pattern: the exponent field gives the integer part of
+# log2 / exp2 for free and a short polynomial handles the mantissa. Coefficients are
+# Chebyshev fits over [0, 1):
+#   fast_log: |error| <= 1.5e-5 in log2 units, i.e. about 1e-5 absolute (8.7e-5 dB)
+#   fast_exp: relative error <= 3.6e-6 from the polynomial (3.1e-5 dB), up to about 7e-6
+#             for large |x| once the float32 rounding of x * log2(e) is included
+# Inputs must be finite; fast_log needs x > 0 and fast_exp flushes results below
+# 2^-126 (about -759 dB) to zero.
+
+import numpy as np
+from llvmlite import ir
+from numba import njit, types
+from numba.extending import intrinsic
+
+LOG2E = 1.4426950408889634
+LN2 = 0.6931471805599453
+
+@intrinsic
+def _float_bits(typingctx, x):
+    # Reinterpret a float32 as its int32 bit pattern.
+    sig = types.int32(types.float32)
+    def codegen(context, builder, signature, args):
+        return builder.bitcast(args[0], ir.IntType(32))
+    return sig, codegen
+
+@intrinsic
+def _bits_float(typingctx, i):
+    # Reinterpret an int32 bit pattern as a float32.
+    sig = types.float32(types.int32)
+    def codegen(context, builder, signature, args):
+        return builder.bitcast(args[0], ir.FloatType())
+    return sig, codegen
+
+@njit(inline='always')
+def fast_log2(x):
+    bits = _float_bits(np.float32(x))
+    exponent = np.float32(((bits >> 23) & 0xFF) - 127)
+    # Mantissa as m - 1 in [0, 1)
+    m = _bits_float((bits & 0x007FFFFF) | 0x3F800000) - np.float32(1.0)
+    p = np.float32(0.0439290999)
+    p = p * m + np.float32(-0.189834429)
+    p = p * m + np.float32(0.411564149)
+    p = p * m + np.float32(-0.707254899)
+    p = p * m + np.float32(1.44159239)
+    p = p * m + np.float32(1.43724989e-05)
+    return exponent + p
+
+@njit(inline='always')
+def fast_exp2(x):
+    # Clamp to the normal float32 range; below 2^-126 the result is flushed to zero.
+    x = min(max(np.float32(x), np.float32(-127.0)), np.float32(127.0))
+    # Round to the nearest integer k, leaving f in [-0.5, 0.5]. The offset keeps the value
+    # positive so the truncating int conversion is a floor (and survives fastmath, unlike
+    # the usual add-and-subtract-a-magic-number trick).
+    k = np.int32(x + np.float32(127.5)) - np.int32(127)
+    f = x - np.float32(k)
+    p = np.float32(0.00967604193)
+    p = p * f + np.float32(0.0559220775)
+    p = p * f + np.float32(0.240221073)
+    p = p * f + np.float32(0.693121029)
+    p = p * f + np.float32(1.00000008)
+    if k < -126:
+        return np.float32(0.0)
+    # Scale by 2^k by adding k to the exponent field.
+    return _bits_float(_float_bits(p) + (k << 23))
+
+@njit(inline='always')
+def fast_log(x):
+    return fast_log2(x) * np.float32(LN2)
+
+@njit(inline='always')
+def fast_exp(x):
+    return fast_exp2(np.float32(x) * np.float32(LOG2E))
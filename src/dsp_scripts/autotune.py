@@ -0,0 +1,142 @@
+# Run with: python -m dsp_scripts.autotune   (from the src directory)
+# Times every exact backend of every effect in the registry (see registry.py), references
+# aside, for float32 and float64 buffers at each size bucket, on this host and at the
+# current numba thread count, and saves the fastest per (effect, dtype, bucket) to the
+# tuning file. From then on the kernels dispatch to the winners. Run it once per host,
+# e.g. next to the warm-up while building a container image, and again with --threads for
+# other thread counts (the segment-parallel workers run with one thread each, see
+# segments.py).
+#
+# Every backend's output is checked against the default backend's before it is timed; one
+# that doesn't match it bit for bit is never picked. --check compares every backend with the
+# effect's reference implementation (see reference.py) instead, and exits with status 1 if
+# any of them is off by more than CHECK_TOLERANCE.
+
+import sys
+import time
+import argparse
+import numpy as np
+import numba
+from dsp_scripts import registry
+
+# Max absolute difference from the reference --check accepts, per dtype of the audio.
+# float32 output rounds to 6e-8 of full scale; the recursive float64 kernels drift from the
+# Python references by a few ulp.
+CHECK_TOLERANCE = {"float32": 1e-6, "float64": 1e-9}
+
+# A backend replaces the default only if it is at least this much faster, so timing noise
+# doesn't flip the choice between near-equal backends.
+MIN_SPEEDUP = 1.05
+
+# Frames --check runs at; the dynamics references are sample loops in Python.
+CHECK_FRAMES = 4096
+
+def load_effects():
+    """
+    Import every kernel module, which registers its effects and backends.
+    """
+    import dsp_scripts.buss_compressor
+    import dsp_scripts.distortion_exciter
+    import dsp_scripts.stereo_upmix
+    import dsp_scripts.saturator
+    import dsp_scripts.mixer
+    return registry.effects()
+
+def call(backend, prepare, output):
+    args = prepare()
+    start = time.perf_counter()
+    result = backend.function(*args)
+    elapsed = time.perf_counter() - start
+    return np.array(output(args, result)), elapsed
+
+def tune(effects=None, buckets=registry.SIZE_BUCKETS, repeats=5, report=print):
+    """
+    Time the exact backends of effects (default: all) at every bucket.
+
+    Returns:
+        dict: {tuning key: winning backend name}.
+    """
+    winners = {}
+    for name, effect in load_effects().items():
+        if (effects and name not in effects) or effect.case is None:
+            continue
+        if sum(backend.exact and not backend.reference for backend in effect.backends.values()) < 2:
+            # Nothing to choose from.
+            continue
+        for dtype in (np.dtype(np.float32), np.dtype(np.float64)):
+            for frames in buckets:
+                prepare, output = effect.case(frames, dtype)
+                default = effect.default(dtype, frames)
+                expected, _ = call(effect.backends[default], prepare, output)
+                timings = {}
+                for backend in effect.backends.values():
+                    if not backend.exact or backend.reference:
+                        # References are the oracle, not candidates.
+                        continue
+                    # The first call compiles or loads the kernel and checks the output.
+                    result, _ = call(backend, prepare, output)
+                    if not np.array_equal(result, expected):
+                        report(f"{name}: {backend.name} differs from {default} on {dtype.name}, skipped")
+                        continue
+                    timings[backend.name] = min(call(backend, prepare, output)[1] for _ in range(repeats))
+                if default not in timings:
+                    continue
+                winner = min(timings, key=timings.get)
+                if timings[default] < timings[winner] * MIN_SPEEDUP:
+                    winner = default
+                winners[registry.tuning_key(name, dtype, frames)] = winner
+                times = "  ".join(f"{backend} {seconds * 1e6:10.1f} us" for backend, seconds in timings.items())
+                report(f"{name:28s} {dtype.name:8s} {frames:8d}  {times}  -> {winner} "
+                       f"({timings[default] / timings[winner]:.2f}x the default)")
+    return winners
+
+def check(effects=None, frames=CHECK_FRAMES, report=print):
+    """
+    Compare every backend of effects (default: all) with the effect's reference.
+
+    Returns:
+        bool: True if every backend is within CHECK_TOLERANCE.
+    """
+    ok = True
+    for name, effect in load_effects().items():
+        ref = registry.reference(name)
+        if (effects and name not in effects) or effect.case is None or ref is None:
+            continue
+        for dtype in (np.dtype(np.float32), np.dtype(np.float64)):
+            prepare, output = effect.case(frames, dtype)
+            expected, _ = call(ref, prepare, output)
+            for backend in effect.backends.values():
+                if backend is ref:
+                    continue
+                result, _ = call(backend, prepare, output)
+                error = np.max(np.abs(result.astype(np.float64) - expected))
+                passed = error <= CHECK_TOLERANCE[dtype.name]
+                ok = ok and passed
+                report(f"{name:28s} {dtype.name:8s} {backend.name:10s} max error {error:9.2e} "
+                       f"{'ok' if passed else 'FAILED'}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick the fastest backend of every kernel on this host.")
+    parser.add_argument("--effects", nargs="+", metavar="EFFECT", help="Only these effects (default: all).")
+    parser.add_argument("--threads", type=int, help="numba thread count to tune for (default: numba's).")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per backend, best counts (default: 5).")
+    parser.add_argument("--out", default=registry.TUNING_FILE,
+                        help=f"Tuning file to update (default: {registry.TUNING_FILE}, or $KERNEL_TUNING_FILE).")
+    parser.add_argument("--check", action="store_true", help="Check the backends against the references instead.")
+    args = parser.parse_args()
+
+    if args.threads:
+        numba.set_num_threads(args.threads)
+    if args.check:
+        sys.exit(0 if check(args.effects) else 1)
+    winners = tune(args.effects, repeats=args.repeats)
+    if args.effects:
+        # Keep the earlier winners of the other effects.
+        previous = registry.load_tuning(args.out).get(numba.get_num_threads(), {})
+        winners = {**previous, **winners}
+    registry.save_tuning(winners, numba.get_num_threads(), args.out)
+    print(f"Saved {len(winners)} winners for {numba.get_num_threads()} thread(s) to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -7,74 +7,132 @@
 import numpy as np
 import math
 import numba
+from dsp_scripts.approx_math import fast_exp, fast_log
+from dsp_scripts.precision import state_dtype, is_fast
+from dsp_scripts import reference
+from dsp_scripts.registry import register_effect, register, dispatch
 
-@numba.njit
-def buss_compressor(samplerate, audio_array, threshold_db=-20.0, ratio=4.0, attack_us=20000.0, release_ms=250.0, mix_percent=100.0):
+# Block kernel signatures (see dsp_scripts/__init__.py): float32/float64 (frames, channels) buffers, float32/float64 state.
+_block_signatures = [
+    numba.void(numba.float64, dtype[:, :], dtype[:, :], real[:],
+               numba.float64, numba.float64, numba.float64, numba.float64, numba.float64)
+    for dtype in (numba.float32, numba.float64)
+    for real in (numba.float32, numba.float64)
+]
+
+# The same for the control-rate kernel, which takes the control period K as well.
+_control_signatures = [
+    numba.void(numba.float64, dtype[:, :], dtype[:, :], real[:],
+               numba.float64, numba.float64, numba.float64, numba.float64, numba.float64, numba.int64)
+    for dtype in (numba.float32, numba.float64)
+    for real in (numba.float32, numba.float64)
+]
+
+# The traced kernel's: a row of state per detector, control period, float32 gains per detector.
+_traced_signatures = [
+    numba.void(numba.float64, dtype[:, :], dtype[:, :], real[:, :],
+               numba.float64, numba.float64, numba.float64, numba.float64, numba.float64, numba.int64, numba.float32[:, :])
+    for dtype in (numba.float32, numba.float64)
+    for real in (numba.float32, numba.float64)
+]
+
+@numba.njit(cache=True, nogil=True)
+def buss_compressor(samplerate, audio_array, threshold_db=-20.0, ratio=4.0, attack_us=20000.0, release_ms=250.0, mix_percent=100.0, linked=True, channels_first=False, out=None):
     """
     Apply compression using dynamic range compression with JIT acceleration.
     
     Parameters:
         samplerate (int): The sample rate of the audio.
-        audio_array (np.ndarray): Stereo audio signal (Nx2).
+        audio_array (np.ndarray): Audio signal (NxC, e.g. Nx2 stereo), or CxN with channels_first=True.
         threshold_db (float): Compression threshold in dB.
         ratio (float): Compression ratio.
         attack_us (float): Attack time in microseconds.
         release_ms (float): Release time in milliseconds.
         mix_percent (float): Wet/dry mix percentage.
+        linked (bool): True: one detector on the loudest channel (the original stereo behavior).
+                       False: every channel (or stem) is compressed on its own, one channel per core.
+        channels_first (bool): Set when audio_array is laid out CxN, as Pedalboard returns it.
+        out (np.ndarray): Array with audio_array's shape and dtype to write the result into;
+                          out=audio_array compresses in place. A new one is made if None.
     
     Returns:
-        np.ndarray: The compressed audio signal.
+        np.ndarray: The compressed audio signal, in the same layout as the input (out, if given).
     """
+    if out is None:
+        output_audio = np.empty_like(audio_array)
+    else:
+        output_audio = out
+    frames_in = audio_array.T if channels_first else audio_array
+    frames_out = output_audio.T if channels_first else output_audio
+    if linked:
+        state = np.zeros(2, dtype=np.float64)
+        buss_compressor_block(samplerate, frames_in, frames_out, state, threshold_db, ratio, attack_us, release_ms, mix_percent)
+    else:
+        state = np.zeros((frames_in.shape[1], 2), dtype=np.float64)
+        buss_compressor_unlinked(samplerate, frames_in, frames_out, state, threshold_db, ratio, attack_us, release_ms, mix_percent)
+    return output_audio
+
+@numba.njit(inline='always')
+def _compress(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, approx, gains):
+    # Working precision, taken from the state array. Coefficients are computed in float64
+    # and then rounded to it. The gain of every sample goes to gains unless it is empty.
+    real = state.dtype.type
+    zero = real(0.0)
+
     # Conversion constants
-    log2db = 8.6858896380650365530225783783321  # linear to dB
-    db2log = 0.11512925464970228420089957273422  # dB to linear
+    log2db = real(8.6858896380650365530225783783321)  # linear to dB
+    db2log = real(0.11512925464970228420089957273422)  # dB to linear
 
     # Convert times and mix
     attack_time = attack_us / 1000000.0  # seconds
     release_time = release_ms / 1000.0     # seconds
-    mix = mix_percent / 100.0              # fraction
+    mix = real(mix_percent / 100.0)        # fraction
+    dry = real(1.0 - mix_percent / 100.0)
 
     # Coefficients for smoothing (attack and release)
-    atcoef = math.exp(-1.0 / (attack_time * samplerate))
-    relcoef = math.exp(-1.0 / (release_time * samplerate))
+    atcoef = real(math.exp(-1.0 / (attack_time * samplerate)))
+    relcoef = real(math.exp(-1.0 / (release_time * samplerate)))
 
     # Compression threshold in linear scale
-    threshv = math.exp(threshold_db * db2log)
+    threshv = real(math.exp(threshold_db * 0.11512925464970228420089957273422))
+
+    # Gain reduction slope
+    ratio_m1 = real(ratio - 1.0)
+    ratio_r = real(ratio)
 
     n_samples = audio_array.shape[0]
-    output_audio = np.empty_like(audio_array)
+    n_channels = audio_array.shape[1]
 
-    # Initialize state variables
-    rundb = 0.0   # running average level in dB
-    runave = 0.0  # running average of the squared level
+    # Restore state variables
+    rundb = state[0]   # running average level in dB
+    runave = state[1]  # running average of the squared level
+    record = gains.shape[0] > 0
 
     for i in range(n_samples):
-        # Retrieve current sample for both channels
-        ospl0 = audio_array[i, 0]
-        ospl1 = audio_array[i, 1]
-        aspl0 = abs(ospl0)
-        aspl1 = abs(ospl1)
-
-        # Compute signal level (squared maximum of both channels)
-        if aspl0 > aspl1:
-            maxspl = aspl0 * aspl0
-        else:
-            maxspl = aspl1 * aspl1
+        # Compute signal level (squared maximum of all channels)
+        aspl = abs(audio_array[i, 0])
+        for ch in range(1, n_channels):
+            if abs(audio_array[i, ch]) > aspl:
+                aspl = abs(audio_array[i, ch])
+        maxspl = aspl * aspl
 
         # Smoothing of the signal level
         runave = maxspl + relcoef * (runave - maxspl)
         # Ensure non-negative for sqrt:
-        if runave < 0:
-            runave = 0.0
+        if runave < zero:
+            runave = zero
         det = math.sqrt(runave)
 
         # Compute gain reduction in dB (only if above threshold)
-        if det <= 0:
-            overdb = 0.0
+        if det <= zero:
+            overdb = zero
         else:
-            overdb = log2db * math.log(det / threshv)
-            if overdb < 0:
-                overdb = 0.0
+            if approx:
+                overdb = log2db * fast_log(det / threshv)
+            else:
+                overdb = log2db * math.log(det / threshv)
+            if overdb < zero:
+                overdb = zero
 
         # Attack/release smoothing for gain reduction
         if overdb > rundb:
@@ -83,11 +141,366 @@ def buss_compressor(samplerate, audio_array, threshold_db=-20.0, ratio=4.0, atta
             rundb = overdb + relcoef * (rundb - overdb)
 
         # Compute gain reduction factor
-        gr = -rundb * (ratio - 1.0) / ratio
-        grv = math.exp(gr * db2log)
+        gr = -rundb * ratio_m1 / ratio_r
+        if approx:
+            grv = fast_exp(gr * db2log)
+        else:
+            grv = math.exp(gr * db2log)
+        if record:
+            gains[i] = grv
 
         # Mix dry and compressed signals
-        output_audio[i, 0] = ospl0 * grv * mix + ospl0 * (1.0 - mix)
-        output_audio[i, 1] = ospl1 * grv * mix + ospl1 * (1.0 - mix)
+        for ch in range(n_channels):
+            ospl = audio_array[i, ch]
+            output_audio[i, ch] = ospl * grv * mix + ospl * dry
 
-    return output_audio
+    # Save state for the next block
+    state[0] = rundb
+    state[1] = runave
+
+@numba.njit(_block_signatures, cache=True, nogil=True)
+def buss_compressor_block(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent):
+    """
+    Compress one block of audio, carrying the detector state across calls.
+
+    Running this over consecutive blocks with the same state array gives exactly
+    the same result as running buss_compressor over the whole signal.
+
+    Parameters:
+        samplerate (int): The sample rate of the audio.
+        audio_array (np.ndarray): Audio block (NxC).
+        output_audio (np.ndarray): Output block, same shape as audio_array.
+        state (np.ndarray): Array of length 2 holding [rundb, runave]. Its dtype sets the
+                            precision of the math: float64 (exact) or float32.
+        threshold_db, ratio, attack_us, release_ms, mix_percent: see buss_compressor.
+    """
+    _compress(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, False,
+              np.empty(0, dtype=np.float32))
+
+@numba.njit(_block_signatures, cache=True, nogil=True, fastmath=True)
+def buss_compressor_block_fast(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent):
+    """
+    buss_compressor_block for the "fast" precision: fastmath and the approximate exp/log
+    from approx_math.py. Use with a float32 state.
+    """
+    _compress(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, True,
+              np.empty(0, dtype=np.float32))
+
+# Control rate. At the attack and release times a buss compressor uses, the gain moves far
+# slower than the audio: with control_rate=K the level detector still follows every sample,
+# but the log, the attack/release smoothing and the exp run once every K samples, and the
+# gain is ramped linearly from one control point to the next. That cuts the transcendental
+# math K-fold. The ramp trails the per-sample gain by about K/2 samples, which sets the
+# error. Null-test level against the per-sample float64 compressor and kernel speed, on
+# python -m dsp_scripts.accuracy's test signal (2 ms attack, 132 ms release, 44.1 kHz):
+#
+#   K     null test   max error    float64 speed
+#   1     -150 dB     -136 dBFS     570x realtime
+#   4      -84 dB      -66 dBFS    1350x
+#   8      -77 dB      -58 dBFS    1730x
+#   16     -71 dB      -52 dBFS    2050x
+#   32     -64 dB      -45 dBFS    2110x
+#
+# The null test loses about 6.5 dB per doubling of K, and float32/fast give the same
+# figures from K = 4 up. K = 16 keeps the residual more than 70 dB below the signal at
+# 3.6x the speed; past that the per-sample detector and mix dominate.
+
+def new_control_state(n_rows, dtype):
+    # [rundb, runave, gain at the last control point, gain at the next one, phase] per row.
+    state = np.zeros((n_rows, 5), dtype=dtype)
+    state[:, 2] = 1.0
+    state[:, 3] = 1.0
+    return state
+
+@numba.njit(inline='always')
+def _compress_control(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate, approx, gains):
+    # _compress with the gain computed every control_rate samples, see above.
+    real = state.dtype.type
+    zero = real(0.0)
+
+    log2db = real(8.6858896380650365530225783783321)
+    db2log = real(0.11512925464970228420089957273422)
+
+    attack_time = attack_us / 1000000.0
+    release_time = release_ms / 1000.0
+    mix = real(mix_percent / 100.0)
+    dry = real(1.0 - mix_percent / 100.0)
+
+    # The detector runs per sample; the gain smoothing takes control_rate samples per step.
+    relcoef = real(math.exp(-1.0 / (release_time * samplerate)))
+    atcoef_k = real(math.exp(-control_rate / (attack_time * samplerate)))
+    relcoef_k = real(math.exp(-control_rate / (release_time * samplerate)))
+
+    threshv = real(math.exp(threshold_db * 0.11512925464970228420089957273422))
+    ratio_m1 = real(ratio - 1.0)
+    ratio_r = real(ratio)
+    step = real(1.0 / control_rate)
+
+    n_samples = audio_array.shape[0]
+    n_channels = audio_array.shape[1]
+
+    rundb = state[0]
+    runave = state[1]
+    gain_from = state[2]
+    gain_to = state[3]
+    phase = int(state[4])
+    record = gains.shape[0] > 0
+
+    for i in range(n_samples):
+        aspl = abs(audio_array[i, 0])
+        for ch in range(1, n_channels):
+            if abs(audio_array[i, ch]) > aspl:
+                aspl = abs(audio_array[i, ch])
+        maxspl = aspl * aspl
+        runave = maxspl + relcoef * (runave - maxspl)
+        if runave < zero:
+            runave = zero
+
+        if phase == 0:
+            # Control point: the gain the detector calls for now becomes the ramp's target.
+            det = math.sqrt(runave)
+            if det <= zero:
+                overdb = zero
+            else:
+                if approx:
+                    overdb = log2db * fast_log(det / threshv)
+                else:
+                    overdb = log2db * math.log(det / threshv)
+                if overdb < zero:
+                    overdb = zero
+            if overdb > rundb:
+                rundb = overdb + atcoef_k * (rundb - overdb)
+            else:
+                rundb = overdb + relcoef_k * (rundb - overdb)
+            gr = -rundb * ratio_m1 / ratio_r
+            gain_from = gain_to
+            if approx:
+                gain_to = fast_exp(gr * db2log)
+            else:
+                gain_to = math.exp(gr * db2log)
+
+        phase += 1
+        grv = gain_from + (gain_to - gain_from) * (real(phase) * step)
+        if phase == control_rate:
+            phase = 0
+        if record:
+            gains[i] = grv
+
+        for ch in range(n_channels):
+            ospl = audio_array[i, ch]
+            output_audio[i, ch] = ospl * grv * mix + ospl * dry
+
+    state[0] = rundb
+    state[1] = runave
+    state[2] = gain_from
+    state[3] = gain_to
+    state[4] = phase
+
+@numba.njit(_control_signatures, cache=True, nogil=True)
+def buss_compressor_control_block(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate):
+    """
+    buss_compressor_block with the gain computed every control_rate samples and ramped in
+    between. state is a row of new_control_state; the ramp's phase is part of it, so
+    consecutive blocks of any size give the same result as one call.
+    """
+    _compress_control(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate, False,
+                      np.empty(0, dtype=np.float32))
+
+@numba.njit(_control_signatures, cache=True, nogil=True, fastmath=True)
+def buss_compressor_control_block_fast(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate):
+    """
+    buss_compressor_control_block for the "fast" precision.
+    """
+    _compress_control(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate, True,
+                      np.empty(0, dtype=np.float32))
+
+@numba.njit(cache=True, nogil=True, parallel=True)
+def buss_compressor_unlinked(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, fast=False, control_rate=1):
+    """
+    Compress every channel of an NxC block with its own detector, one channel per core.
+    state is a Cx2 array, one [rundb, runave] row per channel. fast picks buss_compressor_block_fast.
+    With control_rate > 1 state comes from new_control_state(C) instead, see buss_compressor_control_block.
+    """
+    for ch in numba.prange(audio_array.shape[1]):
+        if control_rate > 1:
+            if fast:
+                buss_compressor_control_block_fast(samplerate, audio_array[:, ch:ch + 1], output_audio[:, ch:ch + 1], state[ch],
+                                                   threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate)
+            else:
+                buss_compressor_control_block(samplerate, audio_array[:, ch:ch + 1], output_audio[:, ch:ch + 1], state[ch],
+                                              threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate)
+        elif fast:
+            buss_compressor_block_fast(samplerate, audio_array[:, ch:ch + 1], output_audio[:, ch:ch + 1], state[ch],
+                                       threshold_db, ratio, attack_us, release_ms, mix_percent)
+        else:
+            buss_compressor_block(samplerate, audio_array[:, ch:ch + 1], output_audio[:, ch:ch + 1], state[ch],
+                                  threshold_db, ratio, attack_us, release_ms, mix_percent)
+
+def buss_compressor_unlinked_serial(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, fast=False, control_rate=1):
+    """
+    buss_compressor_unlinked on one thread, a channel at a time. Same output; no thread
+    start-up cost, which wins on short blocks and few cores.
+    """
+    if control_rate > 1:
+        block = buss_compressor_control_block_fast if fast else buss_compressor_control_block
+        extra = (control_rate,)
+    else:
+        block = buss_compressor_block_fast if fast else buss_compressor_block
+        extra = ()
+    for ch in range(audio_array.shape[1]):
+        block(samplerate, audio_array[:, ch:ch + 1], output_audio[:, ch:ch + 1], state[ch],
+              threshold_db, ratio, attack_us, release_ms, mix_percent, *extra)
+
+@numba.njit(inline='always')
+def _compress_traced(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate, gains, approx):
+    # One detector per row of state and gains: a single row is linked over every channel,
+    # otherwise row c compresses channel c.
+    linked = state.shape[0] == 1
+    for row in range(state.shape[0]):
+        audio = audio_array if linked else audio_array[:, row:row + 1]
+        output = output_audio if linked else output_audio[:, row:row + 1]
+        if control_rate > 1:
+            _compress_control(samplerate, audio, output, state[row], threshold_db, ratio, attack_us, release_ms, mix_percent,
+                              control_rate, approx, gains[row])
+        else:
+            _compress(samplerate, audio, output, state[row], threshold_db, ratio, attack_us, release_ms, mix_percent,
+                      approx, gains[row])
+
+@numba.njit(_traced_signatures, cache=True, nogil=True)
+def buss_compressor_traced(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate, gains):
+    """
+    Compress an NxC block as the block kernels do, and write the gain applied to every
+    sample to gains, for QC. The output is the same as the untraced kernels'.
+
+    Parameters:
+        state (np.ndarray): One row per detector: a single row ([rundb, runave], or a
+                            new_control_state row with control_rate > 1) for linked, a row
+                            per channel for unlinked.
+        gains (np.ndarray): float32, (state rows, N).
+    """
+    _compress_traced(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent,
+                     control_rate, gains, False)
+
+@numba.njit(_traced_signatures, cache=True, nogil=True, fastmath=True)
+def buss_compressor_traced_fast(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent, control_rate, gains):
+    """
+    buss_compressor_traced for the "fast" precision.
+    """
+    _compress_traced(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent,
+                     control_rate, gains, True)
+
+def _output(audio_array, out):
+    # The kernels read every channel of a sample before writing it, so out may be the input.
+    if out is None:
+        return np.empty_like(audio_array)
+    if out.shape != audio_array.shape or out.dtype != audio_array.dtype:
+        raise ValueError("out must have the same shape and dtype as the audio.")
+    return out
+
+class BussCompressor:
+    def __init__(self, samplerate, threshold_db=-20.0, ratio=4.0, attack_us=20000.0, release_ms=250.0, mix_percent=100.0, linked=True, precision=None, control_rate=1):
+        """
+        Stateful buss compressor for block-by-block (streaming) processing.
+
+        Parameters are the same as buss_compressor. The state is sized from the
+        channel count of the first block. precision is "float64", "float32" or
+        "fast" (see precision.py); None uses the pipeline-wide setting.
+        control_rate (K) computes the gain every K samples instead of every sample
+        (see buss_compressor_control_block); 1 is the per-sample compressor.
+        """
+        if int(control_rate) != control_rate or control_rate < 1:
+            raise ValueError(f"control_rate must be a whole number of samples >= 1, not {control_rate!r}.")
+        self.samplerate = samplerate
+        self.threshold_db = threshold_db
+        self.ratio = ratio
+        self.attack_us = attack_us
+        self.release_ms = release_ms
+        self.mix_percent = mix_percent
+        self.linked = linked
+        self.control_rate = int(control_rate)
+        self.dtype = state_dtype(precision)
+        self.fast = is_fast(precision)
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def gain_rows(self, channels):
+        # Rows of the gains process_block() reports: one per detector.
+        return 1 if self.linked else channels
+
+    def process_block(self, audio_array, channels_first=False, out=None, gains=None):
+        """
+        Compress the next block of an NxC signal (CxN with channels_first=True).
+
+        Parameters:
+            out (np.ndarray): Array with audio_array's shape and dtype to write the result
+                              into; out=audio_array compresses in place. A new one is made if None.
+            gains (np.ndarray): If given, a float32 (gain_rows(C), N) array that receives the
+                                linear gain applied to every sample, see buss_compressor_traced.
+
+        Returns:
+            np.ndarray: The compressed block, in the same layout as the input (out, if given).
+        """
+        output_audio = _output(audio_array, out)
+        frames_in = audio_array.T if channels_first else audio_array
+        frames_out = output_audio.T if channels_first else output_audio
+        if gains is not None:
+            if self.state is None:
+                rows = self.gain_rows(frames_in.shape[1])
+                self.state = (new_control_state(rows, self.dtype) if self.control_rate > 1 else
+                              np.zeros(2 if self.linked else (rows, 2), dtype=self.dtype))
+            # The linked per-sample state is a single row.
+            state = self.state if self.state.ndim == 2 else self.state[np.newaxis]
+            traced = buss_compressor_traced_fast if self.fast else buss_compressor_traced
+            traced(self.samplerate, frames_in, frames_out, state, self.threshold_db, self.ratio,
+                   self.attack_us, self.release_ms, self.mix_percent, self.control_rate, gains)
+        elif self.control_rate > 1:
+            if self.state is None:
+                self.state = new_control_state(1 if self.linked else frames_in.shape[1], self.dtype)
+            if self.linked:
+                block = buss_compressor_control_block_fast if self.fast else buss_compressor_control_block
+                block(self.samplerate, frames_in, frames_out, self.state[0],
+                      self.threshold_db, self.ratio, self.attack_us, self.release_ms, self.mix_percent, self.control_rate)
+            else:
+                unlinked = dispatch("buss_compressor_unlinked", frames_in.dtype, frames_in.shape[0])
+                unlinked(self.samplerate, frames_in, frames_out, self.state, self.threshold_db, self.ratio,
+                         self.attack_us, self.release_ms, self.mix_percent, self.fast, self.control_rate)
+        elif self.linked:
+            if self.state is None:
+                self.state = np.zeros(2, dtype=self.dtype)
+            if self.fast:
+                block = buss_compressor_block_fast
+            else:
+                block = dispatch("buss_compressor", frames_in.dtype, frames_in.shape[0])
+            block(self.samplerate, frames_in, frames_out, self.state,
+                  self.threshold_db, self.ratio, self.attack_us, self.release_ms, self.mix_percent)
+        else:
+            if self.state is None:
+                self.state = np.zeros((frames_in.shape[1], 2), dtype=self.dtype)
+            unlinked = dispatch("buss_compressor_unlinked", frames_in.dtype, frames_in.shape[0])
+            unlinked(self.samplerate, frames_in, frames_out, self.state,
+                     self.threshold_db, self.ratio, self.attack_us, self.release_ms, self.mix_percent, self.fast)
+        return output_audio
+
+# Backends, see registry.py. The linked per-sample compressor has one compiled backend and
+# the reference; the unlinked one runs its channels in parallel or one after the other.
+def _case(linked):
+    def case(frames, dtype):
+        rng = np.random.default_rng(0)
+        audio = (rng.standard_normal((frames, 2)) * np.linspace(0.05, 1.5, frames)[:, np.newaxis]).astype(dtype)
+
+        def prepare():
+            state = np.zeros(2 if linked else (2, 2), dtype=np.float64)
+            return (44100.0, audio, np.empty_like(audio), state, -4.8, 4.0, 2000.0, 132.0, 100.0)
+        return prepare, lambda args, result: args[2]
+    return case
+
+register_effect("buss_compressor", lambda dtype, frames: "numba", _case(True))
+register("buss_compressor", "numba", buss_compressor_block)
+register("buss_compressor", "python", reference.compress, exact=False, reference=True)
+
+register_effect("buss_compressor_unlinked", lambda dtype, frames: "parallel", _case(False))
+register("buss_compressor_unlinked", "parallel", buss_compressor_unlinked)
+register("buss_compressor_unlinked", "serial", buss_compressor_unlinked_serial)
+register("buss_compressor_unlinked", "python", reference.compress_unlinked, exact=False, reference=True)
@@ -1,22 +1,46 @@
 # Carmine Silano
 # Feb 24, 2025
 # Implement a distortion exciter effect that applies dynamic gain control combined with filtering.
-# The effect is applied to a stereo audio signal and returns the processed audio.
+# The effect is applied to a stereo (or any N-channel) audio signal and returns the processed audio.
 # The technique is based on the work of Michael Gruhn.
 # Rewritten to use Numba for JIT acceleration which made a HUGE difference in speed.
 
+import math
 import numpy as np
-from numba import njit
+from numba import njit, prange, types
+from dsp_scripts.approx_math import fast_exp, fast_log
+from dsp_scripts.precision import state_dtype, is_fast
+from dsp_scripts import reference
+from dsp_scripts.registry import register_effect, register, dispatch
 
-@njit
-def distortion_exciter(audio, srate, drive=16.4, distortion=33, highpass=5000, wet_mix=-6, dry_mix=0):
+# Block kernel signatures (see dsp_scripts/__init__.py): float32/float64 (frames, channels) buffers, float32/float64 state.
+_block_signatures = [
+    dtype[:, :](dtype[:, :], types.float64, real[:],
+                types.float64, types.float64, types.float64, types.float64, types.float64)
+    for dtype in (types.float32, types.float64)
+    for real in (types.float32, types.float64)
+]
+
+# The traced kernel's: a row of state per gain follower, float32 gains per follower.
+_traced_signatures = [
+    dtype[:, :](dtype[:, :], types.float64, real[:, :],
+                types.float64, types.float64, types.float64, types.float64, types.float64, types.float32[:, :])
+    for dtype in (types.float32, types.float64)
+    for real in (types.float32, types.float64)
+]
+
+@njit(cache=True, nogil=True)
+def distortion_exciter(audio, srate, drive=16.4, distortion=33, highpass=5000, wet_mix=-6, dry_mix=0, linked=True, channels_first=False, out=None):
     """
     Process a stereo audio signal by applying dynamic gain control combined with filtering,
     resulting in a mix of the original (dry) and processed (wet) signals.
+
+    The audio is processed in place and the same array is returned, unless out is given.
     
     Parameters:
       audio    : ndarray
-                 Input stereo audio array with shape (n_samples, 2).
+                 Input audio array with shape (n_samples, n_channels), e.g. (n_samples, 2)
+                 for stereo, or (n_channels, n_samples) with channels_first=True.
       srate    : int or float
                  The sampling rate in Hz.
       drive    : float, optional
@@ -29,10 +53,63 @@ def distortion_exciter(audio, srate, drive=16.4, distortion=33, highpass=5000, w
                  Wet signal mix level in dB. (Default is -6 dB)
       dry_mix  : float, optional
                  Dry (unprocessed) signal mix level in dB. (Default is 0 dB)
+      linked   : bool, optional
+                 True: one gain follower driven by the loudest channel (the original stereo
+                 behavior). False: every channel gets its own follower and the channels are
+                 processed in parallel, one per core.
+      channels_first : bool, optional
+                 Set when audio is laid out (n_channels, n_samples), as Pedalboard returns it.
+      out      : ndarray, optional
+                 Array with the same shape and dtype as audio to write the result into,
+                 leaving audio as it is.
                  
     Returns:
-      ndarray: Processed stereo audio with the same shape as the input.
+      ndarray: Processed audio with the same shape as the input (audio, or out if given).
     """
+    if out is not None:
+        out[:] = audio
+        audio = out
+    frames = audio.T if channels_first else audio
+    if linked:
+        distortion_exciter_block(frames, srate, new_state(frames.shape[1]), drive, distortion, highpass, wet_mix, dry_mix)
+    else:
+        distortion_exciter_unlinked(frames, srate, new_unlinked_state(frames.shape[1]), drive, distortion, highpass, wet_mix, dry_mix)
+    return audio
+
+@njit(cache=True, nogil=True)
+def new_state(n_channels):
+    # [gain, stage 1 filter per channel, stage 2 per channel, stage 3 per channel]
+    state = np.zeros(1 + 3 * n_channels, dtype=np.float64)
+    state[0] = 1.0
+    return state
+
+@njit(cache=True, nogil=True)
+def new_unlinked_state(n_channels):
+    # One single-channel state per row.
+    state = np.zeros((n_channels, 4), dtype=np.float64)
+    state[:, 0] = 1.0
+    return state
+
+@njit(inline='always')
+def _lowering_level(gain, release, thresh, threshDB, ratio, c):
+    # The loudest sample so far sets the gain: it is min(gain, release * seekGain) and seekGain
+    # falls as the level rises, so a sample only changes it if it is louder than the level
+    # where release * seekGain == gain. Below that level the exp/log can be skipped with no
+    # change to the output. The level is lowered by 0.1% to stay clear of rounding (the
+    # precise test is still made for the samples in between).
+    if release < gain:
+        return -1.0
+    if gain <= 0.0:
+        return np.inf
+    level = (gain / (release * np.exp(threshDB * (1.0 - ratio) / c))) ** (1.0 / (ratio - 1.0))
+    return max(level, thresh) * (1.0 - 1e-3)
+
+@njit(inline='always')
+def _excite(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, approx, gains):
+    # Working precision, taken from the state array. Coefficients are computed in float64
+    # and then rounded to it. The wet gain of every sample goes to gains unless it is empty.
+    real = state.dtype.type
+
     # Constants for decibel/exponential calculations.
     c = 8.65617025
     threshDB = -drive
@@ -49,57 +126,313 @@ def distortion_exciter(audio, srate, drive=16.4, distortion=33, highpass=5000, w
     # Compute wet and dry mix factors.
     wet = np.exp(wet_mix / c) / np.exp((threshDB - threshDB * ratio) / c)
     dry = np.exp(dry_mix / c)
-    
-    gain = 1.0
-    seekGain = 1.0
 
-    # Initialize filter state variables for three filter stages.
-    t00 = 0.0
-    t01 = 0.0
-    t10 = 0.0
-    t11 = 0.0
-    t20 = 0.0
-    t21 = 0.0
+    # Round everything used per sample to the working precision.
+    c = real(c)
+    threshDB = real(threshDB)
+    thresh = real(thresh)
+    ratio = real(ratio)
+    release = real(release)
+    blp = real(blp)
+    alp = real(alp)
+    wet = real(wet)
+    dry = real(dry)
+    one = real(1.0)
+    
+    gain = state[0]
+    seekGain = one
+    record = gains.shape[0] > 0
+    level = _lowering_level(gain, release, thresh, threshDB, ratio, c)
 
     n_samples = audio.shape[0]
+    n_channels = audio.shape[1]
+
+    # Restore filter state variables for three filter stages, t[stage, channel].
+    t = np.empty((3, n_channels), dtype=state.dtype)
+    for stage in range(3):
+        for ch in range(n_channels):
+            t[stage, ch] = state[1 + stage * n_channels + ch]
+    s = np.empty(n_channels, dtype=state.dtype)
+
     for i in range(n_samples):
-        # Extract left and right channel samples.
-        spl0 = audio[i, 0]
-        spl1 = audio[i, 1]
-        
-        # --- Filter Stage 1 ---
-        t00 = alp * spl0 - blp * t00
-        s0 = t00
-        t01 = alp * spl1 - blp * t01
-        s1 = t01
-        
-        # --- Filter Stage 2 ---
-        t10 = alp * s0 - blp * t10
-        s0 = t10
-        t11 = alp * s1 - blp * t11
-        s1 = t11
-        
-        # --- Filter Stage 3 ---
-        t20 = alp * s0 - blp * t20
-        s0 = spl0 - t20
-        t21 = alp * s1 - blp * t21
-        s1 = spl1 - t21
-        
-        # Compute the instantaneous amplitude.
-        rms = abs(spl0)
-        if abs(spl1) > rms:
-            rms = abs(spl1)
+        for ch in range(n_channels):
+            spl = audio[i, ch]
+
+            # --- Filter Stage 1 ---
+            t[0, ch] = alp * spl - blp * t[0, ch]
+
+            # --- Filter Stage 2 ---
+            t[1, ch] = alp * t[0, ch] - blp * t[1, ch]
+
+            # --- Filter Stage 3 ---
+            t[2, ch] = alp * t[1, ch] - blp * t[2, ch]
+            s[ch] = spl - t[2, ch]
         
-        # Compute the desired gain based on the signal amplitude.
-        if rms > thresh:
-            seekGain = np.exp((threshDB + (np.log(rms) * c - threshDB) * ratio) / c) / rms
-        else:
-            seekGain = 1.0
+        # Compute the instantaneous amplitude (loudest channel).
+        rms = abs(audio[i, 0])
+        for ch in range(1, n_channels):
+            if abs(audio[i, ch]) > rms:
+                rms = abs(audio[i, ch])
         
-        gain = min(gain, release * seekGain)
+        # Compute the desired gain based on the signal amplitude, for the samples loud
+        # enough to lower the gain (see _lowering_level).
+        if rms > level:
+            if rms > thresh:
+                if approx:
+                    seekGain = fast_exp((threshDB + (fast_log(rms) * c - threshDB) * ratio) / c) / rms
+                else:
+                    seekGain = np.exp((threshDB + (np.log(rms) * c - threshDB) * ratio) / c) / rms
+            else:
+                seekGain = one
+            if release * seekGain < gain:
+                gain = release * seekGain
+                level = _lowering_level(gain, release, thresh, threshDB, ratio, c)
+        if record:
+            gains[i] = gain
         
         # Mix the dry (original) and wet (processed) signals.
-        audio[i, 0] = spl0 * dry + s0 * gain * wet
-        audio[i, 1] = spl1 * dry + s1 * gain * wet
+        for ch in range(n_channels):
+            audio[i, ch] = audio[i, ch] * dry + s[ch] * gain * wet
+
+    # Save state for the next block.
+    state[0] = gain
+    for stage in range(3):
+        for ch in range(n_channels):
+            state[1 + stage * n_channels + ch] = t[stage, ch]
+
+    return audio
+
+@njit(_block_signatures, cache=True, nogil=True)
+def distortion_exciter_block(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix):
+    """
+    Process one block of a signal in place, carrying the gain and filter
+    state across calls so consecutive blocks match a whole-signal render exactly.
+
+    Parameters:
+      audio    : ndarray
+                 Audio block with shape (n_samples, n_channels). Overwritten in place.
+      srate    : int or float
+                 The sampling rate in Hz.
+      state    : ndarray
+                 Array from new_state(n_channels): the gain followed by the three
+                 filter stages for every channel. For stereo that is
+                 [gain, t00, t01, t10, t11, t20, t21]. Its dtype sets the precision
+                 of the math: float64 (exact) or float32.
+      drive, distortion, highpass, wet_mix, dry_mix : see distortion_exciter.
+
+    Returns:
+      ndarray: The processed block (the same array as audio).
+    """
+    return _excite(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, False, np.empty(0, dtype=np.float32))
+
+@njit(_block_signatures, cache=True, nogil=True, fastmath=True)
+def distortion_exciter_block_fast(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix):
+    """
+    distortion_exciter_block for the "fast" precision: fastmath and the approximate exp/log
+    from approx_math.py. Use with a float32 state.
+    """
+    return _excite(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, True, np.empty(0, dtype=np.float32))
+
+@njit(cache=True, nogil=True, parallel=True)
+def distortion_exciter_unlinked(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, fast=False):
+    """
+    Process every channel of a (n_samples, n_channels) block with its own gain follower,
+    one channel per core. state comes from new_unlinked_state(n_channels). In place.
+    fast picks distortion_exciter_block_fast.
+    """
+    for ch in prange(audio.shape[1]):
+        if fast:
+            distortion_exciter_block_fast(audio[:, ch:ch + 1], srate, state[ch], drive, distortion, highpass, wet_mix, dry_mix)
+        else:
+            distortion_exciter_block(audio[:, ch:ch + 1], srate, state[ch], drive, distortion, highpass, wet_mix, dry_mix)
+    return audio
+
+def distortion_exciter_unlinked_serial(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, fast=False):
+    """
+    distortion_exciter_unlinked on one thread, a channel at a time. Same output; no thread
+    start-up cost, which wins on short blocks and few cores.
+    """
+    block = distortion_exciter_block_fast if fast else distortion_exciter_block
+    for ch in range(audio.shape[1]):
+        block(audio[:, ch:ch + 1], srate, state[ch], drive, distortion, highpass, wet_mix, dry_mix)
+    return audio
 
+@njit(inline='always')
+def _excite_traced(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, gains, approx):
+    # One gain follower per row of state and gains: a single row is linked over every
+    # channel, otherwise row c processes channel c.
+    linked = state.shape[0] == 1
+    for row in range(state.shape[0]):
+        frames = audio if linked else audio[:, row:row + 1]
+        _excite(frames, srate, state[row], drive, distortion, highpass, wet_mix, dry_mix, approx, gains[row])
     return audio
+
+@njit(_traced_signatures, cache=True, nogil=True)
+def distortion_exciter_traced(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, gains):
+    """
+    Process a block in place as the block kernels do, and write the wet path's gain at
+    every sample to gains, for QC. The output is the same as the untraced kernels'.
+
+    Parameters:
+      state : ndarray
+              One row per gain follower: new_state(n_channels) as a single row for
+              linked, new_unlinked_state(n_channels) for unlinked.
+      gains : ndarray
+              float32, (state rows, n_samples).
+    """
+    return _excite_traced(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, gains, False)
+
+@njit(_traced_signatures, cache=True, nogil=True, fastmath=True)
+def distortion_exciter_traced_fast(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, gains):
+    """
+    distortion_exciter_traced for the "fast" precision.
+    """
+    return _excite_traced(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, gains, True)
+
+class DistortionExciter:
+    def __init__(self, srate, drive=16.4, distortion=33, highpass=5000, wet_mix=-6, dry_mix=0, linked=True, precision=None):
+        """
+        Stateful distortion exciter for block-by-block (streaming) processing.
+
+        Parameters are the same as distortion_exciter. The state is sized from the
+        channel count of the first block. precision is "float64", "float32" or
+        "fast" (see precision.py); None uses the pipeline-wide setting.
+        """
+        self.srate = srate
+        self.drive = drive
+        self.distortion = distortion
+        self.highpass = highpass
+        self.wet_mix = wet_mix
+        self.dry_mix = dry_mix
+        self.linked = linked
+        self.dtype = state_dtype(precision)
+        self.fast = is_fast(precision)
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def prime(self, peaks):
+        """
+        Reset, then set the gain follower to where it would be after a signal whose
+        absolute peak per channel was peaks.
+
+        The follower only ever falls, to the lowest gain the loudest sample so far called
+        for, so this reproduces it exactly. The filters start from zero; they are back on
+        the continuous render's track after settle_frames() samples. Lets a render start
+        halfway through a signal, see segments.py.
+
+        Parameters:
+          peaks : ndarray
+                  (n_channels,) max |sample| of each channel, in the dtype of the audio
+                  that will follow.
+        """
+        peaks = np.asarray(peaks)
+        block = distortion_exciter_block_fast if self.fast else distortion_exciter_block
+        probes = [peaks.max()] if self.linked else list(peaks)
+        gains = []
+        for peak in probes:
+            # Run the kernel itself on the peak sample, so the gain is computed bit for bit
+            # the way the render computes it.
+            state = new_state(1).astype(self.dtype)
+            block(np.full((1, 1), peak, dtype=peaks.dtype), self.srate, state, self.drive,
+                  self.distortion, self.highpass, self.wet_mix, self.dry_mix)
+            gains.append(state[0])
+        if self.linked:
+            self.state = new_state(len(peaks)).astype(self.dtype)
+            self.state[0] = gains[0]
+        else:
+            self.state = new_unlinked_state(len(peaks)).astype(self.dtype)
+            self.state[:, 0] = gains
+
+    def settle_frames(self):
+        """
+        Samples of input after which the highpass filters, started from zero, match the
+        continuous render bit for bit.
+
+        A difference in the filter state decays like (1 + n + n²/2)·|blp|^n for the three
+        one-pole stages in series; this is the first n where that is below half a float64
+        ulp of full scale. About 20 samples at the default 5 kHz, 6000 at 20 Hz.
+        """
+        decay = 2 * math.pi * self.highpass * 3 / self.srate
+        if decay <= 0.0:
+            return math.inf
+        target = math.log(np.finfo(np.float64).eps / 2)
+        # Start from where |blp|^n alone is small enough, the polynomial only adds to it.
+        n = max(1, int(-target / decay))
+        while math.log(1 + n + n * n / 2) - decay * n > target:
+            n += 1
+        return n
+
+    def gain_rows(self, channels):
+        # Rows of the gains process_block() reports: one per gain follower.
+        return 1 if self.linked else channels
+
+    def process_block(self, audio, channels_first=False, out=None, gains=None):
+        """
+        Process the next block, in place unless out is given. audio is
+        (n_samples, n_channels), or (n_channels, n_samples) with channels_first=True.
+
+        Parameters:
+          out : ndarray, optional
+                Array with audio's shape and dtype to write the result into, leaving audio
+                as it is.
+          gains : ndarray, optional
+                  float32 (gain_rows(n_channels), n_samples) array that receives the wet
+                  path's gain at every sample, see distortion_exciter_traced.
+
+        Returns:
+          ndarray: The processed block (audio, or out if given).
+        """
+        if out is not None and out is not audio:
+            if out.shape != audio.shape or out.dtype != audio.dtype:
+                raise ValueError("out must have the same shape and dtype as the audio.")
+            out[:] = audio
+            audio = out
+        frames = audio.T if channels_first else audio
+        if gains is not None:
+            if self.state is None:
+                self.state = (new_state if self.linked else new_unlinked_state)(frames.shape[1]).astype(self.dtype)
+            # The linked state is a single row.
+            state = self.state[np.newaxis] if self.linked else self.state
+            traced = distortion_exciter_traced_fast if self.fast else distortion_exciter_traced
+            traced(frames, self.srate, state, self.drive,
+                   self.distortion, self.highpass, self.wet_mix, self.dry_mix, gains)
+        elif self.linked:
+            if self.state is None:
+                self.state = new_state(frames.shape[1]).astype(self.dtype)
+            if self.fast:
+                block = distortion_exciter_block_fast
+            else:
+                block = dispatch("distortion_exciter", frames.dtype, frames.shape[0])
+            block(frames, self.srate, self.state, self.drive,
+                  self.distortion, self.highpass, self.wet_mix, self.dry_mix)
+        else:
+            if self.state is None:
+                self.state = new_unlinked_state(frames.shape[1]).astype(self.dtype)
+            unlinked = dispatch("distortion_exciter_unlinked", frames.dtype, frames.shape[0])
+            unlinked(frames, self.srate, self.state, self.drive,
+                     self.distortion, self.highpass, self.wet_mix, self.dry_mix, self.fast)
+        return audio
+
+# Backends, see registry.py. The linked exciter has one compiled backend and the reference;
+# the unlinked one runs its channels in parallel or one after the other.
+def _case(linked):
+    def case(frames, dtype):
+        rng = np.random.default_rng(0)
+        audio = (rng.standard_normal((frames, 2)) * np.linspace(0.05, 1.5, frames)[:, np.newaxis]).astype(dtype)
+
+        def prepare():
+            state = new_state(2) if linked else new_unlinked_state(2)
+            return (audio.copy(), 44100.0, state, 16.0, 33.0, 4800.0, -6.0, 0.0)
+        return prepare, lambda args, result: args[0]
+    return case
+
+register_effect("distortion_exciter", lambda dtype, frames: "numba", _case(True))
+register("distortion_exciter", "numba", distortion_exciter_block)
+register("distortion_exciter", "python", reference.excite, exact=False, reference=True)
+
+register_effect("distortion_exciter_unlinked", lambda dtype, frames: "parallel", _case(False))
+register("distortion_exciter_unlinked", "parallel", distortion_exciter_unlinked)
+register("distortion_exciter_unlinked", "serial", distortion_exciter_unlinked_serial)
+register("distortion_exciter_unlinked", "python", reference.excite_unlinked, exact=False, reference=True)
@@ -0,0 +1,289 @@
+# Block-streaming loudness meter after ITU-R BS.1770-4 / EBU R128.
+#
+# LoudnessMeter.process_block() takes the audio a block at a time, in any block sizes, and
+# keeps only running statistics: the filter and interpolator state, and one energy value per
+# 100 ms of audio (36 kB per hour). From those it reports at any point:
+#
+#   integrated    programme loudness in LUFS: 400 ms blocks with 75% overlap, K-weighted,
+#                 gated at -70 LUFS and then at -10 LU below the mean of what passed
+#   momentary     loudest 400 ms block, LUFS
+#   short-term    loudest 3 s window, LUFS
+#   range         loudness range (EBU Tech 3342) in LU: 10th to 95th percentile of the 3 s
+#                 windows, gated at -70 LUFS and -20 LU
+#   true peak     dBTP, from 4x oversampling (at rates below 96 kHz) with a 48-tap
+#                 polyphase interpolator, as in BS.1770 Annex 2
+#   sample peak   dBFS
+#
+# The K-weighting and gating run in one compiled pass over the block, and the true-peak
+# interpolator in another. All math is float64 whatever the audio's dtype.
+
+import math
+import numpy as np
+from numba import njit, types
+
+# Measurement constants from BS.1770-4 and EBU Tech 3342.
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+RANGE_RELATIVE_GATE = -20.0
+SUB_BLOCK_SECONDS = 0.1
+MOMENTARY_SUB_BLOCKS = 4
+SHORT_TERM_SUB_BLOCKS = 30
+
+# Signatures (see dsp_scripts/__init__.py): float32/float64 (channels, frames) audio, float64 state.
+_energy_signatures = [
+    types.int64(dtype[:, :], types.float64[:, ::1], types.float64[:, :, ::1], types.float64[::1],
+                types.int64, types.float64[::1], types.float64[::1])
+    for dtype in (types.float32, types.float64)
+]
+_peak_signatures = [
+    types.void(dtype[:, :], types.float64[:, ::1], types.float64[:, ::1], types.float64[::1])
+    for dtype in (types.float32, types.float64)
+]
+
+def k_weighting(samplerate):
+    """
+    The two K-weighting biquads (high shelf, then high-pass) for samplerate.
+
+    The analog prototypes from BS.1770 are mapped with the bilinear transform, which gives
+    the standard's 48 kHz coefficients exactly and the right curve at any other rate.
+
+    Returns:
+        np.ndarray: (2, 6) float64 rows of [b0, b1, b2, 1, a1, a2].
+    """
+    # Stage 1: +4 dB high shelf modelling the head.
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / samplerate)
+    vh = 10.0 ** (gain_db / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1.0 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2.0 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+    # Stage 2: the RLB high-pass.
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / samplerate)
+    a0 = 1.0 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+    return np.array([shelf, highpass], dtype=np.float64)
+
+def channel_weights(n_channels):
+    # BS.1770 weights: 1.0 for the front channels, 1.41 for the surrounds, 0 for the LFE.
+    if n_channels == 6:
+        return np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+    if n_channels == 5:
+        return np.array([1.0, 1.0, 1.0, 1.41, 1.41])
+    return np.ones(n_channels)
+
+def true_peak_taps(samplerate):
+    """
+    Polyphase interpolator for the true-peak measurement.
+
+    Returns:
+        np.ndarray: (phases, 12) float64 taps, one row per output phase; a single phase
+                    (the samples themselves) at 96 kHz and up.
+    """
+    phases = 4 if samplerate < 96000 else (2 if samplerate < 192000 else 1)
+    if phases == 1:
+        taps = np.zeros((1, 12))
+        taps[0, 0] = 1.0
+        return taps
+    # Kaiser-windowed sinc low-pass at the original Nyquist frequency, 12 taps per phase.
+    n = np.arange(12 * phases)
+    h = np.sinc((n - (12 * phases - 1) / 2.0) / phases) * np.kaiser(12 * phases, 7.0)
+    taps = h.reshape(12, phases).T[:, ::-1].copy()
+    # Unity gain at DC for every phase, so a constant signal reads its own level.
+    return taps / taps.sum(axis=1, keepdims=True)
+
+@njit(_energy_signatures, cache=True, nogil=True)
+def k_weighted_energy_block(audio, sos, state, weights, sub_block, partial, out):
+    """
+    K-weight a (channels, frames) block and sum the weighted energy per 100 ms sub-block.
+
+    Parameters:
+      audio     : (channels, frames) block.
+      sos       : (2, 6) K-weighting biquads from k_weighting().
+      state     : (channels, 2, 2) float64 filter state, zeros to start.
+      weights   : (channels,) channel weights.
+      sub_block : Frames per sub-block.
+      partial   : [energy, frames] of the sub-block in progress, carried across calls.
+      out       : Room for the completed sub-blocks, at least (partial frames + block frames)
+                  // sub_block entries. Gets the mean weighted energy of each.
+
+    Returns:
+      int: The number of sub-blocks completed by this block (written to out).
+    """
+    n_channels = audio.shape[0]
+    n_frames = audio.shape[1]
+    energy = partial[0]
+    count = int(partial[1])
+    done = 0
+    for i in range(n_frames):
+        z = 0.0
+        for ch in range(n_channels):
+            x = np.float64(audio[ch, i])
+            for s in range(2):
+                # Transposed direct form II.
+                y = sos[s, 0] * x + state[ch, s, 0]
+                state[ch, s, 0] = sos[s, 1] * x - sos[s, 4] * y + state[ch, s, 1]
+                state[ch, s, 1] = sos[s, 2] * x - sos[s, 5] * y
+                x = y
+            z += weights[ch] * x * x
+        energy += z
+        count += 1
+        if count == sub_block:
+            out[done] = energy / sub_block
+            done += 1
+            energy = 0.0
+            count = 0
+    partial[0] = energy
+    partial[1] = count
+    return done
+
+@njit(_peak_signatures, cache=True, nogil=True)
+def true_peak_block(audio, taps, history, peaks):
+    """
+    Track the sample peak and the interpolated (true) peak of a (channels, frames) block.
+
+    Parameters:
+      audio   : (channels, frames) block.
+      taps    : (phases, n_taps) interpolator from true_peak_taps().
+      history : (channels, n_taps) float64, the last n_taps samples of every channel (newest
+                last), zeros to start.
+      peaks   : [sample peak, true peak], linear, updated in place.
+    """
+    n_phases = taps.shape[0]
+    n_taps = taps.shape[1]
+    n_frames = audio.shape[1]
+    if n_frames == 0:
+        return
+    sample_peak = peaks[0]
+    true_peak = peaks[1]
+    # The last n_taps - 1 samples of the previous block, then this block.
+    buf = np.empty(n_taps - 1 + n_frames, dtype=np.float64)
+    for ch in range(audio.shape[0]):
+        for k in range(n_taps - 1):
+            buf[k] = history[ch, k + 1]
+        for i in range(n_frames):
+            buf[n_taps - 1 + i] = audio[ch, i]
+        for i in range(n_frames):
+            x = abs(buf[n_taps - 1 + i])
+            if x > sample_peak:
+                sample_peak = x
+            for p in range(n_phases):
+                y = 0.0
+                for k in range(n_taps):
+                    y += taps[p, k] * buf[i + k]
+                y = abs(y)
+                if y > true_peak:
+                    true_peak = y
+        for k in range(n_taps):
+            history[ch, k] = buf[n_frames - 1 + k]
+    peaks[0] = sample_peak
+    peaks[1] = max(true_peak, sample_peak)
+
+def _lufs(energy):
+    return -0.691 + 10.0 * math.log10(energy) if energy > 0 else -math.inf
+
+def _db(linear):
+    return 20.0 * math.log10(linear) if linear > 0 else -math.inf
+
+def _windows(energies, length):
+    # Mean energy of every run of length consecutive sub-blocks (100 ms hop).
+    if len(energies) < length:
+        return np.zeros(0)
+    sums = np.concatenate(([0.0], np.cumsum(energies)))
+    return (sums[length:] - sums[:-length]) / length
+
+def gated_loudness(block_energies, relative_gate=RELATIVE_GATE):
+    """
+    BS.1770 integrated loudness of gating-block energies: absolute gate, then relative gate.
+
+    Returns:
+        float: LUFS, -inf if nothing passes the absolute gate.
+    """
+    loudness = -0.691 + 10.0 * np.log10(np.maximum(block_energies, 1e-300))
+    passed = block_energies[loudness > ABSOLUTE_GATE]
+    if passed.size == 0:
+        return -math.inf
+    gate = _lufs(passed.mean()) + relative_gate
+    passed = block_energies[(loudness > ABSOLUTE_GATE) & (loudness > gate)]
+    return _lufs(passed.mean()) if passed.size else -math.inf
+
+class LoudnessMeter:
+    def __init__(self, samplerate, channels):
+        """
+        Streaming BS.1770 loudness and true-peak meter.
+
+        Feed it (channels, frames) blocks with process_block(); read the measurement with
+        result() at any point, e.g. at the end of the stream.
+        """
+        self.samplerate = samplerate
+        self.channels = channels
+        self.sos = k_weighting(samplerate)
+        self.weights = channel_weights(channels)
+        self.taps = true_peak_taps(samplerate)
+        self.sub_block = int(round(SUB_BLOCK_SECONDS * samplerate))
+        self.reset()
+
+    def reset(self):
+        self.state = np.zeros((self.channels, 2, 2))
+        self.partial = np.zeros(2)
+        self.history = np.zeros((self.channels, self.taps.shape[1]))
+        self.peaks = np.zeros(2)
+        self.energies = []
+        self.frames = 0
+
+    def process_block(self, audio):
+        """
+        Measure the next (channels, frames) block. The block is not modified.
+        """
+        out = np.empty((int(self.partial[1]) + audio.shape[1]) // self.sub_block + 1)
+        done = k_weighted_energy_block(audio, self.sos, self.state, self.weights, self.sub_block, self.partial, out)
+        self.energies.extend(out[:done])
+        true_peak_block(audio, self.taps, self.history, self.peaks)
+        self.frames += audio.shape[1]
+
+    def integrated(self):
+        return gated_loudness(_windows(np.array(self.energies), MOMENTARY_SUB_BLOCKS))
+
+    def loudness_range(self):
+        short_term = _windows(np.array(self.energies), SHORT_TERM_SUB_BLOCKS)
+        loudness = -0.691 + 10.0 * np.log10(np.maximum(short_term, 1e-300))
+        passed = short_term[loudness > ABSOLUTE_GATE]
+        if passed.size == 0:
+            return 0.0
+        gate = _lufs(passed.mean()) + RANGE_RELATIVE_GATE
+        kept = loudness[(loudness > ABSOLUTE_GATE) & (loudness > gate)]
+        if kept.size == 0:
+            return 0.0
+        low, high = np.percentile(kept, (10, 95))
+        return float(high - low)
+
+    def result(self):
+        """
+        Returns:
+            dict: integrated_lufs, momentary_max_lufs, short_term_max_lufs, loudness_range_lu,
+                  true_peak_dbtp, sample_peak_dbfs and seconds. Levels of silence (or of
+                  audio too short to measure) are -inf.
+        """
+        energies = np.array(self.energies)
+        momentary = _windows(energies, MOMENTARY_SUB_BLOCKS)
+        short_term = _windows(energies, SHORT_TERM_SUB_BLOCKS)
+        return {"integrated_lufs": self.integrated(),
+                "momentary_max_lufs": _lufs(momentary.max()) if momentary.size else -math.inf,
+                "short_term_max_lufs": _lufs(short_term.max()) if short_term.size else -math.inf,
+                "loudness_range_lu": self.loudness_range(),
+                "true_peak_dbtp": _db(self.peaks[1]),
+                "sample_peak_dbfs": _db(self.peaks[0]),
+                "seconds": self.frames / self.samplerate}
+
+def normalization_gain(measurement, target_lufs, true_peak_ceiling=None):
+    """
+    The gain in dB that brings a measured programme to target_lufs, lowered if needed so
+    its true peak stays at or below true_peak_ceiling (dBTP). 0 for silence.
+    """
+    if not math.isfinite(measurement["integrated_lufs"]):
+        return 0.0
+    gain_db = target_lufs - measurement["integrated_lufs"]
+    if true_peak_ceiling is not None and math.isfinite(measurement["true_peak_dbtp"]):
+        gain_db = min(gain_db, true_peak_ceiling - measurement["true_peak_dbtp"])
+    return gain_db
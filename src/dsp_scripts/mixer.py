@@ -0,0 +1,192 @@
+# N-stem mixer: any number of mono or stereo stems, of any lengths, each with its own gain
+# and pan, summed into one (channels, frames) output.
+#
+# Every stem is accumulated straight into the output buffer by one compiled pass: the gain
+# and pan are applied as the stem is read, a mono stem is spread over the output channels
+# on the fly, and a stem shorter than the mix only touches its own frames. The longest stem
+# is written rather than added, so the output needs no zero fill either. Nothing the size
+# of the mix is allocated besides the output itself (which can be the caller's), so time
+# and memory grow linearly with the number of stems.
+#
+# Mixing is stateless, so a song can be mixed whole or block by block with the same result;
+# Mixer keeps the per-stem gains for the block-by-block case.
+#
+# Pan law, pan in [-1, 1] from hard left to hard right:
+#   mono stems    constant power, scaled to 0 dB at the center: both channels carry the
+#                 stem at unity when centered and the panned side rises to +3 dB
+#   stereo stems  balance: the far channel is attenuated linearly, the near one is kept
+
+import math
+import numpy as np
+from numba import njit, types
+from dsp_scripts import reference
+from dsp_scripts.registry import register_effect, register, dispatch
+
+# Signatures (see dsp_scripts/__init__.py): float32/float64 output and stem, C-contiguous or any layout.
+_signatures = [
+    types.void(out_dtype[:, layout], stem_dtype[:, layout], types.float64[::1], types.boolean)
+    for layout in (slice(None, None, 1), slice(None))
+    for out_dtype in (types.float32, types.float64)
+    for stem_dtype in (types.float32, types.float64)
+]
+
+@njit(_signatures, cache=True, nogil=True)
+def accumulate(out, stem, gains, assign):
+    """
+    Add stem * gains[channel] into the first stem-length frames of out, or write it there
+    when assign is set. A mono stem feeds every output channel; otherwise stem channel c
+    goes to output channel c. The math runs in out's dtype.
+    """
+    real = out.dtype.type
+    channels = out.shape[0]
+    frames = min(stem.shape[1], out.shape[1])
+    mono = stem.shape[0] == 1
+    if channels == 2 and out.strides[0] < out.strides[1]:
+        # Interleaved stereo (a transposed Nx2 array): one pass in memory order.
+        right = 0 if mono else 1
+        left_gain = real(gains[0])
+        right_gain = real(gains[1])
+        if assign:
+            for i in range(frames):
+                out[0, i] = real(stem[0, i]) * left_gain
+                out[1, i] = real(stem[right, i]) * right_gain
+        else:
+            for i in range(frames):
+                out[0, i] += real(stem[0, i]) * left_gain
+                out[1, i] += real(stem[right, i]) * right_gain
+        return
+    for c in range(channels):
+        source = 0 if mono else c
+        gain = real(gains[c])
+        if assign:
+            for i in range(frames):
+                out[c, i] = real(stem[source, i]) * gain
+        else:
+            for i in range(frames):
+                out[c, i] += real(stem[source, i]) * gain
+
+def pan_gains(pan, stem_channels, channels):
+    """
+    Linear gain per output channel for a stem panned to pan (see the pan law above).
+
+    Returns:
+        np.ndarray: float64 array of length channels.
+    """
+    pan = min(max(float(pan), -1.0), 1.0)
+    gains = np.ones(channels, dtype=np.float64)
+    if channels != 2 or pan == 0.0:
+        return gains
+    if stem_channels == 1:
+        angle = (pan + 1.0) * math.pi / 4.0
+        gains[0] = math.sqrt(2.0) * math.cos(angle)
+        gains[1] = math.sqrt(2.0) * math.sin(angle)
+    else:
+        gains[0] = min(1.0, 1.0 - pan)
+        gains[1] = min(1.0, 1.0 + pan)
+    return gains
+
+def _as_stem(stem):
+    stem = np.asarray(stem)
+    if stem.ndim == 1:
+        stem = stem[np.newaxis, :]
+    if stem.dtype != np.float32 and stem.dtype != np.float64:
+        stem = stem.astype(np.float32)
+    return stem
+
+def peak_level(audio):
+    """
+    Largest absolute sample of audio, without an abs() temporary the size of audio.
+    """
+    if audio.size == 0:
+        return audio.dtype.type(0.0)
+    return max(np.max(audio), -np.min(audio))
+
+class Mixer:
+    def __init__(self, n_stems, gains_db=None, pans=None, channels=2):
+        """
+        Mix a fixed set of stems, whole or a block at a time.
+
+        Parameters:
+            n_stems (int): Number of stems.
+            gains_db (list): Gain per stem in dB (default: 0 dB each).
+            pans (list): Pan per stem, -1 (left) to 1 (right) (default: centered).
+            channels (int): Output channels. Every stem must be mono or have this many.
+        """
+        gains_db = [0.0] * n_stems if gains_db is None else list(gains_db)
+        pans = [0.0] * n_stems if pans is None else list(pans)
+        if len(gains_db) != n_stems or len(pans) != n_stems:
+            raise ValueError("Expected a gain and a pan for each of the %d stems." % n_stems)
+        self.n_stems = n_stems
+        self.channels = channels
+        self.levels = [10.0 ** (gain_db / 20.0) for gain_db in gains_db]
+        self.pans = [float(pan) for pan in pans]
+        # Output channel gains per stem, for mono and for multichannel stems.
+        self._gains = [{stem_channels: level * pan_gains(pan, stem_channels, channels)
+                        for stem_channels in (1, channels)}
+                       for level, pan in zip(self.levels, self.pans)]
+
+    def process_block(self, stems, out=None, dtype=np.float32):
+        """
+        Mix the next block of every stem. The blocks may differ in length (e.g. a stem that
+        has already ended passes an empty or short block); the mix is as long as the longest.
+
+        Parameters:
+            stems (list): One 1D mono or (channels, frames) array per stem.
+            out (np.ndarray): (channels, frames) buffer to mix into, at least as long as
+                              the longest stem; its contents are overwritten. A new one of
+                              dtype is made if None.
+
+        Returns:
+            np.ndarray: The (channels, frames) mix: out, or its leading frames.
+        """
+        if len(stems) != self.n_stems:
+            raise ValueError("Expected %d stems, got %d." % (self.n_stems, len(stems)))
+        stems = [_as_stem(stem) for stem in stems]
+        for stem in stems:
+            if stem.shape[0] not in (1, self.channels):
+                raise ValueError("A %d-channel stem can't be mixed to %d channels." % (stem.shape[0], self.channels))
+        frames = max((stem.shape[1] for stem in stems), default=0)
+        if out is None:
+            out = np.empty((self.channels, frames), dtype=dtype)
+        elif out.shape[0] != self.channels or out.shape[1] < frames:
+            raise ValueError("out must be (%d, >= %d), got %s." % (self.channels, frames, out.shape))
+        out = out[:, :frames]
+        if not stems:
+            return out
+        # The longest stem initializes the mix, the others are added to it.
+        first = max(range(len(stems)), key=lambda i: stems[i].shape[1])
+        kernel = dispatch("mix_accumulate", out.dtype, frames)
+        kernel(out, stems[first], self._gains[first][stems[first].shape[0]], True)
+        for i, stem in enumerate(stems):
+            if i != first:
+                kernel(out, stem, self._gains[i][stem.shape[0]], False)
+        return out
+
+def mix_stems(stems, gains_db=None, pans=None, channels=None, out=None, dtype=np.float32):
+    """
+    Mix stems into one buffer, see Mixer.process_block.
+
+    Parameters:
+        channels (int): Output channels (default: the most any stem has).
+        gains_db, pans: Per stem, see Mixer.
+
+    Returns:
+        np.ndarray: The (channels, frames) mix.
+    """
+    stems = [_as_stem(stem) for stem in stems]
+    if channels is None:
+        channels = out.shape[0] if out is not None else max((stem.shape[0] for stem in stems), default=1)
+    return Mixer(len(stems), gains_db, pans, channels).process_block(stems, out, dtype)
+
+# Backends, see registry.py. Adding with NumPy broadcasting rounds the same way as the kernel.
+def _case(frames, dtype):
+    rng = np.random.default_rng(0)
+    stem = rng.uniform(-1.0, 1.0, (2, frames)).astype(dtype)
+    out = rng.uniform(-1.0, 1.0, (2, frames)).astype(dtype)
+    gains = np.array([0.5, 0.7])
+    prepare = lambda: (out.copy(), stem, gains, False)
+    return prepare, lambda args, result: args[0]
+
+register_effect("mix_accumulate", lambda dtype, frames: "numba", _case)
+register("mix_accumulate", "numba", accumulate)
+register("mix_accumulate", "numpy", reference.accumulate, reference=True)
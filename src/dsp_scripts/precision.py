@@ -0,0 +1,40 @@
+# Pipeline-wide numeric precision for the DSP kernels.
+#
+#   "float64"  exact: kernel state and math in float64 (the reference, and the default)
+#   "float32"  kernel state and math in float32 (expf/logf instead of exp/log)
+#   "fast"     float32 compiled with fastmath, plus the approximate exp/log from
+#              approx_math.py and the sine table in the saturator
+#
+# The kernels pick their precision from the dtype of their state arrays, so the stateful
+# classes (BussCompressor, DistortionExciter, MonoToStereoUpmixer) read the setting when
+# they are created. Set it before building the chains, e.g. with app.py --precision.
+# python -m dsp_scripts.accuracy reports what each mode costs against float64.
+
+import os
+import numpy as np
+
+PRECISIONS = ("float64", "float32", "fast")
+
+_precision = os.environ.get("DSP_PRECISION", "float64")
+
+def set_precision(precision):
+    global _precision
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}.")
+    _precision = precision
+
+def get_precision():
+    return _precision
+
+def state_dtype(precision=None):
+    """
+    The dtype kernel state (and the math done on it) uses for a precision, default the current one.
+    """
+    if precision is None:
+        precision = _precision
+    return np.float64 if precision == "float64" else np.float32
+
+def is_fast(precision=None):
+    if precision is None:
+        precision = _precision
+    return precision == "fast"
@@ -0,0 +1,428 @@
+# Quality control of rendered audio, measured from the buffers as they are written instead
+# of decoding the outputs again afterwards.
+#
+# QCMeter.process_block() takes a (channels, frames) output a block at a time, in any block
+# sizes, and keeps running statistics only. Its result() reports:
+#
+#   clipping      samples at or above CLIP_LEVEL (full scale in 16-bit), and runs of at
+#                 least CLIP_RUN of them in a row, which is what audible clipping looks like
+#   DC offset     mean of each channel
+#   correlation   of the first two channels, over the whole track and per 400 ms window:
+#                 the lowest window and the share of windows below 0 (out of phase). Windows
+#                 quieter than CORRELATION_GATE dBFS are left out.
+#   spectral tilt slope of the octave band levels (63 Hz to 16 kHz) of the channels' mean,
+#                 in dB per octave, against a target (TILT_TARGET_DB_PER_OCTAVE)
+#   levels        sample peak and RMS per channel
+#
+# The sample statistics are one compiled pass over the block. The long-term spectrum doesn't
+# need every frame: it averages Hann-windowed FFTs of one TILT_FFT_SIZE segment in every
+# TILT_SEGMENT_STRIDE, vectorized; the other frames aren't touched. A segment that spans two
+# blocks is carried over.
+#
+# GainTrace summarizes the gain a dynamics kernel applied, as the kernel reports it for every
+# sample (buss_compressor_traced, distortion_exciter_traced): the lowest gain in each 10 ms
+# window, in windows that carry over from one block to the next. For the compressor that is
+# the gain of the whole signal, for the exciter the gain of its wet path.
+
+import json
+import math
+import numpy as np
+from numba import njit, types
+
+# A sample at or above this (one 16-bit step below full scale) is clipped.
+CLIP_LEVEL = 32767.0 / 32768.0
+# Consecutive clipped samples that count as a clipped run.
+CLIP_RUN = 3
+CORRELATION_WINDOW_SECONDS = 0.4
+CORRELATION_GATE = -60.0
+TILT_FFT_SIZE = 4096
+TILT_SEGMENT_STRIDE = 8
+# Octave band centers the tilt is fitted over.
+TILT_BANDS = tuple(62.5 * 2.0 ** k for k in range(9))
+# Long-term spectrum of typical mastered music, falling a little faster than pink noise.
+TILT_TARGET_DB_PER_OCTAVE = -4.5
+GAIN_WINDOW_SECONDS = 0.01
+# Gain reduction above this counts the window as active.
+GAIN_ACTIVE_DB = 1.0
+
+# Signatures (see dsp_scripts/__init__.py): float32/float64 (channels, frames) audio, float64 state.
+_stats_signatures = [
+    types.int64(dtype[:, :], types.float64, types.int64, types.int64, types.float64[:, ::1],
+                types.int64[::1], types.float64[::1], types.float64[:, ::1])
+    for dtype in (types.float32, types.float64)
+]
+
+# The sums below keep four independent accumulators each, so the additions don't wait on
+# one another; that makes them about 3x faster than a plain loop.
+
+@njit(cache=True, nogil=True)
+def _channel_sums(row):
+    # (sum, sum of squares, max, min) of row.
+    t0 = t1 = t2 = t3 = 0.0
+    q0 = q1 = q2 = q3 = 0.0
+    h0 = h1 = h2 = h3 = -np.inf
+    l0 = l1 = l2 = l3 = np.inf
+    n = row.shape[0]
+    m = n - n % 4
+    for i in range(0, m, 4):
+        x0 = np.float64(row[i])
+        x1 = np.float64(row[i + 1])
+        x2 = np.float64(row[i + 2])
+        x3 = np.float64(row[i + 3])
+        t0 += x0
+        t1 += x1
+        t2 += x2
+        t3 += x3
+        q0 += x0 * x0
+        q1 += x1 * x1
+        q2 += x2 * x2
+        q3 += x3 * x3
+        h0 = max(h0, x0)
+        h1 = max(h1, x1)
+        h2 = max(h2, x2)
+        h3 = max(h3, x3)
+        l0 = min(l0, x0)
+        l1 = min(l1, x1)
+        l2 = min(l2, x2)
+        l3 = min(l3, x3)
+    for i in range(m, n):
+        x0 = np.float64(row[i])
+        t0 += x0
+        q0 += x0 * x0
+        h0 = max(h0, x0)
+        l0 = min(l0, x0)
+    return t0 + t1 + t2 + t3, q0 + q1 + q2 + q3, max(max(h0, h1), max(h2, h3)), min(min(l0, l1), min(l2, l3))
+
+@njit(cache=True, nogil=True)
+def _pair_sums(left, right):
+    # (sum of left^2, sum of right^2, sum of left * right).
+    a0 = a1 = a2 = a3 = 0.0
+    b0 = b1 = b2 = b3 = 0.0
+    c0 = c1 = c2 = c3 = 0.0
+    n = left.shape[0]
+    m = n - n % 4
+    for i in range(0, m, 4):
+        l0 = np.float64(left[i])
+        l1 = np.float64(left[i + 1])
+        l2 = np.float64(left[i + 2])
+        l3 = np.float64(left[i + 3])
+        r0 = np.float64(right[i])
+        r1 = np.float64(right[i + 1])
+        r2 = np.float64(right[i + 2])
+        r3 = np.float64(right[i + 3])
+        a0 += l0 * l0
+        a1 += l1 * l1
+        a2 += l2 * l2
+        a3 += l3 * l3
+        b0 += r0 * r0
+        b1 += r1 * r1
+        b2 += r2 * r2
+        b3 += r3 * r3
+        c0 += l0 * r0
+        c1 += l1 * r1
+        c2 += l2 * r2
+        c3 += l3 * r3
+    for i in range(m, n):
+        l0 = np.float64(left[i])
+        r0 = np.float64(right[i])
+        a0 += l0 * l0
+        b0 += r0 * r0
+        c0 += l0 * r0
+    return a0 + a1 + a2 + a3, b0 + b1 + b2 + b3, c0 + c1 + c2 + c3
+
+@njit(_stats_signatures, cache=True, nogil=True)
+def signal_stats_block(audio, clip_level, clip_run, window, stats, runs, pair, out):
+    """
+    Accumulate the sample statistics of a (channels, frames) block.
+
+    Parameters:
+      audio  : (channels, frames) block.
+      stats  : (channels, 6) float64 [sum, sum of squares, max, min, clipped samples,
+               clipped runs] per channel, zeros to start (max/min at -inf/inf).
+      runs   : (channels,) length of the clipped run in progress, carried across calls.
+      pair   : [LL, RR, LR, frames] of the correlation window in progress, carried across
+               calls. Only used with two or more channels.
+      out    : Room for the completed windows, at least (pair frames + block frames) //
+               window rows. Gets [LL, RR, LR] of each.
+
+    Returns:
+      int: The number of correlation windows completed by this block (written to out).
+    """
+    n_channels = audio.shape[0]
+    n_frames = audio.shape[1]
+    for ch in range(n_channels):
+        total, squares, high, low = _channel_sums(audio[ch])
+        stats[ch, 0] += total
+        stats[ch, 1] += squares
+        stats[ch, 2] = max(stats[ch, 2], high)
+        stats[ch, 3] = min(stats[ch, 3], low)
+        if max(high, -low) < clip_level:
+            runs[ch] = 0
+            continue
+        # Rare: only blocks that reach the clip level are scanned for runs.
+        for i in range(n_frames):
+            if abs(np.float64(audio[ch, i])) >= clip_level:
+                stats[ch, 4] += 1.0
+                runs[ch] += 1
+                if runs[ch] == clip_run:
+                    stats[ch, 5] += 1.0
+            else:
+                runs[ch] = 0
+    done = 0
+    if n_channels < 2:
+        return done
+    start = 0
+    while start < n_frames:
+        end = min(n_frames, start + window - int(pair[3]))
+        ll, rr, lr = _pair_sums(audio[0, start:end], audio[1, start:end])
+        pair[0] += ll
+        pair[1] += rr
+        pair[2] += lr
+        pair[3] += end - start
+        if pair[3] == window:
+            out[done, 0] = pair[0]
+            out[done, 1] = pair[1]
+            out[done, 2] = pair[2]
+            done += 1
+            pair[:] = 0.0
+        start = end
+    return done
+
+def _db(linear):
+    return 20.0 * math.log10(linear) if linear > 0.0 else -math.inf
+
+def _power_db(energy):
+    return 10.0 * math.log10(energy) if energy > 0.0 else -math.inf
+
+def correlation(ll, rr, lr):
+    """
+    Correlation of two channels from their sums of squares and of products: 1 identical,
+    0 unrelated, -1 opposite polarity. None if either channel is silent.
+    """
+    norm = math.sqrt(ll * rr)
+    return lr / norm if norm > 0.0 else None
+
+def octave_band_levels(power, samplerate, fft_size):
+    """
+    Mean power spectrum (rfft bins, scaled so they add up to the mean square) to the dB
+    level of the average bin in each of the TILT_BANDS octave bands. Bands above Nyquist or
+    without a bin are None.
+    """
+    freqs = np.fft.rfftfreq(fft_size, 1.0 / samplerate)
+    levels = []
+    for center in TILT_BANDS:
+        band = (freqs >= center / math.sqrt(2.0)) & (freqs < center * math.sqrt(2.0))
+        levels.append(_power_db(float(power[band].mean())) if band.any() else None)
+    return levels
+
+def spectral_tilt(levels):
+    """
+    Least-squares slope of octave band levels, in dB per octave. None with fewer than two
+    usable bands.
+    """
+    points = [(k, level) for k, level in enumerate(levels) if level is not None and math.isfinite(level)]
+    if len(points) < 2:
+        return None
+    octaves, db = np.array(points).T
+    return float(np.polyfit(octaves, db, 1)[0])
+
+class QCMeter:
+    def __init__(self, samplerate, channels, tilt_target=TILT_TARGET_DB_PER_OCTAVE):
+        """
+        Streaming QC meter, see the top of this file.
+
+        Feed it (channels, frames) blocks with process_block(); read the measurement with
+        result() at any point, e.g. at the end of the stream.
+        """
+        self.samplerate = samplerate
+        self.channels = channels
+        self.tilt_target = tilt_target
+        self.window = int(round(CORRELATION_WINDOW_SECONDS * samplerate))
+        self.fft_window = np.hanning(TILT_FFT_SIZE)
+        # Bin powers of a windowed segment times this add up to the segment's mean square.
+        self.fft_scale = 2.0 / (TILT_FFT_SIZE * np.sum(self.fft_window ** 2))
+        self.reset()
+
+    def reset(self):
+        self.stats = np.zeros((self.channels, 6))
+        self.stats[:, 2] = -np.inf
+        self.stats[:, 3] = np.inf
+        self.runs = np.zeros(self.channels, dtype=np.int64)
+        self.pair = np.zeros(4)
+        self.windows = []
+        self.power = np.zeros(TILT_FFT_SIZE // 2 + 1)
+        self.spectra = 0
+        # The start of a segment to analyze that the last block cut off, and its length.
+        self.partial = np.zeros((self.channels, TILT_FFT_SIZE), dtype=np.float32)
+        self.filled = 0
+        self.frames = 0
+
+    def process_block(self, audio):
+        """
+        Measure the next (channels, frames) block. The block is not modified.
+        """
+        out = np.empty(((int(self.pair[3]) + audio.shape[1]) // self.window + 1, 3))
+        done = signal_stats_block(audio, CLIP_LEVEL, CLIP_RUN, self.window, self.stats, self.runs, self.pair, out)
+        self.windows.extend(out[:done])
+        self._spectrum(audio)
+        self.frames += audio.shape[1]
+
+    def _spectrum(self, audio):
+        # The segments to analyze start every TILT_SEGMENT_STRIDE segments of the stream;
+        # self.frames is where this block starts.
+        size = TILT_FFT_SIZE
+        period = size * TILT_SEGMENT_STRIDE
+        n = audio.shape[1]
+        if self.filled:
+            take = min(size - self.filled, n)
+            self.partial[:, self.filled:self.filled + take] = audio[:, :take]
+            self.filled += take
+            if self.filled < size:
+                return
+            self._analyze(self.partial[:, np.newaxis, :])
+            self.filled = 0
+        first = -self.frames % period
+        count = (n - first - size) // period + 1 if n - first >= size else 0
+        if count:
+            # (channels, count, size) views of the block, no copy.
+            self._analyze(np.lib.stride_tricks.sliding_window_view(audio, size, axis=1)[:, first::period][:, :count])
+        cut = first + count * period
+        if cut < n:
+            self.filled = n - cut
+            self.partial[:, :self.filled] = audio[:, cut:]
+
+    def _analyze(self, segments):
+        # Add the spectra of the channels' mean of (channels, count, size) segments.
+        # A few hundred at a time bound the temporaries.
+        for start in range(0, segments.shape[1], 256):
+            chunk = segments[:, start:start + 256]
+            # In float32, which is plenty for a spectrum and much faster.
+            mid = chunk[0].astype(np.float32)
+            for channel in chunk[1:]:
+                mid += channel
+            mid *= (self.fft_window / chunk.shape[0]).astype(np.float32)
+            spectra = np.fft.rfft(mid, axis=1)
+            self.power += (spectra.real ** 2 + spectra.imag ** 2).sum(axis=0)
+            self.spectra += mid.shape[0]
+
+    def result(self):
+        """
+        Returns:
+            dict: frames, seconds, peak_dbfs, rms_dbfs and dc_offset (per channel),
+                  clipped_samples, clipped_runs, correlation (overall, min_window and
+                  out_of_phase_fraction; None for mono) and spectral_tilt (db_per_octave,
+                  target, deviation, octave band levels). Levels of silence are -inf.
+        """
+        frames = max(self.frames, 1)
+        peaks = np.maximum(self.stats[:, 2], -self.stats[:, 3])
+        report = {"frames": self.frames, "seconds": self.frames / self.samplerate,
+                  "peak_dbfs": [_db(float(peak)) for peak in peaks],
+                  "rms_dbfs": [_power_db(float(sq) / frames) for sq in self.stats[:, 1]],
+                  "dc_offset": [float(total) / frames for total in self.stats[:, 0]],
+                  "clipped_samples": int(self.stats[:, 4].sum()),
+                  "clipped_runs": int(self.stats[:, 5].sum()),
+                  "correlation": None}
+        if self.channels >= 2:
+            windows = np.array(self.windows).reshape(-1, 3)
+            totals = windows.sum(axis=0) + self.pair[:3]
+            # Gate on the mean energy of the two channels.
+            loud = (windows[:, 0] + windows[:, 1]) / (2 * self.window) > 10.0 ** (CORRELATION_GATE / 10.0)
+            per_window = [correlation(*w) for w in windows[loud]]
+            per_window = np.array([c for c in per_window if c is not None])
+            report["correlation"] = {
+                "overall": correlation(*(float(total) for total in totals)),
+                "min_window": float(per_window.min()) if per_window.size else None,
+                "out_of_phase_fraction": float((per_window < 0.0).mean()) if per_window.size else None}
+        levels = (octave_band_levels(self.power * self.fft_scale / self.spectra, self.samplerate, TILT_FFT_SIZE)
+                  if self.spectra else [])
+        tilt = spectral_tilt(levels)
+        report["spectral_tilt"] = {
+            "db_per_octave": tilt, "target_db_per_octave": self.tilt_target,
+            "deviation_db_per_octave": None if tilt is None else tilt - self.tilt_target,
+            "octave_bands_hz": list(TILT_BANDS), "octave_band_levels_db": levels}
+        return report
+
+class GainTrace:
+    def __init__(self, samplerate):
+        """
+        Gain reduction trace of a dynamics stage, per GAIN_WINDOW_SECONDS window.
+
+        Feed it the stage's per-sample gains with add(), a block at a time, in any block
+        sizes.
+        """
+        self.samplerate = samplerate
+        self.window = max(1, int(round(GAIN_WINDOW_SECONDS * samplerate)))
+        self.reset()
+
+    def reset(self):
+        # Lowest gain per finished window, a list of arrays.
+        self.windows = []
+        # Lowest gain of the unfinished window, and how many samples it has.
+        self.lowest = np.inf
+        self.filled = 0
+
+    def add(self, gains):
+        """
+        Add the next block of gains: a (detectors, frames) array of the linear gain applied
+        to every sample, one row per detector (e.g. per channel of an unlinked compressor).
+        The lowest gain over the rows counts.
+        """
+        gains = gains[0] if gains.shape[0] == 1 else gains.min(axis=0)
+        n = gains.shape[0]
+        if n == 0:
+            return
+        start = 0
+        if self.filled:
+            start = min(self.window - self.filled, n)
+            self.lowest = min(self.lowest, float(gains[:start].min()))
+            self.filled += start
+            if self.filled < self.window:
+                return
+            self.windows.append(np.array([self.lowest]))
+            self.filled = 0
+        full = (n - start) // self.window
+        if full:
+            self.windows.append(gains[start:start + full * self.window].reshape(full, self.window).min(axis=1))
+        start += full * self.window
+        if start < n:
+            self.lowest = float(gains[start:].min())
+            self.filled = n - start
+
+    def result(self):
+        """
+        Returns:
+            dict: Gain reduction (positive: the stage turned the audio down) in dB, the most
+                  in each window: windows, mean, max, median, p95, active_fraction (share
+                  above GAIN_ACTIVE_DB), and per_second, the most per second of audio.
+        """
+        lowest = self.windows + ([np.array([self.lowest])] if self.filled else [])
+        if not lowest:
+            return {"windows": 0, "mean_db": None, "max_db": None, "median_db": None, "p95_db": None,
+                    "active_fraction": None, "per_second": []}
+        # 0 - gain rather than -gain, so unity gain reads 0.0 rather than -0.0.
+        reduction = 0.0 - 20.0 * np.log10(np.maximum(np.concatenate(lowest).astype(np.float64), 1e-30))
+        per_second = max(1, int(round(1.0 / GAIN_WINDOW_SECONDS)))
+        padded = np.full(-(-reduction.size // per_second) * per_second, -np.inf)
+        padded[:reduction.size] = reduction
+        median, p95 = np.percentile(reduction, (50, 95))
+        return {"windows": int(reduction.size), "mean_db": float(reduction.mean()), "max_db": float(reduction.max()),
+                "median_db": float(median), "p95_db": float(p95),
+                "active_fraction": float((reduction > GAIN_ACTIVE_DB).mean()),
+                "per_second": [round(float(v), 2) for v in padded.reshape(-1, per_second).max(axis=1)]}
+
+def _finite(value):
+    # JSON has no infinities or NaN: write them as null.
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _finite(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    return value
+
+def write_report(report, path):
+    """
+    Save a QC report as JSON, with non-finite levels (silence) as null.
+    """
+    with open(path, "w") as f:
+        json.dump(_finite(report), f, indent=2)
@@ -0,0 +1,157 @@
+# Reference implementations of the kernels in plain NumPy and Python, registered as the
+# reference backend of each effect (see registry.py). They are written for clarity, not
+# speed, and are what the compiled backends are checked against:
+#
+#   python -m dsp_scripts.autotune --check
+#
+# The dynamics processors are recursive, so their references are sample loops in Python with
+# float64 math (the float64 precision's kernels must match them to within rounding). The
+# saturator, the upmixer and the mixer have no feedback, so theirs are vectorized and run in
+# the same precision as the kernels, which makes them exact.
+
+import math
+import numpy as np
+
+def compress(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent):
+    """
+    buss_compressor_block: one linked detector on the loudest channel of an NxC block.
+    """
+    atcoef = math.exp(-1.0 / (attack_us / 1000000.0 * samplerate))
+    relcoef = math.exp(-1.0 / (release_ms / 1000.0 * samplerate))
+    threshv = math.exp(threshold_db * 0.11512925464970228420089957273422)
+    mix = mix_percent / 100.0
+    dry = 1.0 - mix_percent / 100.0
+    rundb, runave = float(state[0]), float(state[1])
+
+    # The detector input, computed ahead for the whole block.
+    levels = np.max(np.abs(audio_array.astype(np.float64)), axis=1) ** 2
+    gains = np.empty(audio_array.shape[0])
+    for i, maxspl in enumerate(levels):
+        runave = max(maxspl + relcoef * (runave - maxspl), 0.0)
+        det = math.sqrt(runave)
+        overdb = max(8.6858896380650365530225783783321 * math.log(det / threshv), 0.0) if det > 0.0 else 0.0
+        coef = atcoef if overdb > rundb else relcoef
+        rundb = overdb + coef * (rundb - overdb)
+        gains[i] = math.exp(-rundb * (ratio - 1.0) / ratio * 0.11512925464970228420089957273422)
+
+    audio = audio_array.astype(np.float64)
+    output_audio[:] = audio * gains[:, np.newaxis] * mix + audio * dry
+    state[0] = rundb
+    state[1] = runave
+
+def compress_unlinked(samplerate, audio_array, output_audio, state, threshold_db, ratio, attack_us, release_ms, mix_percent,
+                      fast=False, control_rate=1):
+    """
+    buss_compressor_unlinked: compress() on every channel with its own state row. Only the
+    per-sample float64 compressor has a reference (fast=False, control_rate=1).
+    """
+    if fast or control_rate != 1:
+        raise ValueError("The reference compressor is the per-sample float64 one.")
+    for ch in range(audio_array.shape[1]):
+        compress(samplerate, audio_array[:, ch:ch + 1], output_audio[:, ch:ch + 1], state[ch],
+                 threshold_db, ratio, attack_us, release_ms, mix_percent)
+
+def excite(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix):
+    """
+    distortion_exciter_block: in place on an NxC block, state from new_state(C).
+    """
+    c = 8.65617025
+    threshDB = -drive
+    thresh = math.exp(threshDB / c)
+    ratio = 1.0 / 20.0
+    release = math.exp(-60 / (((1 - distortion) / 100) ** 3 * 500 * srate / 1000) / c)
+    blp = -math.exp(-2 * math.pi * highpass * 3 / srate)
+    alp = 1 + blp
+    wet = math.exp(wet_mix / c) / math.exp((threshDB - threshDB * ratio) / c)
+    dry = math.exp(dry_mix / c)
+
+    n_channels = audio.shape[1]
+    gain = float(state[0])
+    t = [[float(state[1 + stage * n_channels + ch]) for ch in range(n_channels)] for stage in range(3)]
+    for i in range(audio.shape[0]):
+        spl = [float(x) for x in audio[i]]
+        s = []
+        for ch in range(n_channels):
+            t[0][ch] = alp * spl[ch] - blp * t[0][ch]
+            t[1][ch] = alp * t[0][ch] - blp * t[1][ch]
+            t[2][ch] = alp * t[1][ch] - blp * t[2][ch]
+            s.append(spl[ch] - t[2][ch])
+        rms = max(abs(x) for x in spl)
+        seek_gain = math.exp((threshDB + (math.log(rms) * c - threshDB) * ratio) / c) / rms if rms > thresh else 1.0
+        gain = min(gain, release * seek_gain)
+        for ch in range(n_channels):
+            audio[i, ch] = spl[ch] * dry + s[ch] * gain * wet
+
+    state[0] = gain
+    for stage in range(3):
+        for ch in range(n_channels):
+            state[1 + stage * n_channels + ch] = t[stage][ch]
+    return audio
+
+def excite_unlinked(audio, srate, state, drive, distortion, highpass, wet_mix, dry_mix, fast=False):
+    """
+    distortion_exciter_unlinked: excite() on every channel with its own state row.
+    """
+    if fast:
+        raise ValueError("The reference exciter is the float64 one.")
+    for ch in range(audio.shape[1]):
+        excite(audio[:, ch:ch + 1], srate, state[ch], drive, distortion, highpass, wet_mix, dry_mix)
+    return audio
+
+def saturate(audio, out, consts, table, approx_sine):
+    """
+    The saturator on flat arrays: clip, sine shaping (math.sin or the sine table) and the
+    dry/wet mix, in the dtype of consts, as the original NumPy version did.
+    """
+    halfpi, mix, mix1, one = consts
+    dry = np.clip(audio, -one, one)
+    if approx_sine:
+        pos = np.abs(dry) * (table.shape[0] - 1)
+        idx = np.minimum(pos.astype(np.int64), table.shape[0] - 2)
+        frac = pos - idx.astype(pos.dtype)
+        wet = table[idx] + (table[idx + 1] - table[idx]) * frac
+        wet = np.where(dry < 0, -wet, wet)
+    else:
+        wet = np.sin(dry * halfpi)
+    out[:] = mix1 * dry + mix * wet
+
+def upmix(mono_buffer, bs, delay_buffer, ptr_state, stereo_output):
+    """
+    process_buffer_stereo_into, vectorized: the delay line is a pure delay of bs - 1 samples,
+    so the delayed signal is the last bs - 1 samples of history followed by the input.
+    """
+    n = mono_buffer.shape[0]
+    real = delay_buffer.dtype
+    ptr = int(ptr_state[0])
+    # The loop wraps at bs, and at bs = 0 behaves as bs = 1 (no delay).
+    bs = max(bs, 1)
+    # History in time order: the oldest sample is the one after the write position.
+    history = delay_buffer[(ptr + 1 + np.arange(bs - 1)) % bs]
+    x = mono_buffer.astype(real)
+    delayed = np.concatenate([history, x])[:n]
+    work = np.result_type(mono_buffer.dtype, real)
+    spl0 = mono_buffer.astype(work)
+    delayed = delayed.astype(work)
+    two = work.type(2.0)
+    one_and_half = work.type(1.5)
+    spl0_ = (spl0 * two + delayed) / two
+    spl1_ = (spl0 * two - delayed) / two
+    stereo_output[:, 0] = (spl0_ + spl1_ / two) / one_and_half
+    stereo_output[:, 1] = (spl1_ + spl0_ / two) / one_and_half
+    # Leave the delay line as the sample loop would.
+    last = min(n, bs)
+    delay_buffer[(ptr + np.arange(n - last, n)) % bs] = x[n - last:]
+    ptr_state[0] = (ptr + n) % bs
+
+def accumulate(out, stem, gains, assign):
+    """
+    mixer.accumulate with NumPy broadcasting.
+    """
+    real = out.dtype.type
+    frames = min(stem.shape[1], out.shape[1])
+    for c in range(out.shape[0]):
+        value = stem[0 if stem.shape[0] == 1 else c, :frames].astype(out.dtype) * real(gains[c])
+        if assign:
+            out[c, :frames] = value
+        else:
+            out[c, :frames] += value
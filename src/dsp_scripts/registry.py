@@ -0,0 +1,170 @@
+# Kernel registry: every effect can have several implementations (backends) with the same
+# call signature, e.g. a serial and a parallel numba kernel, or a NumPy one. The kernel entry
+# points (dynamic_saturator, BussCompressor.process_block, ...) ask dispatch() for the backend
+# to run on a buffer, which is what fx.py and everything above it go through.
+#
+# Which backend is fastest depends on the buffer length, the dtype and the core count, so
+# dispatch() picks per (effect, dtype, size bucket):
+#
+#   1. the winner measured on this host by python -m dsp_scripts.autotune, for the current
+#      numba thread count, when a tuning file for this host exists (see TUNING_FILE)
+#   2. otherwise the effect's default rule, which is what the kernels did before the
+#      registry (e.g. the saturator's PARALLEL_MIN_SAMPLES threshold)
+#
+# Only backends registered as exact (output identical to the default backend's, bit for bit)
+# can be picked; the autotuner checks that on every case it times. A reference backend is a
+# plain NumPy/Python implementation (see reference.py) that the others are checked against;
+# it is never tuned or chosen, even if registered as exact, and dispatch() only returns one
+# when asked for it by name.
+
+import os
+import json
+import platform
+import tempfile
+import numpy as np
+import numba
+
+# Where the autotuner saves its winners; $KERNEL_TUNING_FILE overrides it, and an empty
+# string turns tuning off (every effect uses its default rule).
+TUNING_FILE = os.environ.get("KERNEL_TUNING_FILE", os.path.join(tempfile.gettempdir(), "audiopostproc_kernels.json"))
+
+# Size buckets, in frames: a buffer falls in the first bucket at least as long as it, or the
+# last one. The autotuner times each bucket at its size.
+SIZE_BUCKETS = (1 << 10, 1 << 13, 1 << 16, 1 << 19)
+
+class Backend:
+    def __init__(self, name, function, exact=True, reference=False):
+        self.name = name
+        self.function = function
+        self.exact = exact
+        self.reference = reference
+
+class Effect:
+    def __init__(self, name, default, case=None):
+        """
+        Parameters:
+            name (str): Effect name, the registry key.
+            default (callable): default(dtype, frames) -> backend name, the rule used when
+                                there is no tuned winner.
+            case (callable): case(frames, dtype) -> (prepare, output) for the autotuner:
+                             prepare() returns fresh arguments for a backend call and
+                             output(args, result) the array to compare afterwards.
+        """
+        self.name = name
+        self.default = default
+        self.case = case
+        self.backends = {}
+
+_effects = {}
+_tuning = None
+
+def register_effect(name, default, case=None):
+    """
+    Declare an effect; see Effect. Its backends are added with register().
+    """
+    _effects[name] = Effect(name, default, case)
+    return _effects[name]
+
+def register(effect, name, function, exact=True, reference=False):
+    """
+    Add a backend to effect. exact declares that it gives the default backend's output bit
+    for bit, which makes it eligible for dispatch; reference marks the oracle.
+
+    Returns:
+        callable: function, so this can be used on a definition.
+    """
+    _effects[effect].backends[name] = Backend(name, function, exact, reference)
+    return function
+
+def effects():
+    return dict(_effects)
+
+def backends(effect):
+    return dict(_effects[effect].backends)
+
+def reference(effect):
+    """
+    The effect's reference backend, or None.
+    """
+    for backend in _effects[effect].backends.values():
+        if backend.reference:
+            return backend
+    return None
+
+def size_bucket(frames):
+    for bucket in SIZE_BUCKETS:
+        if frames <= bucket:
+            return bucket
+    return SIZE_BUCKETS[-1]
+
+def tuning_key(effect, dtype, frames):
+    return "%s/%s/%d" % (effect, np.dtype(dtype).name, size_bucket(frames))
+
+def host():
+    """
+    What a tuning table is only valid for.
+    """
+    return {"machine": platform.machine(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "numba": numba.__version__}
+
+def load_tuning(path=None):
+    """
+    Load the winners for this host from path (default TUNING_FILE). A missing file, or one
+    tuned on another host, leaves every effect on its default rule.
+
+    Returns:
+        dict: {numba thread count: {tuning key: backend name}}.
+    """
+    global _tuning
+    path = TUNING_FILE if path is None else path
+    _tuning = {}
+    if path and os.path.exists(path):
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        if saved.get("host") == host():
+            _tuning = {int(threads): winners for threads, winners in saved.get("winners", {}).items()}
+    return _tuning
+
+def save_tuning(winners, threads, path=None):
+    """
+    Store winners ({tuning key: backend name}) for the given numba thread count in path
+    (default TUNING_FILE), keeping what was tuned for other thread counts.
+    """
+    path = TUNING_FILE if path is None else path
+    saved = {"host": host(), "winners": {}}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+            if previous.get("host") == host():
+                saved["winners"] = previous.get("winners", {})
+        except (OSError, ValueError):
+            pass
+    saved["winners"][str(threads)] = winners
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(saved, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, path)
+    load_tuning(path)
+
+def choose(effect, dtype, frames):
+    """
+    Name of the backend dispatch() runs for effect on a frames-long buffer of dtype.
+    """
+    if _tuning is None:
+        load_tuning()
+    winner = _tuning.get(numba.get_num_threads(), {}).get(tuning_key(effect, dtype, frames))
+    entry = _effects[effect]
+    if winner in entry.backends and entry.backends[winner].exact and not entry.backends[winner].reference:
+        return winner
+    return entry.default(np.dtype(dtype), frames)
+
+def dispatch(effect, dtype, frames, backend=None):
+    """
+    The backend function for effect on a frames-long buffer of dtype: the one named by
+    backend if given, otherwise see choose().
+    """
+    return _effects[effect].backends[backend or choose(effect, dtype, frames)].function
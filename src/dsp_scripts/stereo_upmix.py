@@ -10,19 +10,38 @@
 
 import numpy as np
 import math
-from numba import njit
+from numba import njit, types
+from dsp_scripts.precision import state_dtype
+from dsp_scripts import reference
+from dsp_scripts.registry import register_effect, register, dispatch
 
-@njit
-def process_buffer_stereo(mono_buffer, bs, delay_buffer):
+# Signatures (see dsp_scripts/__init__.py): float32/float64 mono input, float32/float64 delay line.
+_signatures = [
+    dtype[:, ::1](dtype[:], types.int64, real[:], types.int64[:])
+    for dtype in (types.float32, types.float64)
+    for real in (types.float32, types.float64)
+]
+# Same, writing into a caller-provided (n, 2) output of any layout, e.g. the transposed view
+# of a (2, n) channels-first buffer.
+_into_signatures = [
+    types.void(dtype[:], types.int64, real[:], types.int64[:], dtype[:, :])
+    for dtype in (types.float32, types.float64)
+    for real in (types.float32, types.float64)
+]
+
+@njit(inline='always')
+def _upmix(mono_buffer, bs, delay_buffer, ptr_state, stereo_output):
     # Determine the number of samples in the input mono signal.
     n = mono_buffer.shape[0]
+
+    # The math runs in the delay buffer's precision.
+    real = delay_buffer.dtype.type
+    two = real(2.0)
+    one_and_half = real(1.5)
     
-    # Create an empty output array for the stereo signal.
-    # The shape is (n, 2): one column for the left channel and one for the right.
-    stereo_output = np.empty((n, 2), dtype=mono_buffer.dtype)
-    
-    # Initialize a pointer (index) for the circular delay buffer.
-    ptr = 0
+    # Restore the pointer (index) for the circular delay buffer.
+    # It is kept in ptr_state so the next buffer continues where this one stopped.
+    ptr = ptr_state[0]
     
     # Process each sample in the mono input buffer.
     for i in range(n):
@@ -44,50 +63,99 @@ def process_buffer_stereo(mono_buffer, bs, delay_buffer):
         
         # Calculate intermediate value spl0_ and spl1_.:
         # This is the average of (current sample multiplied by 2) and the delayed sample.
-        spl0_ = (spl0 * 2 + delayed) / 2.0
-        spl1_ = (spl0 * 2 - delayed) / 2.0
+        spl0_ = (spl0 * two + delayed) / two
+        spl1_ = (spl0 * two - delayed) / two
         
         # Compute the left and right channel output.
         # It is derived from spl0_ and a scaled version of spl1_.
-        stereo_output[i, 0] = (spl0_ + spl1_ / 2.0) / 1.5
-        stereo_output[i, 1] = (spl1_ + spl0_ / 2.0) / 1.5
+        stereo_output[i, 0] = (spl0_ + spl1_ / two) / one_and_half
+        stereo_output[i, 1] = (spl1_ + spl0_ / two) / one_and_half
     
+    # Save the pointer for the next buffer.
+    ptr_state[0] = ptr
+
+@njit(_signatures, cache=True, nogil=True)
+def process_buffer_stereo(mono_buffer, bs, delay_buffer, ptr_state):
+    # Create an empty output array for the stereo signal.
+    # The shape is (n, 2): one column for the left channel and one for the right.
+    stereo_output = np.empty((mono_buffer.shape[0], 2), dtype=mono_buffer.dtype)
+    _upmix(mono_buffer, bs, delay_buffer, ptr_state, stereo_output)
+
     # Return the complete stereo output array.
     return stereo_output
 
+@njit(_into_signatures, cache=True, nogil=True)
+def process_buffer_stereo_into(mono_buffer, bs, delay_buffer, ptr_state, stereo_output):
+    _upmix(mono_buffer, bs, delay_buffer, ptr_state, stereo_output)
+
 class MonoToStereoUpmixer:
-    def __init__(self, sample_rate, delay_ms=125):
+    def __init__(self, sample_rate, delay_ms=125, precision=None):
         """
         Initialize the upmixer.
 
         Parameters:
             sample_rate (int): The sampling rate in Hz.
             delay_ms (float): Delay in milliseconds (default: 125ms).
+            precision (str): "float64", "float32" or "fast" (see precision.py). "fast" is
+                             float32 here, there is no exp/log to approximate.
+                             None uses the pipeline-wide setting.
         """
         self.sample_rate = sample_rate
         self.delay_ms = delay_ms
         # Calculate delay length in samples (bs), capped at 500,000 samples.
         self.bs = int(math.floor(min(delay_ms * sample_rate / 1000, 500000)))
         # Allocate a delay buffer of size (bs * 2 + 1)
-        self.delay_buffer = np.zeros(self.bs * 2 + 1, dtype=np.float64)
+        self.delay_buffer = np.zeros(self.bs * 2 + 1, dtype=state_dtype(precision))
+        # Circular buffer pointer, carried across calls to process_buffer.
+        self.ptr_state = np.zeros(1, dtype=np.int64)
+
+    def reset(self):
+        self.delay_buffer[:] = 0.0
+        self.ptr_state[0] = 0
 
-    def process_buffer(self, mono_buffer):
+    def process_buffer(self, mono_buffer, channels_first=False, out=None):
         """
-        Process an entire mono buffer to produce stereo output.
+        Process a mono buffer to produce stereo output.
+
+        Consecutive calls continue the delay line, so a signal can be fed in
+        blocks and the result matches processing it in one go.
 
         Parameters:
-            mono_buffer (np.ndarray): 1D NumPy array of mono samples.
+            mono_buffer (np.ndarray): 1D NumPy array of mono samples, or a (1, n_samples) array
+                                      as Pedalboard returns it.
+            channels_first (bool): Return a C-contiguous (2, n_samples) array instead.
+            out (np.ndarray): (n_samples, 2) array ((2, n_samples) with channels_first=True)
+                              of the input's dtype to write the output into. A new one is
+                              made if None. It can't be the input; the output is stereo.
 
         Returns:
-            np.ndarray: A 2D array of shape (n_samples, 2) with stereo output.
+            np.ndarray: A 2D array of shape (n_samples, 2) with stereo output ((2, n_samples)
+                        with channels_first=True), out if given.
         """
-        print("stereo_upmix.py : Input buffer shape:", mono_buffer.shape)
-        
         if mono_buffer.ndim == 2:
         # If the first dimension is 1, assume it's in the wrong orientation.
-            if mono_buffer.shape[0] == 1 and mono_buffer.shape[1] > 1:
-                mono_buffer = mono_buffer.T.flatten() # numba processes expect a 1D array
+            if mono_buffer.shape[0] == 1:
+                mono_buffer = mono_buffer[0] # numba processes expect a 1D array; this is a view
 
-        
-        print("stereo_upmix.py : Mono buffer shape:", mono_buffer.shape)
-        return process_buffer_stereo(mono_buffer, self.bs, self.delay_buffer)
\ No newline at end of file
+        shape = (2, mono_buffer.shape[0]) if channels_first else (mono_buffer.shape[0], 2)
+        if out is None:
+            out = np.empty(shape, dtype=mono_buffer.dtype)
+        elif out.shape != shape or out.dtype != mono_buffer.dtype:
+            raise ValueError(f"out must be a {shape} {mono_buffer.dtype} array.")
+        upmix = dispatch("stereo_upmix", mono_buffer.dtype, mono_buffer.shape[0])
+        upmix(mono_buffer, self.bs, self.delay_buffer, self.ptr_state, out.T if channels_first else out)
+        return out
+
+# Backends, see registry.py. The delay line has no feedback, so the NumPy version is
+# vectorized and gives the same output as the sample loop.
+def _case(frames, dtype):
+    mono = np.random.default_rng(0).uniform(-1.0, 1.0, frames).astype(dtype)
+
+    def prepare():
+        upmixer = MonoToStereoUpmixer(44100.0, 100)
+        return (mono, upmixer.bs, upmixer.delay_buffer, upmixer.ptr_state, np.empty((2, frames), dtype=dtype).T)
+    return prepare, lambda args, result: args[4]
+
+register_effect("stereo_upmix", lambda dtype, frames: "numba", _case)
+register("stereo_upmix", "numba", process_buffer_stereo_into)
+register("stereo_upmix", "numpy", reference.upmix, reference=True)
\ No newline at end of file
@@ -2,44 +2,43 @@
 # Feb 23, 2025
 # Summing two AudioFile objects together and returning an AudioFile object.
 
+# Now a two-stem case of dsp_scripts.mixer, which mixes any number of stems in place.
+
 import numpy as np
-def sum_audio_arrays(audio1, audio2, normalize=True):
+from dsp_scripts.mixer import mix_stems, peak_level
+
+def sum_audio_arrays(audio1, audio2, normalize=True, out=None):
     """
     Sum (mix) two NumPy audio arrays together and return the result.
     
     Parameters:
         audio1 (np.ndarray): First audio signal (NxC, where N=frames, C=channels).
         audio2 (np.ndarray): Second audio signal (NxC, where N=frames, C=channels).
+                             The two may differ in length (the shorter one is mixed into
+                             the frames it covers) and one may be mono (it goes to every
+                             channel of the other).
         normalize (bool): If True, normalizes the mixed audio to prevent clipping.
+        out (np.ndarray): NxC array to write the mix into, with N and C the larger of the
+                          two inputs'. A new one is made if None.
     
     Returns:
-        np.ndarray: The mixed audio signal as a NumPy array.
+        np.ndarray: The mixed audio signal as a NumPy array (out, if given).
     """
-    # Ensure both files have the same number of channels
-    if audio1.shape[1] != audio2.shape[1]:
-        raise ValueError("Number of channels do not match between audio arrays.")
-
-    # Determine the maximum length
-    max_len = max(audio1.shape[0], audio2.shape[0])
-
-    # Pad or trim the shorter array to match the length
-    def match_length(audio, target_length):
-        if audio.shape[0] < target_length:
-            pad_amount = target_length - audio.shape[0]
-            return np.pad(audio, ((0, pad_amount), (0, 0)), mode='constant')
-        else:
-            return audio[:target_length]
-
-    audio1 = match_length(audio1, max_len)
-    audio2 = match_length(audio2, max_len)
-
-    # Sum the two audio signals
-    mixed_audio = audio1 + audio2
+    dtype = np.result_type(audio1, audio2)
+    if dtype != np.float64:
+        dtype = np.float32
+    # The mixer works on (channels, frames): mix the transposed views of the inputs into
+    # the transposed view of an NxC output, no copies.
+    shape = (max(audio1.shape[0], audio2.shape[0]), max(audio1.shape[1], audio2.shape[1]))
+    mixed_audio = np.empty(shape, dtype=dtype) if out is None else out
+    if mixed_audio.shape != shape:
+        raise ValueError(f"out must be {shape}, got {mixed_audio.shape}.")
+    mix_stems([audio1.T, audio2.T], out=mixed_audio.T)
 
     # Normalize if necessary (prevent clipping)
     if normalize:
-        peak = np.max(np.abs(mixed_audio))
+        peak = peak_level(mixed_audio)
         if peak > 1.0:
             mixed_audio /= peak
 
-    return mixed_audio
\ No newline at end of file
+    return mixed_audio
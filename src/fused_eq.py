@@ -0,0 +1,120 @@
+# EQ compiler: turns the filter plugins of a Pedalboard into fused biquad cascades.
+#
+# fuse_eq(board) returns a FusedBoard that is called exactly like the Pedalboard it replaces.
+# Every run of consecutive HighpassFilter / LowpassFilter / PeakFilter / HighShelfFilter /
+# LowShelfFilter / Gain plugins becomes one SOSEqualizer (one pass over the buffer instead
+# of one per plugin); everything else (compressors, reverbs, delays) stays in Pedalboard.
+# Output matches the Pedalboard version sample for sample, see dsp_scripts/sos_eq.py.
+#
+# Plugin parameters are read when the board is compiled (and re-read if the sample rate
+# changes); later edits to the original plugins are not picked up.
+
+from pedalboard import Pedalboard, Gain, HighpassFilter, LowpassFilter, PeakFilter, HighShelfFilter, LowShelfFilter
+from dsp_scripts import sos_eq
+
+FUSABLE = (Gain, HighpassFilter, LowpassFilter, PeakFilter, HighShelfFilter, LowShelfFilter)
+
+def compile_eq(plugins, samplerate):
+    """
+    Design the biquad cascade for a run of fusable plugins.
+
+    A gain is applied to the output of the sections before it. Anything after a gain
+    (another filter or gain) starts a new cascade, so every float32 rounding step is
+    the same as in Pedalboard. In practice a run is a list of filters ending in a gain.
+
+    Returns:
+        list: SOSEqualizer stages equivalent to plugins, in order.
+    """
+    stages = []
+    sections = []
+    gain = None
+    for plugin in plugins:
+        if isinstance(plugin, Gain):
+            if gain is not None:
+                stages.append(sos_eq.SOSEqualizer(sections, gain))
+                sections = []
+            gain = sos_eq.gain_factor(plugin.gain_db)
+            continue
+        if gain is not None:
+            # A filter after a gain: close the current cascade with that gain.
+            stages.append(sos_eq.SOSEqualizer(sections, gain))
+            sections, gain = [], None
+        if isinstance(plugin, HighpassFilter):
+            sections.append(sos_eq.first_order_highpass(samplerate, plugin.cutoff_frequency_hz))
+        elif isinstance(plugin, LowpassFilter):
+            sections.append(sos_eq.first_order_lowpass(samplerate, plugin.cutoff_frequency_hz))
+        elif isinstance(plugin, PeakFilter):
+            sections.append(sos_eq.peak(samplerate, plugin.cutoff_frequency_hz, plugin.q, plugin.gain_db))
+        elif isinstance(plugin, HighShelfFilter):
+            sections.append(sos_eq.high_shelf(samplerate, plugin.cutoff_frequency_hz, plugin.q, plugin.gain_db))
+        elif isinstance(plugin, LowShelfFilter):
+            sections.append(sos_eq.low_shelf(samplerate, plugin.cutoff_frequency_hz, plugin.q, plugin.gain_db))
+        else:
+            raise TypeError(f"{type(plugin).__name__} can't be fused.")
+    if sections or gain is not None:
+        stages.append(sos_eq.SOSEqualizer(sections, 1.0 if gain is None else gain))
+    return stages
+
+class FusedBoard:
+    def __init__(self, board):
+        """
+        Drop-in replacement for a Pedalboard with its filter runs fused (see fuse_eq).
+        """
+        self.board = board
+        self.samplerate = None
+        self.stages = []
+
+    def compile(self, samplerate):
+        # Consecutive fusable plugins become SOSEqualizers, the rest are grouped in Pedalboards.
+        self.samplerate = samplerate
+        self.stages = []
+        run = []
+        kind = None
+        for plugin in self.board:
+            if isinstance(plugin, Gain):
+                # A gain joins whatever run it follows; a lone Gain isn't worth a kernel call.
+                plugin_kind = kind or "pedalboard"
+            else:
+                plugin_kind = "eq" if isinstance(plugin, FUSABLE) else "pedalboard"
+            if run and plugin_kind != kind:
+                self.stages += self._build(kind, run)
+                run = []
+            kind = plugin_kind
+            run.append(plugin)
+        if run:
+            self.stages += self._build(kind, run)
+
+    def _build(self, kind, plugins):
+        if kind == "eq":
+            return compile_eq(plugins, self.samplerate)
+        return [Pedalboard(plugins)]
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def __call__(self, audio, sample_rate, reset=True):
+        """
+        Process (channels, frames) audio like Pedalboard.__call__.
+        """
+        if sample_rate != self.samplerate:
+            self.compile(sample_rate)
+        elif reset:
+            self.reset()
+        for i, stage in enumerate(self.stages):
+            if isinstance(stage, Pedalboard):
+                audio = stage(audio, sample_rate, reset=False)
+            else:
+                # Past the first stage the buffer is our own intermediate, so filter it in place;
+                # the caller's input is never written to.
+                audio = stage.process_block(audio, channels_first=True, out=audio if i > 0 else None)
+        return audio
+
+def fuse_eq(board):
+    """
+    Compile a Pedalboard's filter runs into fused biquad cascades.
+
+    Returns:
+        FusedBoard: Called like the Pedalboard: fused(audio, samplerate, reset=False).
+    """
+    return FusedBoard(board)
@@ -1,85 +1,321 @@
 # Carmine Silano
 # Feb 23, 2025
-from pedalboard import Pedalboard, Compressor, Distortion, HighShelfFilter, HighpassFilter, PeakFilter, Gain, Chorus, LadderFilter, Phaser, Convolution, Reverb, Delay, Limiter
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from pedalboard.io import AudioFile
-from dsp_scripts.buss_compressor import buss_compressor
 from dsp_scripts.sum_audio import sum_audio_arrays
+from dsp_scripts import mixer, registry, reference
+from dsp_scripts.mixer import mix_stems, peak_level
 from dsp_scripts.stereo_upmix import MonoToStereoUpmixer
 from dsp_scripts.distortion_exciter import distortion_exciter
 from dsp_scripts.saturator import dynamic_saturator
+from dsp_scripts.precision import get_precision
+from dsp_scripts.qc import GainTrace
+from contextlib import ExitStack
+import utils
+from utils import open_file, open_file_stream, file_hash, BackgroundWriter, LoudnessWriter, DEFAULT_SAMPLE_FORMAT
+from profiling import stage
+from arena import BufferArena
+from stage_cache import combine, source_hash
+from presets import CHAINS, load_preset, preset_hash, build_stages, preset_board
+
+# Default number of frames per block in streaming mode.
+DEFAULT_BLOCK_SIZE = 65536
+
+# Threads used by process_song to run the instrumental and vocal branches and the output writes side by side.
+SONG_WORKERS = 4
+
+# The default chains live in ../presets/default.json (see presets.py). These return fresh
+# Pedalboards of its EQ/effects sections, for code that wants just the Pedalboard part.
+
+def instrumental_fxchain():
+    return preset_board("instrumental", "fxchain")
+
+def vocal_fxchain():
+    return preset_board("vocal", "fxchain")
+
+def buss_fxchain():
+    return preset_board("buss", "fxchain")
+
+# Buffer contract: every buffer handed from stage to stage, from the file reads to the file
+# writes, is a C-contiguous (channels, frames) float32 array. That is what Pedalboard reads,
+# processes and writes, so none of those steps copy. The numba kernels index (frames, channels)
+# and get the transposed view with channels_first=True, which is also free. Kernel *state*
+# (detectors, filters, delay lines) follows the precision setting and may be float64; the
+# audio buffers never are.
+#
+# as_buffer() is the one place a buffer gets converted. It returns its input untouched when
+# it already follows the contract and otherwise converts it, counting the copy (or dtype
+# conversion) in buffer_stats so stray full-length copies show up instead of hiding.
+BUFFER_DTYPE = np.float32
+
+class BufferStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.copies = 0
+        self.conversions = 0
+        self.bytes_copied = 0
+        self.sites = {}
+
+    def record(self, where, kind, nbytes):
+        if kind == "copy":
+            self.copies += 1
+        else:
+            self.conversions += 1
+        self.bytes_copied += nbytes
+        site = self.sites.setdefault(where, {"copy": 0, "upcast": 0, "downcast": 0, "bytes": 0})
+        site[kind] += 1
+        site["bytes"] += nbytes
+
+    def summary(self):
+        return {"copies": self.copies, "conversions": self.conversions,
+                "bytes_copied": self.bytes_copied, "sites": self.sites}
+
+buffer_stats = BufferStats()
+
+# Buffers of every render in this process are recycled through one arena, so a batch worker
+# renders each song after the first into memory that is already mapped (see arena.py).
+buffer_arena = BufferArena()
+
+def as_buffer(audio, where):
+    """
+    Return audio as a contract buffer: C-contiguous (channels, frames) float32.
+
+    A 1D array becomes a (1, frames) view. Anything that needs a copy or a dtype
+    conversion is converted and counted in buffer_stats under where.
+
+    Parameters:
+        audio (np.ndarray): 1D mono or (channels, frames) audio.
+        where (str): Name of the handoff, for buffer_stats.
+
+    Returns:
+        np.ndarray: audio itself when it already follows the contract.
+    """
+    if audio.ndim == 1:
+        audio = audio[np.newaxis, :]
+    if audio.dtype != BUFFER_DTYPE:
+        kind = "upcast" if audio.dtype.itemsize < np.dtype(BUFFER_DTYPE).itemsize else "downcast"
+        audio = np.ascontiguousarray(audio, dtype=BUFFER_DTYPE)
+        buffer_stats.record(where, kind, audio.nbytes)
+    elif not audio.flags.c_contiguous:
+        audio = np.ascontiguousarray(audio)
+        buffer_stats.record(where, "copy", audio.nbytes)
+    return audio
+
+# A Chain holds every piece of state of one chain (Pedalboard plugins, numba kernel state,
+# delay lines) so audio can be pushed through it one block at a time. Its stages come from
+# a preset (see presets.py); chains take and return contract buffers (see above) and
+# overwrite their input if the first stage works in place, unless asked to preserve it.
+# Feeding a whole song as a single block is the regular, non-streaming render.
+# precision ("float64", "float32" or "fast", see dsp_scripts/precision.py) is fixed when a
+# chain is built; None takes the pipeline-wide setting at that point.
+# fused_eq=True runs the chains' filter plugins as fused biquad cascades (see fused_eq.py),
+# which gives the same output as Pedalboard in fewer passes over the audio.
+# Every step goes through profiling.stage(), a plain call unless profiling is enabled.
+#
+# With an arena (see arena.py) the stages that can write into a given buffer (those with
+# output_shape) get one from the arena, and work in place only on buffers the chain took
+# itself, so the input is never overwritten. An arena buffer is given back as soon as the
+# next stage has made a new one from it; the chain's output is the caller's to give back.
+#
+# trace_gains() makes the stages that can report their per-sample gain (those with
+# gain_shape) write it into a buffer that a GainTrace summarizes (see dsp_scripts/qc.py), for
+# the QC report.
+
+class Chain:
+    def __init__(self, name, stages, arena=None):
+        self.name = name
+        self.stages = stages
+        self.arena = arena
+        # GainTrace per stage index while tracing, see trace_gains().
+        self.gain_traces = None
+        # Held by callers that share a cached chain between threads, see process_instrumental.
+        self.lock = threading.Lock()
+
+    def reset(self):
+        for _, chain_stage in self.stages:
+            chain_stage.reset()
+
+    def trace_gains(self, samplerate):
+        """
+        Start new gain traces of the stages with gain_shape, or stop tracing if samplerate
+        is None. Stages skipped by process_cached() aren't traced.
+        """
+        self.gain_traces = None if samplerate is None else {
+            i: GainTrace(samplerate) for i, (_, chain_stage) in enumerate(self.stages)
+            if hasattr(chain_stage, "gain_shape")}
+
+    def gain_report(self):
+        """
+        Returns:
+            dict: Stage name -> GainTrace.result() of the traced stages.
+        """
+        names = [name for name, _ in self.stages]
+        report = {}
+        for i, trace in (self.gain_traces or {}).items():
+            name = self.stages[i][0]
+            report[name if names.count(name) == 1 else f"{name}#{i}"] = trace.result()
+        return report
+
+    def process(self, audio, preserve_input=False):
+        return self._run(*self._input(audio, preserve_input), 0)
+
+    def process_cached(self, audio, cache, key, preserve_input=False):
+        """
+        process() through a StageCache: every stage output is stored under a key chained
+        from the input's key, and the chain resumes after the last stage already cached.
+
+        Only for whole-file renders from a reset chain, as skipped stages don't update
+        their state.
+
+        Parameters:
+            audio: The input buffer, or a function returning it, called only if a stage runs.
+            cache (StageCache): Where stage outputs are stored.
+            key (str): Key of the input, see stage_cache.py.
+
+        Returns:
+            tuple: (output buffer, key of the output)
+        """
+        keys = []
+        for _, chain_stage in self.stages:
+            key = combine(key, chain_stage.fingerprint)
+            keys.append(key)
+        for start in range(len(keys), 0, -1):
+            cached = stage(f"{self.name}.cache", cache.get, keys[start - 1])
+            if cached is not None:
+                # A copy-on-write map of the cache file, free to overwrite.
+                return self._run(cached, True, start, cache, keys), key
+        audio, writable = self._input(audio() if callable(audio) else audio, preserve_input)
+        return self._run(audio, writable, 0, cache, keys), key
+
+    def _input(self, audio, preserve_input):
+        # The input buffer, and whether the stages may overwrite it.
+        buffer = as_buffer(audio, self.name + ".in")
+        first = self.stages[0][1] if self.stages else None
+        if self.arena is not None and (first is None or not first.in_place or hasattr(first, "output_shape")):
+            return buffer, False
+        if preserve_input and self.stages and self.stages[0][1].in_place and np.may_share_memory(buffer, audio):
+            # Someone else still reads the input (e.g. a background writer): work on a copy.
+            buffer = buffer.copy()
+            buffer_stats.record(self.name + ".in", "copy", buffer.nbytes)
+        return buffer, True
+
+    def _run(self, audio, writable, start, cache=None, keys=None):
+        # writable: the stages may overwrite audio. owned: audio was taken from the arena
+        # here, and goes back to it once a stage has read it into a new buffer.
+        owned = False
+        for i in range(start, len(self.stages)):
+            name, chain_stage = self.stages[i]
+            trace = self.gain_traces.get(i) if self.gain_traces else None
+            options = {}
+            if self.arena is not None and hasattr(chain_stage, "output_shape"):
+                options["out"] = audio if chain_stage.in_place and writable else self.arena.take(chain_stage.output_shape(audio))
+            if trace is not None:
+                shape = chain_stage.gain_shape(audio)
+                options["gains"] = np.empty(shape, np.float32) if self.arena is None else self.arena.take(shape)
+            result = stage(f"{self.name}.{name}", chain_stage.process, audio, **options)
+            if trace is not None:
+                stage(f"qc.{self.name}.{name}", trace.add, options["gains"])
+                if self.arena is not None:
+                    self.arena.give(options["gains"])
+            if cache is not None:
+                # Stored before the next stage, which may work in place on it.
+                stage(f"{self.name}.cache", cache.put, keys[i], result)
+            if not np.may_share_memory(result, audio):
+                if owned:
+                    self.arena.give(audio)
+                owned = self.arena is not None and self.arena.owns(result)
+                writable = True
+            audio = result
+        return audio
+
+class SongChains:
+    # Everything a song render needs, built once and reset between songs so a
+    # long-running process (e.g. a batch worker) doesn't rebuild it per track.
+    def __init__(self, samplerate, precision=None, fused_eq=False, preset=None, arena=None):
+        """
+        Parameters:
+            preset (str or dict): Preset file or loaded preset, None for the default one.
+            arena (BufferArena): Where the chains and the renders take their buffers from
+                                 (default: buffer_arena, shared by the whole process).
+        """
+        self.samplerate = samplerate
+        self.precision = precision or get_precision()
+        self.preset = load_preset(preset)
+        self.fused_eq = bool(fused_eq)
+        self.key = (preset_hash(self.preset), float(samplerate), self.precision, bool(fused_eq))
+        self.arena = buffer_arena if arena is None else arena
+        self.instrumental, self.vocal, self.buss = (
+            Chain(name, build_stages(self.preset, name, samplerate, self.precision, fused_eq), self.arena)
+            for name in CHAINS)
+
+    def reset(self):
+        self.instrumental.reset()
+        self.vocal.reset()
+        self.buss.reset()
+
+    def trace_gains(self, enabled=True):
+        # See Chain.trace_gains.
+        for chain in (self.instrumental, self.vocal, self.buss):
+            chain.trace_gains(self.samplerate if enabled else None)
+
+    def gain_report(self):
+        # Chain name -> Chain.gain_report(), for the chains with traced stages.
+        report = {chain.name: chain.gain_report() for chain in (self.instrumental, self.vocal, self.buss)}
+        return {name: stages for name, stages in report.items() if stages}
+
+# Compiled SongChains by (preset hash, sample rate, precision, fused_eq), least recently used first.
+PIPELINE_CACHE_SIZE = 16
+_pipelines = OrderedDict()
+_pipelines_lock = threading.Lock()
+
+def get_chains(samplerate, preset=None, precision=None, fused_eq=False):
+    """
+    The SongChains for a preset, built on first use and cached.
+
+    The key is the preset's content hash, so an edited file gets new chains and the same
+    preset under another path reuses the old ones. Up to PIPELINE_CACHE_SIZE are kept.
+    The cached chains are shared: render with one at a time (process_song resets them).
+
+    Parameters:
+        preset (str or dict): Preset file or loaded preset, None for the default one.
+
+    Returns:
+        SongChains: The cached chains.
+    """
+    preset = load_preset(preset)
+    key = (preset_hash(preset), float(samplerate), precision or get_precision(), bool(fused_eq))
+    with _pipelines_lock:
+        chains = _pipelines.get(key)
+        if chains is not None:
+            _pipelines.move_to_end(key)
+            return chains
+    chains = SongChains(samplerate, precision=key[2], fused_eq=fused_eq, preset=preset)
+    with _pipelines_lock:
+        chains = _pipelines.setdefault(key, chains)
+        _pipelines.move_to_end(key)
+        while len(_pipelines) > PIPELINE_CACHE_SIZE:
+            _pipelines.popitem(last=False)
+    return chains
+
+def _process_cached(name, audio, samplerate):
+    # One chain of the default preset, shared by every caller and used under its lock.
+    chain = getattr(get_chains(samplerate), name)
+    with chain.lock:
+        chain.reset()
+        return chain.process(audio)
 
 def process_instrumental(audio, samplerate):
-    fxchain = Pedalboard([
-        Compressor(threshold_db=-1.0, 
-                   ratio=1.5, 
-                   attack_ms=5.0, 
-                   release_ms=100.0),
-        HighpassFilter(cutoff_frequency_hz = 36),
-        PeakFilter(cutoff_frequency_hz = 111, 
-                   q = 0.8, 
-                   gain_db = 2.7),
-        PeakFilter(cutoff_frequency_hz = 406, 
-                   q = 2.0, 
-                   gain_db = -3.5),
-        PeakFilter(cutoff_frequency_hz = 1434, 
-                   q = 2.43, 
-                   gain_db = -1.3),
-        PeakFilter(cutoff_frequency_hz = 3007, 
-                   q = 1.0, 
-                   gain_db = -1.3),
-        PeakFilter(cutoff_frequency_hz = 5220, 
-                   q = 0.63, 
-                   gain_db = -2.5),
-        HighShelfFilter(cutoff_frequency_hz = 11000, 
-                        gain_db = -4.3, 
-                        q = 0.78),
-        #Distortion(drive_db=3),
-        Gain(gain_db=-10)
-        #Limiter(threshold_db=-0.1)
-    ])
-
-    dist_fxed = distort_exciter(audio, samplerate, drive=16, distortion=33, highpass=4800, wet_mix=-6, dry_mix=0)
-    chain_fxed = fxchain(dist_fxed, samplerate)
-    stereod = stereo_upmix(chain_fxed, samplerate, 100)
-    effected = saturate(stereod, mix_pct=80)
-    return effected
+    return _process_cached("instrumental", audio, samplerate)
 
 def process_vocals(audio, samplerate):
-    fxchain = Pedalboard([
-        HighpassFilter(cutoff_frequency_hz = 100),
-        PeakFilter(cutoff_frequency_hz = 271, 
-                   q = 1.21, 
-                   gain_db = -2.1),
-        PeakFilter(cutoff_frequency_hz = 518, 
-                   q = 0.31, 
-                   gain_db = -0.6),
-        PeakFilter(cutoff_frequency_hz = 949, 
-                   q = 0.84, 
-                   gain_db = -5.0),
-        PeakFilter(cutoff_frequency_hz = 2696, 
-                   q = 1.0, 
-                   gain_db = -2.7),
-        HighShelfFilter(cutoff_frequency_hz = 10334, 
-                        gain_db = 1.1, 
-                        q = 0.21),
-        Delay(delay_seconds=0.06, 
-              feedback=0, 
-              mix=0.1),
-        Reverb(room_size=0.5,
-               damping=0.5,
-               wet_level=0.15,
-               dry_level=1.0,
-               width=1.0,
-               freeze_mode=0.0),
-        #Distortion(drive_db=.2),
-        Gain(gain_db=-18.0)
-        #Limiter(threshold_db=-0.1)
-    ])
-
-    #dist_fxed = distort_exciter(audio, samplerate)
-    chain_fxed = fxchain(audio, samplerate)
-    effected = stereo_upmix(chain_fxed, samplerate, 32)
-    return effected
+    return _process_cached("vocal", audio, samplerate)
 
 def stereo_upmix(audio1, samplerate, delay_ms):
     upmixer = MonoToStereoUpmixer(samplerate, delay_ms)
@@ -91,28 +327,298 @@ def distort_exciter(audio, samplerate, drive=5.5, distortion=10, highpass=4800,
 def sum_audio(audio1, audio2):
     return sum_audio_arrays(audio1, audio2)
 
-def saturate(audio, mix_pct=100):
-    return dynamic_saturator(audio, mix_pct)
+def sum_buffers(audio1, audio2, normalize=True, out=None):
+    """
+    sum_audio_arrays for (channels, frames) buffers: the shorter one is mixed into the
+    frames it covers, a mono one into both channels, and the mix is peak normalized if
+    normalize is set and it clips. Mixes into out if given (see sum_shape), otherwise
+    makes one new buffer, see dsp_scripts.mixer.
+    """
+    mixed_audio = mix_stems([as_buffer(audio1, "sum.in"), as_buffer(audio2, "sum.in")], out=out, dtype=BUFFER_DTYPE)
+    if normalize:
+        peak = peak_level(mixed_audio)
+        if peak > 1.0:
+            mixed_audio /= peak
+    return mixed_audio
+
+def sum_shape(audio1, audio2):
+    # The shape of sum_buffers(audio1, audio2).
+    channels = max(1 if audio.ndim == 1 else audio.shape[0] for audio in (audio1, audio2))
+    return (channels, max(audio1.shape[-1], audio2.shape[-1]))
+
+# Loudness normalization of the summed and buss outputs, see utils.LoudnessWriter. Streaming
+# services play back at about -14 LUFS, and -1 dBTP leaves headroom for lossy encoders.
+DEFAULT_LOUDNESS_TARGET = -14.0
+DEFAULT_TRUE_PEAK_CEILING = -1.0
+
+# The outputs that are loudness normalized/measured.
+LOUDNESS_OUTPUTS = ("summed", "buss")
+
+def open_writers(outputs, files, samplerate, sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None,
+                 loudness_target=None, true_peak_ceiling=DEFAULT_TRUE_PEAK_CEILING, measure_loudness=False, qc=False):
+    """
+    Open a writer per output file on the ExitStack outputs.
+
+    Parameters:
+        files (dict): Output name -> file path.
+        loudness_target (float): Normalize the LOUDNESS_OUTPUTS to this integrated loudness
+                                 (LUFS) as they are written, with their true peak held under
+                                 true_peak_ceiling (dBTP).
+        measure_loudness (bool): Meter the LOUDNESS_OUTPUTS even without a target.
+        qc (bool): Run every output through a QC meter as it is written (see qc_measurements).
+
+    Returns:
+        dict: Output name -> BackgroundWriter (LoudnessWriter for the metered ones).
+    """
+    writers = {}
+    for name, file_path in files.items():
+        if name in LOUDNESS_OUTPUTS and (measure_loudness or loudness_target is not None):
+            writer = LoudnessWriter(file_path, samplerate, 2, sample_format, compression_level, name,
+                                    target_lufs=loudness_target, true_peak_ceiling=true_peak_ceiling, qc=qc)
+        else:
+            writer = BackgroundWriter(file_path, samplerate, 2, sample_format, compression_level, name, qc=qc)
+        writers[name] = outputs.enter_context(writer)
+    return writers
+
+def loudness_measurements(writers):
+    # Output name -> LoudnessWriter.measurement, once the writers are closed.
+    return {name: writer.measurement for name, writer in writers.items() if isinstance(writer, LoudnessWriter)}
+
+def qc_measurements(writers, chains=None):
+    """
+    The QC report of a render, once its writers (opened with qc=True) are closed.
+
+    Returns:
+        dict: outputs: output name -> the writer's QC result (dsp_scripts.qc.QCMeter), with
+              the loudness measurement under loudness for the metered outputs; stages: chain
+              name -> stage name -> gain trace (SongChains.gain_report), if chains are given.
+    """
+    report = {"outputs": {}}
+    for name, writer in writers.items():
+        report["outputs"][name] = dict(writer.qc, loudness=getattr(writer, "measurement", None))
+    if chains is not None:
+        report["stages"] = chains.gain_report()
+    return report
+
+def saturate(audio, mix_pct=100, out=None, approx_sine=False):
+    return dynamic_saturator(audio, mix_pct, out=out, approx_sine=approx_sine)
 
 def process_buss(audio, samplerate):
-    prefx = Pedalboard([Gain(gain_db=-1.5)])
-    audio = prefx(audio, samplerate)
-
-    audio = buss_compressor(samplerate, audio, threshold_db=-4.8, ratio=4, attack_us=2000, release_ms=132, mix_percent=100)
-    print("Buss compressor applied: ", audio.shape)
-
-    fxchain = Pedalboard([
-        Reverb(room_size=0.5,
-               damping=0.5,
-               wet_level=0.03,
-               dry_level=1.0,
-               width=1.0,
-               freeze_mode=0.0),
-        Gain(gain_db=4.5)
-        #Limiter(threshold_db=-0.1)
-    ])
-
-    effected = fxchain(audio, samplerate)
-    print("Buss pedalboard applied: ", audio.shape)
-    return effected
+    return _process_cached("buss", audio, samplerate)
+
+def process_song(instrumental_file, vocal_file,
+                 output_instrumental_file, output_vocal_file, output_summed_file, output_buss_file,
+                 samplerate, chains=None, max_workers=SONG_WORKERS,
+                 sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None, cache=None,
+                 loudness_target=None, true_peak_ceiling=DEFAULT_TRUE_PEAK_CEILING, loudness_report=None, qc_report=None):
+    """
+    Render a song with each stem fully in memory.
+
+    The stages run as a small dependency graph on a thread pool:
+
+        open+instrumental ----> write instrumental
+                 \
+                  +--> sum --> write summed
+                 /        \
+        open+vocal -----+  +--> buss --> write buss
+                         \
+                          +--> write vocal
+
+    Pedalboard and the numba kernels (nogil) release the GIL, so the two branches run on
+    separate cores and a song takes about as long as its slower branch plus the buss.
+    Each output is handed to its own BackgroundWriter as soon as it is ready, so encoding
+    and disk I/O overlap with the stages still running.
+    The buffers come from chains.arena and go back to it once the writer and the next
+    stage are done with them, so only a few are alive at once and the next song reuses them.
+
+    Parameters:
+        chains (SongChains): Prebuilt chains to reuse; they are reset first. Built fresh if None.
+        max_workers (int): Threads in the pool. 1 runs the stages one after the other.
+        sample_format (str): Output sample format, see utils.SAMPLE_FORMATS. The container
+                             (WAV or FLAC) follows the output file extensions.
+        compression_level (int): FLAC compression level, 0-8.
+        cache (StageCache): Cache every stage output and reuse what the inputs, presets and
+                            code haven't changed since (see stage_cache.py). A stem whose
+                            chain is fully cached isn't even read.
+        loudness_target (float): Instead of peak normalizing the sum, normalize the summed
+                                 and buss outputs to this loudness (LUFS) as they are
+                                 written (see open_writers). The buss then gets the raw sum.
+        true_peak_ceiling (float): dBTP the loudness normalization keeps the true peak under.
+        loudness_report (dict): If given, filled with the loudness measurement of the
+                                summed and buss outputs (see utils.LoudnessWriter).
+        qc_report (dict): If given, filled with the QC report of the outputs and the gain
+                          traces of the dynamics stages (see qc_measurements).
+
+    Returns:
+        int: The number of frames in the summed/buss output.
+    """
+    if chains is None:
+        chains = SongChains(samplerate)
+    else:
+        chains.reset()
+    chains.trace_gains(qc_report is not None)
+    normalize = loudness_target is None
+    arena = chains.arena
+
+    def write(name, audio, readers=0):
+        # Queue audio on its writer. It goes back to the arena once the writer and the
+        # readers have called the returned release (the writer calls it when done).
+        release = arena.releaser(audio, readers + 1)
+        stage("write." + name, writers[name].write, as_buffer(audio, "write." + name), release)
+        return release
+
+    # Each task returns (buffer, cache key, release); the keys stay None without a cache.
+    def sum_branches(inst_future, vocal_future):
+        (inst, inst_key, inst_release), (vocal, vocal_key, vocal_release) = inst_future.result(), vocal_future.result()
+        # The sum's code is sum_buffers here and the mixer kernel with its backends.
+        key = (combine("sum", inst_key, vocal_key, normalize, source_hash(sys.modules[__name__], mixer, registry, reference))
+               if cache is not None else None)
+        summed = stage("sum", sum_buffers, inst, vocal, normalize, out=arena.take(sum_shape(inst, vocal)))
+        inst_release()
+        vocal_release()
+        return summed, key, write("summed", summed, readers=1)
+
+    def render(name, chain, file_path):
+        read = lambda: stage("read." + name, open_file, file_path, samplerate)
+        if cache is None:
+            audio, key = stage(name, chain.process, read()), None
+        else:
+            key = combine("read", file_hash(file_path), float(samplerate), source_hash(utils))
+            audio, key = stage(name, chain.process_cached, read, cache, key)
+        return audio, key, write(name, audio, readers=1)
+
+    def buss_branch(summed_future):
+        summed, key, summed_release = summed_future.result()
+        # The summed mix is still being written, so the buss mustn't process it in place.
+        if cache is None:
+            audio = stage("buss", chains.buss.process, summed, preserve_input=True)
+        else:
+            audio, _ = stage("buss", chains.buss.process_cached, summed, cache, key, preserve_input=True)
+        summed_release()
+        write("buss", audio)
+        return summed.shape[1]
+
+    # Tasks are submitted after the tasks they wait on, so with a FIFO pool a waiting
+    # task never holds a thread that one of its inputs still needs.
+    files = {"instrumental": output_instrumental_file, "vocal": output_vocal_file,
+             "summed": output_summed_file, "buss": output_buss_file}
+    with ExitStack() as outputs:
+        writers = open_writers(outputs, files, samplerate, sample_format, compression_level,
+                               loudness_target, true_peak_ceiling, loudness_report is not None, qc_report is not None)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            inst_processed = pool.submit(render, "instrumental", chains.instrumental, instrumental_file)
+            vocal_processed = pool.submit(render, "vocal", chains.vocal, vocal_file)
+            summed_audios = pool.submit(sum_branches, inst_processed, vocal_processed)
+            buss = pool.submit(buss_branch, summed_audios)
+            buss.result()
+    if loudness_report is not None:
+        loudness_report.update(loudness_measurements(writers))
+    if qc_report is not None:
+        qc_report.update(qc_measurements(writers, chains))
+
+    return buss.result()
+
+def process_song_streaming(instrumental_file, vocal_file,
+                           output_instrumental_file, output_vocal_file, output_summed_file, output_buss_file,
+                           samplerate, block_size=DEFAULT_BLOCK_SIZE, chains=None,
+                           sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None,
+                           loudness_target=None, true_peak_ceiling=DEFAULT_TRUE_PEAK_CEILING, loudness_report=None,
+                           qc_report=None):
+    """
+    Render a song block by block so peak memory depends on block_size, not song length.
+
+    The output matches the whole-file render sample for sample. The summed mix is
+    peak normalized like sum_audio_arrays, which needs the peak of the whole mix, so
+    it is done in two passes:
+      1. Read both stems in blocks, run the instrumental and vocal chains, write their
+         outputs, and spill the raw float32 sum to a temporary file while tracking its peak.
+      2. Read the spill back in blocks, normalize, write the summed output and run the buss.
+    With a loudness_target the sum isn't peak normalized and the buss runs in the same
+    pass; the summed and buss writers meter the blocks and apply the normalization gain
+    as they encode (see utils.LoudnessWriter).
+    Outputs are written by BackgroundWriters, so each block's encoding overlaps with
+    rendering the next one; a writer that falls behind holds the render back. The block
+    buffers cycle through chains.arena like process_song's.
+
+    Parameters:
+        chains (SongChains): Prebuilt chains to reuse; they are reset first. Built fresh if None.
+        sample_format, compression_level: Output encoding, see process_song.
+        loudness_target, true_peak_ceiling, loudness_report: Loudness normalization and
+                                                              measurement, see process_song.
+        qc_report (dict): If given, filled with the QC report, see process_song.
+
+    Returns:
+        int: The number of frames in the summed/buss output.
+    """
+    if chains is None:
+        chains = SongChains(samplerate)
+    else:
+        chains.reset()
+    chains.trace_gains(qc_report is not None)
+    inst_chain = chains.instrumental
+    vocal_chain = chains.vocal
+    buss_chain = chains.buss
+    single_pass = loudness_target is not None
+    arena = chains.arena
+
+    def write(name, audio, readers=0):
+        # See process_song.
+        release = arena.releaser(audio, readers + 1)
+        stage("write." + name, writers[name].write, as_buffer(audio, "write." + name), release)
+        return release
+
+    def run_buss(summed):
+        summed_release = write("summed", summed, readers=1)
+        buss_processed = stage("buss", buss_chain.process, summed, preserve_input=True)
+        summed_release()
+        write("buss", buss_processed)
+
+    files = {"instrumental": output_instrumental_file, "vocal": output_vocal_file,
+             "summed": output_summed_file, "buss": output_buss_file}
+    peak = np.float32(0.0)
+    total_frames = 0
+    # Frames per spilled block; each is stored as one (2, frames) buffer.
+    block_frames = []
+    with tempfile.TemporaryFile() as spill, ExitStack() as outputs:
+        writers = open_writers(outputs, files, samplerate, sample_format, compression_level,
+                               loudness_target, true_peak_ceiling, loudness_report is not None, qc_report is not None)
+        with open_file_stream(instrumental_file, samplerate) as inst_in, \
+             open_file_stream(vocal_file, samplerate) as vocal_in:
+            while inst_in.tell() < inst_in.frames or vocal_in.tell() < vocal_in.frames:
+                inst_processed = np.zeros((2, 0), dtype=BUFFER_DTYPE)
+                vocal_processed = np.zeros((2, 0), dtype=BUFFER_DTYPE)
+                inst_release = vocal_release = None
+                if inst_in.tell() < inst_in.frames:
+                    inst_processed = stage("instrumental", inst_chain.process, stage("read.instrumental", inst_in.read, block_size))
+                    inst_release = write("instrumental", inst_processed, readers=1)
+                if vocal_in.tell() < vocal_in.frames:
+                    vocal_processed = stage("vocal", vocal_chain.process, stage("read.vocal", vocal_in.read, block_size))
+                    vocal_release = write("vocal", vocal_processed, readers=1)
+
+                summed = stage("sum", sum_buffers, inst_processed, vocal_processed, normalize=False,
+                               out=arena.take(sum_shape(inst_processed, vocal_processed)))
+                for release in (inst_release, vocal_release):
+                    if release is not None:
+                        release()
+                total_frames += summed.shape[1]
+                if single_pass:
+                    run_buss(summed)
+                    continue
+                peak = max(peak, peak_level(summed))
+                stage("write.spill", summed.tofile, spill)
+                block_frames.append(summed.shape[1])
+                arena.give(summed)
+
+        spill.seek(0)
+        for n in block_frames:
+            summed = arena.take((2, n))
+            stage("read.spill", spill.readinto, summed)
+            if peak > 1.0:
+                summed /= peak
+            run_buss(summed)
+    if loudness_report is not None:
+        loudness_report.update(loudness_measurements(writers))
+    if qc_report is not None:
+        qc_report.update(qc_measurements(writers, chains))
 
+    return total_frames
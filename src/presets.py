@@ -0,0 +1,341 @@
+# Preset files: the song chains described as data instead of code.
+#
+# A preset is a JSON (or, with PyYAML installed, YAML) file with one list of stages per
+# chain, "instrumental", "vocal" and "buss", run in order. A stage is a dict with a "type",
+# an optional "name" (used in profiles, defaults to the type) and the stage's parameters:
+#
+#   {"type": "Pedalboard", "name": "fxchain", "plugins": [{"type": "PeakFilter", "cutoff_frequency_hz": 111, ...}, ...]}
+#   {"type": "DistortionExciter", "drive": 16, ...}     dsp_scripts.distortion_exciter.DistortionExciter
+#   {"type": "BussCompressor", "threshold_db": -4.8, ...}  dsp_scripts.buss_compressor.BussCompressor
+#   {"type": "MonoToStereoUpmixer", "delay_ms": 100}      dsp_scripts.stereo_upmix.MonoToStereoUpmixer
+#   {"type": "DynamicSaturator", "mix_pct": 80}           dsp_scripts.saturator.dynamic_saturator
+#
+# Plugins are any Pedalboard plugin class, by class name, with its constructor arguments.
+# The sample rate and precision come from the render, not the preset. ../presets/default.json
+# is the chain fx.py renders with unless told otherwise.
+#
+# Compiling a preset builds the stage objects; fx.get_chains() caches them by preset hash,
+# sample rate, precision and fused_eq so a long-running process builds each one once. The
+# numba kernels take every parameter at call time and are compiled per argument type, so
+# compiling a new preset (or switching between cached ones) never recompiles a kernel.
+
+import os
+import sys
+import json
+import math
+import hashlib
+import numpy as np
+import pedalboard
+from pedalboard import Pedalboard
+from dsp_scripts import approx_math, sos_eq, precision as precision_module, registry
+from dsp_scripts.buss_compressor import BussCompressor
+from dsp_scripts.distortion_exciter import DistortionExciter
+from dsp_scripts.stereo_upmix import MonoToStereoUpmixer
+from dsp_scripts.saturator import dynamic_saturator
+from dsp_scripts.precision import get_precision, is_fast
+import fused_eq as fused_eq_module
+from fused_eq import fuse_eq
+from stage_cache import combine, source_hash
+
+DEFAULT_PRESET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "presets", "default.json")
+
+CHAINS = ("instrumental", "vocal", "buss")
+
+_default_preset = None
+
+def load_preset(source=None):
+    """
+    Load and validate a preset.
+
+    Parameters:
+        source (str or dict): Path to a .json/.yaml/.yml file, an already loaded preset,
+                              or None for the default preset.
+
+    Returns:
+        dict: The preset.
+    """
+    global _default_preset
+    if source is None:
+        if _default_preset is None:
+            _default_preset = load_preset(DEFAULT_PRESET)
+        return _default_preset
+    if isinstance(source, dict):
+        preset = source
+    else:
+        with open(source) as f:
+            if source.endswith((".yaml", ".yml")):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError(f"Reading {source} needs PyYAML (pip install pyyaml); JSON presets don't.")
+                preset = yaml.safe_load(f)
+            else:
+                preset = json.load(f)
+    validate(preset)
+    return preset
+
+def validate(preset):
+    # Catch typos up front instead of halfway through a render. Parameter names are
+    # checked when the stages are built.
+    if not isinstance(preset, dict):
+        raise ValueError("A preset must be a mapping of chain name to a list of stages.")
+    for chain in CHAINS:
+        if not isinstance(preset.get(chain), list):
+            raise ValueError(f"Preset is missing the {chain!r} chain (a list of stages).")
+        for i, spec in enumerate(preset[chain]):
+            where = f"{chain}[{i}]"
+            if not isinstance(spec, dict) or spec.get("type") not in STAGE_TYPES:
+                raise ValueError(f"{where}: unknown stage type {spec.get('type') if isinstance(spec, dict) else spec!r}, "
+                                 f"expected one of {', '.join(STAGE_TYPES)}.")
+            if spec["type"] == "Pedalboard":
+                for j, plugin in enumerate(spec.get("plugins", [])):
+                    plugin_class = getattr(pedalboard, str(plugin.get("type")), None)
+                    if not (isinstance(plugin_class, type) and issubclass(plugin_class, pedalboard.Plugin)):
+                        raise ValueError(f"{where}.plugins[{j}]: {plugin.get('type')!r} is not a Pedalboard plugin.")
+
+def preset_hash(preset):
+    """
+    Content hash of a preset: the same stages and parameters give the same hash,
+    whatever the key order or formatting of the file.
+    """
+    canonical = json.dumps(preset, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+def build_board(plugins):
+    """
+    A Pedalboard from a list of plugin specs ({"type": "PeakFilter", ...}).
+    """
+    board = []
+    for plugin in plugins:
+        params = {k: v for k, v in plugin.items() if k != "type"}
+        board.append(getattr(pedalboard, plugin["type"])(**params))
+    return Pedalboard(board)
+
+def preset_board(chain, name, preset=None):
+    """
+    A fresh Pedalboard built from the Pedalboard stage called name in chain of a preset
+    (the default preset if None).
+    """
+    for spec in load_preset(preset)[chain]:
+        if spec["type"] == "Pedalboard" and spec.get("name", "Pedalboard") == name:
+            return build_board(spec.get("plugins", []))
+    raise KeyError(f"No Pedalboard stage named {name!r} in the {chain} chain.")
+
+# Stages. Each one takes and returns a (channels, frames) contract buffer (see fx.py).
+# Those with in_place set write their output over their input. Those with
+# output_shape(audio) can write it into a given buffer of that shape instead,
+# process(audio, out=buffer), which is how a chain with an arena runs them. Those with
+# gain_shape(audio) can also report the gain they apply to every sample,
+# process(audio, gains=buffer), for the QC report (see fx.Chain.trace_gains).
+#
+# Each stage also declares how it can be split into segments rendered separately (see
+# segments.py): segmenting(settle_frames) returns (mode, history_frames), the mode being
+#   EXACT        the state is rebuilt exactly by pre-rolling history_frames of input
+#   APPROXIMATE  decaying state (filters, envelopes, reverb tails): pre-rolling
+#                history_frames (settle_frames per such part) brings it within tolerance
+#   UNSUPPORTED  state that depends on absolute time or the whole past (LFOs, codecs)
+# Stages with needs_prefix can also start mid-signal, but need prime(summarize(prefix))
+# with everything before the pre-roll, so they must come first in their chain.
+
+EXACT = "exact"
+APPROXIMATE = "approximate"
+UNSUPPORTED = "unsupported"
+SEGMENT_MODES = (EXACT, APPROXIMATE, UNSUPPORTED)
+
+# Plugins without state, or whose state is a fixed window of past input.
+_STATELESS_PLUGINS = ("Gain", "Invert", "Clipping", "Distortion", "Bitcrush")
+# Plugins whose state decays: IIR filters, envelope followers, feedback delays, reverbs.
+_DECAYING_PLUGINS = ("HighpassFilter", "LowpassFilter", "PeakFilter", "HighShelfFilter", "LowShelfFilter",
+                     "LadderFilter", "IIRFilter", "Compressor", "Limiter", "NoiseGate", "Reverb", "Convolution")
+
+def plugin_segmenting(plugin, samplerate, settle_frames):
+    name = type(plugin).__name__
+    if name in _STATELESS_PLUGINS:
+        return EXACT, 0
+    if name == "Delay" and plugin.feedback == 0:
+        # Without feedback the output only depends on the last delay_seconds of input.
+        return EXACT, int(math.ceil(plugin.delay_seconds * samplerate)) + 1
+    if name in _DECAYING_PLUGINS or name == "Delay":
+        return APPROXIMATE, settle_frames
+    return UNSUPPORTED, 0
+
+def combine_segmenting(modes):
+    """
+    Combine (mode, history_frames) of stages run one after the other into the weakest
+    mode and the history of the whole run. Windows of exact history add up; decaying
+    state in every stage settles side by side from the start of the pre-roll, so those
+    need the longest settle time, not their sum.
+    """
+    mode = max((m for m, _ in modes), key=SEGMENT_MODES.index, default=EXACT)
+    exact = sum(h for m, h in modes if m == EXACT)
+    settle = max((h for m, h in modes if m == APPROXIMATE), default=0)
+    return mode, exact + settle
+
+class BoardStage:
+    in_place = False
+    needs_prefix = False
+
+    def __init__(self, board, samplerate, plugins=()):
+        self.board = board
+        self.samplerate = samplerate
+        self.plugins = list(plugins)
+
+    def reset(self):
+        self.board.reset()
+
+    def process(self, audio):
+        return self.board(audio, self.samplerate, reset=False)
+
+    def segmenting(self, settle_frames):
+        return combine_segmenting([plugin_segmenting(p, self.samplerate, settle_frames) for p in self.plugins])
+
+class KernelStage:
+    # Compressor: process_block in place on the buffer.
+    in_place = True
+    needs_prefix = False
+
+    def __init__(self, kernel):
+        self.kernel = kernel
+
+    def reset(self):
+        self.kernel.reset()
+
+    def output_shape(self, audio):
+        return audio.shape
+
+    def gain_shape(self, audio):
+        return (self.kernel.gain_rows(audio.shape[0]), audio.shape[1])
+
+    def process(self, audio, out=None, gains=None):
+        return self.kernel.process_block(audio, channels_first=True, out=audio if out is None else out, gains=gains)
+
+    def segmenting(self, settle_frames):
+        # Envelope follower and filters.
+        return APPROXIMATE, settle_frames
+
+    @property
+    def segment_align(self):
+        # A control-rate compressor computes its gain on a grid of control_rate samples,
+        # so a segment must start on that grid to line up with the continuous render.
+        return getattr(self.kernel, "control_rate", 1)
+
+class ExciterStage(KernelStage):
+    # The exciter's gain follower only ever falls, so its state depends on the loudest
+    # sample of the whole past; prime() restores it exactly from the input's peak. The
+    # highpass filters need a pre-roll that grows as the cutoff falls (see
+    # DistortionExciter.settle_frames): about 20 samples at the default cutoff. Cutoffs
+    # so low that it's longer than the settle time get the settle time instead.
+    needs_prefix = True
+
+    def segmenting(self, settle_frames):
+        history = self.kernel.settle_frames()
+        if history > settle_frames:
+            return APPROXIMATE, settle_frames
+        return EXACT, history
+
+    def summarize(self, prefix):
+        return np.max(np.abs(prefix), axis=1)
+
+    def prime(self, summary):
+        self.kernel.prime(summary)
+
+class UpmixStage:
+    in_place = False
+    needs_prefix = False
+
+    def __init__(self, upmixer):
+        self.upmixer = upmixer
+
+    def reset(self):
+        self.upmixer.reset()
+
+    def output_shape(self, audio):
+        return (2, audio.shape[-1])
+
+    def process(self, audio, out=None):
+        return self.upmixer.process_buffer(audio, channels_first=True, out=out)
+
+    def segmenting(self, settle_frames):
+        # The state is a delay line holding the last samples.
+        return EXACT, self.upmixer.delay_buffer.shape[0]
+
+class SaturatorStage:
+    in_place = True
+    needs_prefix = False
+
+    def __init__(self, mix_pct=100, approx_sine=False):
+        self.mix_pct = mix_pct
+        self.approx_sine = approx_sine
+
+    def reset(self):
+        pass
+
+    def output_shape(self, audio):
+        return audio.shape
+
+    def process(self, audio, out=None):
+        return dynamic_saturator(audio, self.mix_pct, out=audio if out is None else out, approx_sine=self.approx_sine)
+
+    def segmenting(self, settle_frames):
+        return EXACT, 0
+
+def _pedalboard_stage(params, samplerate, precision, fused_eq):
+    board = build_board(params.get("plugins", []))
+    return BoardStage(fuse_eq(board) if fused_eq else board, samplerate, board)
+
+STAGE_TYPES = {
+    "Pedalboard": _pedalboard_stage,
+    "DistortionExciter": lambda params, samplerate, precision, fused_eq:
+        ExciterStage(DistortionExciter(samplerate, precision=precision, **params)),
+    "BussCompressor": lambda params, samplerate, precision, fused_eq:
+        KernelStage(BussCompressor(samplerate, precision=precision, **params)),
+    "MonoToStereoUpmixer": lambda params, samplerate, precision, fused_eq:
+        UpmixStage(MonoToStereoUpmixer(samplerate, precision=precision, **params)),
+    "DynamicSaturator": lambda params, samplerate, precision, fused_eq:
+        SaturatorStage(approx_sine=is_fast(precision), **params),
+}
+
+def _backend_modules(module):
+    # Names of the modules the backends of the effects module registers come from: module
+    # itself, reference.py, and whatever else a backend is imported from.
+    names = {module.__name__}
+    for effect in registry.effects().values():
+        found = {getattr(backend.function, "py_func", backend.function).__module__ for backend in effect.backends.values()}
+        if module.__name__ in found:
+            names |= found
+    return sorted(names)
+
+# The modules whose code decides a stage's output, for its cache fingerprint (see
+# stage_cache.py): the kernel's, those of its backends, and those that pick the backend and
+# the precision. Pedalboard stages also depend on the Pedalboard version.
+def _stage_code(stage_type, fused_eq):
+    if stage_type == "Pedalboard":
+        modules = (fused_eq_module, sos_eq) if fused_eq else ()
+        return combine(pedalboard.__version__, source_hash(*modules))
+    kernel = {"DistortionExciter": DistortionExciter, "BussCompressor": BussCompressor,
+              "MonoToStereoUpmixer": MonoToStereoUpmixer, "DynamicSaturator": dynamic_saturator}[stage_type]
+    backends = [sys.modules[name] for name in _backend_modules(sys.modules[kernel.__module__])]
+    return source_hash(*backends, approx_math, precision_module, registry, sys.modules[__name__])
+
+def build_stages(preset, chain, samplerate, precision=None, fused_eq=False):
+    """
+    Build the stages of one chain of a preset.
+
+    Every stage gets a fingerprint: a hash of its preset entry, the render settings and its
+    code, which keys its output in the stage cache.
+
+    Returns:
+        list: (name, stage) pairs in processing order.
+    """
+    precision = precision or get_precision()
+    stages = []
+    for i, spec in enumerate(preset[chain]):
+        params = {k: v for k, v in spec.items() if k not in ("type", "name")}
+        try:
+            built = STAGE_TYPES[spec["type"]](params, samplerate, precision, fused_eq)
+        except TypeError as e:
+            raise ValueError(f"{chain}[{i}] ({spec['type']}): {e}") from e
+        built.fingerprint = combine(json.dumps(spec, sort_keys=True), float(samplerate), precision, bool(fused_eq),
+                                    _stage_code(spec["type"], fused_eq))
+        stages.append((spec.get("name", spec["type"]), built))
+    return stages
@@ -0,0 +1,148 @@
+# Opt-in per-stage instrumentation for the fx chains.
+#
+# fx.py runs every stage (Pedalboard chains, dsp_scripts kernels, the sum, file reads and
+# writes) through stage(). While profiling is off that is a plain function call. After
+# enable() each call is recorded with its wall time, CPU time (of the calling thread),
+# bytes allocated, and the shape/dtype of its array inputs and output.
+#
+#   profiling.enable()
+#   process_song(...)
+#   profiling.disable().save("profile.json")            # events + per-stage summary
+#   profiling.disable().save("trace.json", "chrome")    # open in chrome://tracing or Perfetto
+#
+# Allocations are traced with tracemalloc, which covers NumPy and numba arrays but not
+# Pedalboard's internal buffers. tracemalloc is process-wide, so when stages run concurrently
+# (process_song with more than one worker) their allocation counts overlap; render with
+# max_workers=1 or in streaming mode for exact per-stage numbers.
+
+import os
+import json
+import time
+import threading
+import tracemalloc
+import numpy as np
+
+_profiler = None
+
+def stage(name, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs), recording it as stage name if profiling is enabled.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return func(*args, **kwargs)
+    return profiler.record(name, func, args, kwargs)
+
+def enable(trace_memory=True):
+    """
+    Start recording stages. Returns the Profiler.
+    """
+    global _profiler
+    _profiler = Profiler(trace_memory)
+    return _profiler
+
+def disable():
+    """
+    Stop recording. Returns the Profiler that was active (None if there wasn't one).
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def is_enabled():
+    return _profiler is not None
+
+def describe(value):
+    # Shape and dtype of an array argument or result, None for anything else.
+    if isinstance(value, np.ndarray):
+        return {"shape": list(value.shape), "dtype": value.dtype.name}
+    return None
+
+class Profiler:
+    def __init__(self, trace_memory=True):
+        self.events = []
+        self.lock = threading.Lock()
+        self.trace_memory = trace_memory
+        self.started_tracemalloc = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.origin = time.perf_counter()
+
+    def stop(self):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def record(self, name, func, args, kwargs):
+        memory_before = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        wall = time.perf_counter() - start
+        cpu = time.thread_time() - cpu_start
+        memory_after = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+
+        event = {
+            "name": name,
+            "start_seconds": start - self.origin,
+            "wall_seconds": wall,
+            "cpu_seconds": cpu,
+            "allocated_bytes": max(memory_after - memory_before, 0) if self.trace_memory else None,
+            "thread": threading.get_ident(),
+            "inputs": [d for d in map(describe, list(args) + list(kwargs.values())) if d is not None],
+            "output": describe(result),
+        }
+        with self.lock:
+            self.events.append(event)
+        return result
+
+    def summary(self):
+        """
+        Per-stage totals: calls, wall_seconds, cpu_seconds, allocated_bytes, in order of first call.
+        """
+        stages = {}
+        for event in sorted(self.events, key=lambda e: e["start_seconds"]):
+            total = stages.setdefault(event["name"], {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                      "allocated_bytes": 0})
+            total["calls"] += 1
+            total["wall_seconds"] += event["wall_seconds"]
+            total["cpu_seconds"] += event["cpu_seconds"]
+            total["allocated_bytes"] += event["allocated_bytes"] or 0
+        return stages
+
+    def chrome_trace(self):
+        """
+        The events in Chrome's trace event format (complete "X" events, microseconds).
+        """
+        pid = os.getpid()
+        trace = []
+        for event in self.events:
+            trace.append({
+                "name": event["name"], "cat": "stage", "ph": "X", "pid": pid, "tid": event["thread"],
+                "ts": event["start_seconds"] * 1e6, "dur": event["wall_seconds"] * 1e6,
+                "args": {"cpu_ms": event["cpu_seconds"] * 1000, "allocated_bytes": event["allocated_bytes"],
+                         "inputs": event["inputs"], "output": event["output"]},
+            })
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def save(self, file_path, format="json"):
+        """
+        Write the profile. format is "json" (events and summary) or "chrome" (a trace file).
+        """
+        if format == "chrome":
+            data = self.chrome_trace()
+        elif format == "json":
+            data = {"summary": self.summary(), "events": self.events}
+        else:
+            raise ValueError(f"Unknown profile format {format!r}, expected 'json' or 'chrome'.")
+        with open(file_path, "w") as f:
+            json.dump(data, f, indent=1)
+
+    def print_summary(self):
+        print(f"{'stage':32s} {'calls':>6s} {'wall ms':>10s} {'cpu ms':>10s} {'alloc MiB':>10s}")
+        for name, total in self.summary().items():
+            print(f"{name:32s} {total['calls']:6d} {total['wall_seconds'] * 1000:10.1f} "
+                  f"{total['cpu_seconds'] * 1000:10.1f} {total['allocated_bytes'] / 2**20:10.1f}")
@@ -0,0 +1,193 @@
+# Segment-parallel rendering: a long song is cut into segments that are rendered on a pool
+# of processes and stitched back together, so one song can use every core.
+#
+# A chain is stateful, so a segment can't simply start from a reset chain: every segment
+# is rendered from a window that starts history_frames early (the pre-roll), and the
+# pre-rolled part of the output is dropped. How much history a chain needs, and whether
+# that reproduces the continuous render, is declared by its stages (see presets.py):
+#
+#   exact        stateless stages and delay lines, plus the exciter, whose gain follower
+#                is primed from the peak of everything before the window
+#   approximate  stages with decaying state (IIR filters, compressors, reverbs) get
+#                SEGMENT_SETTLE_SECONDS of pre-roll each. With the default 3 s the
+#                difference at the segment joins is below -120 dBFS (reverb tails decay
+#                slowest), so 16- and 24-bit outputs are identical in practice
+#   unsupported  LFO-driven or otherwise time-dependent plugins: that chain is rendered
+#                as a single segment
+#
+# A chain is as good as its weakest stage. With allow_approximate=False approximate chains
+# are rendered as one segment too, which keeps the output bit-identical to process_song.
+# The summed mix is peak normalized over the whole song, so the instrumental and vocal
+# chains are rendered (in parallel), summed, and then the buss is split in turn.
+
+import os
+import math
+import multiprocessing
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import numba
+from dsp_scripts import warmup
+from dsp_scripts.precision import set_precision
+from presets import APPROXIMATE, UNSUPPORTED, combine_segmenting
+from fx import (SongChains, get_chains, sum_buffers, as_buffer, open_writers, loudness_measurements, qc_measurements,
+                DEFAULT_TRUE_PEAK_CEILING)
+from utils import open_file, DEFAULT_SAMPLE_FORMAT
+from profiling import stage
+
+# Pre-roll for each stage with decaying state. Measured on the default chains after the
+# pre-roll: Pedalboard's filters and compressor and the buss compressor are bit-exact after
+# 2 s, the vocal reverb (wet 0.15) is 125 dB down after 2 s and exact after 4 s.
+SEGMENT_SETTLE_SECONDS = 3.0
+
+# Segments shorter than this aren't split further; the pre-roll would cost more than it saves.
+MIN_SEGMENT_SECONDS = 10.0
+
+def chain_segmenting(chain, samplerate, settle_seconds=SEGMENT_SETTLE_SECONDS):
+    """
+    How a chain can be split.
+
+    Returns:
+        tuple: (mode, history_frames), mode being "exact", "approximate" or "unsupported".
+    """
+    settle_frames = int(settle_seconds * samplerate)
+    modes = []
+    for i, (_, chain_stage) in enumerate(chain.stages):
+        mode, history = chain_stage.segmenting(settle_frames)
+        if chain_stage.needs_prefix and i > 0:
+            # Its prefix would be the output of the stages before it, which we don't have.
+            mode = UNSUPPORTED
+        modes.append((mode, history))
+    return combine_segmenting(modes)
+
+def chain_align(chain):
+    """
+    The sample grid a chain's segment windows must start on (see KernelStage.segment_align).
+    """
+    return math.lcm(*(getattr(chain_stage, "segment_align", 1) for _, chain_stage in chain.stages))
+
+def plan_segments(frames, n_segments, history, align=1):
+    """
+    Split frames into n_segments.
+
+    Returns:
+        list: (window_start, start, end) per segment; window_start is start minus the
+              pre-roll, clipped at 0 and rounded down to a multiple of align.
+    """
+    bounds = np.linspace(0, frames, n_segments + 1).astype(np.int64)
+    return [(max(0, start - history) // align * align, start, end)
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+def _init_worker(precision):
+    # Every worker is one of the cores already; keep numba's parallel kernels serial.
+    numba.set_num_threads(1)
+    set_precision(precision)
+    warmup(precision)
+
+def _render_segment(samplerate, preset, precision, fused_eq, chain_name, window, preroll, summary):
+    chain = getattr(get_chains(samplerate, preset, precision, fused_eq), chain_name)
+    chain.reset()
+    if summary is not None:
+        chain.stages[0][1].prime(summary)
+    processed = chain.process(window)
+    segment = np.array(processed[:, preroll:], order="C")
+    chain.arena.give(processed)
+    return segment
+
+def submit_chain(pool, chains, name, audio, n_segments, settle_seconds=SEGMENT_SETTLE_SECONDS, allow_approximate=True):
+    """
+    Submit the segments of one chain over audio to pool.
+
+    Returns:
+        list: Futures of the segment outputs, in order; see stitch.
+    """
+    chain = getattr(chains, name)
+    mode, history = chain_segmenting(chain, chains.samplerate, settle_seconds)
+    frames = audio.shape[1]
+    if mode == UNSUPPORTED or (mode == APPROXIMATE and not allow_approximate):
+        n_segments = 1
+    n_segments = max(1, min(n_segments, int(frames / (MIN_SEGMENT_SECONDS * chains.samplerate))))
+    first = chain.stages[0][1] if chain.stages else None
+    futures = []
+    for window_start, start, end in plan_segments(frames, n_segments, history, chain_align(chain)):
+        summary = None
+        if first is not None and first.needs_prefix and window_start > 0:
+            summary = first.summarize(audio[:, :window_start])
+        futures.append(pool.submit(_render_segment, chains.samplerate, chains.preset, chains.precision, chains.fused_eq,
+                                   name, audio[:, window_start:end], start - window_start, summary))
+    return futures
+
+def stitch(futures):
+    return np.concatenate([future.result() for future in futures], axis=1)
+
+def describe(chains, settle_seconds=SEGMENT_SETTLE_SECONDS):
+    """
+    {chain name: (mode, history seconds)} for chains, for reporting.
+    """
+    described = {}
+    for name in ("instrumental", "vocal", "buss"):
+        mode, history = chain_segmenting(getattr(chains, name), chains.samplerate, settle_seconds)
+        described[name] = (mode, history / chains.samplerate)
+    return described
+
+def process_song_segmented(instrumental_file, vocal_file,
+                           output_instrumental_file, output_vocal_file, output_summed_file, output_buss_file,
+                           samplerate, chains=None, workers=None, segments=None,
+                           settle_seconds=SEGMENT_SETTLE_SECONDS, allow_approximate=True,
+                           sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None,
+                           loudness_target=None, true_peak_ceiling=DEFAULT_TRUE_PEAK_CEILING, loudness_report=None,
+                           qc_report=None):
+    """
+    Render a song like process_song, with each chain split into segments rendered on a
+    pool of worker processes.
+
+    Parameters:
+        chains (SongChains): Chains whose preset, precision and fused_eq the workers build;
+                             the default chains if None. Not used for processing.
+        workers (int): Worker processes (default: CPU count).
+        segments (int): Segments per chain (default: workers). Chains that can't be split,
+                        and songs too short for it, use fewer.
+        settle_seconds (float): Pre-roll per stage with decaying state.
+        allow_approximate (bool): Split chains whose split is only approximate.
+        loudness_target, true_peak_ceiling, loudness_report: Loudness normalization and
+                                                              measurement, see fx.process_song.
+        qc_report (dict): If given, filled with the QC report of the outputs, see
+                          fx.process_song. The stages run in the workers, so there are no
+                          gain traces.
+
+    Returns:
+        int: The number of frames in the summed/buss output.
+    """
+    if chains is None:
+        chains = SongChains(samplerate)
+    workers = workers or os.cpu_count()
+    segments = segments or workers
+
+    def write(name, audio):
+        stage("write." + name, writers[name].write, as_buffer(audio, "write." + name))
+
+    files = {"instrumental": output_instrumental_file, "vocal": output_vocal_file,
+             "summed": output_summed_file, "buss": output_buss_file}
+    with ExitStack() as outputs:
+        writers = open_writers(outputs, files, samplerate, sample_format, compression_level,
+                               loudness_target, true_peak_ceiling, loudness_report is not None, qc_report is not None)
+        # Spawned, not forked: numba's OpenMP runtime may already be running in this process.
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(chains.precision,)) as pool:
+            inst = stage("read.instrumental", open_file, instrumental_file, samplerate)
+            vocal = stage("read.vocal", open_file, vocal_file, samplerate)
+            inst_segments = submit_chain(pool, chains, "instrumental", inst, segments, settle_seconds, allow_approximate)
+            vocal_segments = submit_chain(pool, chains, "vocal", vocal, segments, settle_seconds, allow_approximate)
+            inst_processed = stage("instrumental", stitch, inst_segments)
+            write("instrumental", inst_processed)
+            vocal_processed = stage("vocal", stitch, vocal_segments)
+            write("vocal", vocal_processed)
+            summed = stage("sum", sum_buffers, inst_processed, vocal_processed, loudness_target is None)
+            write("summed", summed)
+            buss = stage("buss", stitch, submit_chain(pool, chains, "buss", summed, segments, settle_seconds, allow_approximate))
+            write("buss", buss)
+    if loudness_report is not None:
+        loudness_report.update(loudness_measurements(writers))
+    if qc_report is not None:
+        qc_report.update(qc_measurements(writers))
+    return summed.shape[1]
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# Long-running local render service: keeps a pool of warm worker processes (kernels compiled,
+# chains built, see batch.init_worker) and renders vocal/instrumental pairs sent to it over a
+# small HTTP/JSON API, so a render doesn't pay for imports, JIT and chain building.
+#
+#   POST /jobs        {"vocal": path, "instrumental": path, "preset": path (optional),
+#                      "name": label (optional)}  ->  202 {"id": ..., "status": "queued"}
+#   GET  /jobs        every job the service remembers, newest last
+#   GET  /jobs/<id>   one job: status (queued, running, done, failed), timings, outputs, error,
+#                     the outputs' loudness with --measure-loudness or --loudness-target,
+#                     and the path of its QC report (qc.json in its output folder) with --qc
+#   GET  /stats       queue depth, running jobs, latency percentiles and realtime factor
+#
+# Paths are on the service's machine; outputs go to <out>/<id>/ with app.py's file names. At
+# most --jobs songs render at once, the rest wait in a FIFO queue. The service listens on
+# 127.0.0.1 unless told otherwise.
+#
+#   python service.py --port 8765 --jobs 4
+#   curl -d '{"vocal": "../input_files/v.wav", "instrumental": "../input_files/i.wav"}' localhost:8765/jobs
+#   curl localhost:8765/stats
+
+import os
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+import collections
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import batch
+from dsp_scripts.precision import PRECISIONS, get_precision
+from fx import DEFAULT_BLOCK_SIZE, DEFAULT_LOUDNESS_TARGET, DEFAULT_TRUE_PEAK_CEILING
+from stage_cache import STAGE_CACHE_DIR
+from utils import OUTPUT_FORMATS, SAMPLE_FORMATS, DEFAULT_SAMPLE_FORMAT, output_format
+
+# Finished jobs the service remembers (for GET /jobs/<id>), and finished jobs the latency
+# percentiles and realtime factor are computed over.
+MAX_FINISHED_JOBS = 1000
+STATS_WINDOW = 1000
+
+class RenderService:
+    def __init__(self, options, n_jobs):
+        """
+        A job queue in front of a pool of n_jobs warm batch workers.
+
+        Parameters:
+            options (dict): Worker options, see batch.worker_options.
+            n_jobs (int): Worker processes, i.e. how many songs render at once.
+        """
+        self.options = options
+        self.n_jobs = n_jobs
+        self.pool = multiprocessing.Pool(n_jobs, initializer=batch.init_worker, initargs=(options,))
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.next_id = 1
+        self.started = time.time()
+        # (latency, render seconds, audio seconds) of the last STATS_WINDOW finished jobs.
+        self.finished = collections.deque(maxlen=STATS_WINDOW)
+        # One dispatcher per worker: it takes the next job off the queue and waits for the
+        # pool to render it, so a job counts as queued until a worker is actually free.
+        self.dispatchers = [threading.Thread(target=self._dispatch, name=f"dispatch.{i}", daemon=True)
+                            for i in range(n_jobs)]
+        for dispatcher in self.dispatchers:
+            dispatcher.start()
+
+    def submit(self, vocal_file, instrumental_file, preset_file=None, name=None):
+        """
+        Queue a song.
+
+        Returns:
+            dict: The new job's record (see job()).
+
+        Raises:
+            ValueError: If an input or the preset file doesn't exist.
+        """
+        for path in (vocal_file, instrumental_file) + ((preset_file,) if preset_file else ()):
+            if not os.path.isfile(path):
+                raise ValueError(f"No such file: {path}")
+        with self.lock:
+            job_id = f"{self.next_id:06d}"
+            self.next_id += 1
+            record = {"id": job_id, "name": name or job_id, "status": "queued",
+                      "vocal": vocal_file, "instrumental": instrumental_file, "preset": preset_file,
+                      "submitted": time.time(), "started": None, "finished": None,
+                      "seconds": None, "audio_seconds": None, "loudness": None, "qc": None, "error": None,
+                      "outputs": list(batch.output_files(os.path.join(self.options["out"], job_id), self.options["container"]))}
+            self.jobs[job_id] = record
+            self._forget_old()
+            self.queue.put(record)
+            return dict(record)
+
+    def _forget_old(self):
+        finished = [job_id for job_id, record in self.jobs.items() if record["status"] in ("done", "failed")]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _dispatch(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            with self.lock:
+                record["status"] = "running"
+                record["started"] = time.time()
+                self.running += 1
+            try:
+                result = self.pool.apply(batch.run_job, ((record["id"], record["vocal"], record["instrumental"], record["preset"]),))
+            except Exception as e:
+                # The pool itself failed (e.g. a worker was killed); run_job catches render errors.
+                result = {"ok": False, "error": repr(e), "seconds": time.time() - record["started"], "audio_seconds": 0.0,
+                          "loudness": None, "qc": None}
+            with self.lock:
+                self.running -= 1
+                record["finished"] = time.time()
+                record["seconds"] = result["seconds"]
+                record["audio_seconds"] = result["audio_seconds"]
+                record["loudness"] = result["loudness"]
+                record["qc"] = result["qc"]
+                if result["ok"]:
+                    record["status"] = "done"
+                    self.completed += 1
+                    self.finished.append((record["finished"] - record["submitted"], result["seconds"], result["audio_seconds"]))
+                else:
+                    record["status"] = "failed"
+                    record["error"] = result["error"]
+                    self.failed += 1
+
+    def job(self, job_id):
+        # A copy of a job's record, None for an unknown (or forgotten) id.
+        with self.lock:
+            record = self.jobs.get(job_id)
+            return None if record is None else dict(record)
+
+    def list_jobs(self):
+        with self.lock:
+            return [dict(record) for record in self.jobs.values()]
+
+    def stats(self):
+        """
+        Returns:
+            dict: queued and running jobs, totals, and over the last STATS_WINDOW successful
+                  jobs: latency (submit to finish) and render time percentiles, and the
+                  realtime factor (seconds of audio per second of render).
+        """
+        with self.lock:
+            finished = list(self.finished)
+            stats = {"queued": self.queue.qsize(), "running": self.running, "workers": self.n_jobs,
+                     "completed": self.completed, "failed": self.failed,
+                     "uptime_seconds": time.time() - self.started}
+        if finished:
+            latency, render, audio = (np.array(column) for column in zip(*finished))
+            stats["latency_seconds"] = percentiles(latency)
+            stats["render_seconds"] = percentiles(render)
+            stats["realtime_factor"] = float(audio.sum() / render.sum()) if render.sum() > 0 else None
+        else:
+            stats["latency_seconds"] = stats["render_seconds"] = stats["realtime_factor"] = None
+        return stats
+
+    def close(self):
+        # Jobs still queued are dropped; running ones are stopped with the pool.
+        for _ in self.dispatchers:
+            self.queue.put(None)
+        self.pool.terminate()
+        self.pool.join()
+
+def percentiles(values):
+    p50, p90, p99 = np.percentile(values, (50, 90, 99))
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(values.max())}
+
+class Handler(BaseHTTPRequestHandler):
+    # self.server.service is the RenderService.
+
+    def _reply(self, status, body):
+        data = json.dumps(body, indent=2).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        path = self.path.rstrip("/")
+        if path == "/stats":
+            self._reply(200, service.stats())
+        elif path == "/jobs":
+            self._reply(200, service.list_jobs())
+        elif path.startswith("/jobs/"):
+            record = service.job(path[len("/jobs/"):])
+            if record is None:
+                self._reply(404, {"error": "Unknown job."})
+            else:
+                self._reply(200, record)
+        else:
+            self._reply(404, {"error": "Not found."})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._reply(404, {"error": "Not found."})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            record = self.server.service.submit(body["vocal"], body["instrumental"], body.get("preset"), body.get("name"))
+        except KeyError as e:
+            self._reply(400, {"error": f"Missing field {e}."})
+        except (ValueError, TypeError, AttributeError) as e:
+            self._reply(400, {"error": str(e)})
+        else:
+            self._reply(202, record)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def make_server(service, host="127.0.0.1", port=8765, verbose=False):
+    """
+    An HTTP server for service; call serve_forever() on it. Port 0 picks a free port
+    (see server.server_address).
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+def main():
+    parser = argparse.ArgumentParser(description="Render vocal/instrumental pairs sent over a local HTTP API, on warm workers.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1, this machine only).")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765, 0 for any free port).")
+    parser.add_argument("--out", default="../service_output", help="Output directory, one folder per job (default: ../service_output).")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Songs rendered at once (default: CPU count).")
+    parser.add_argument("--stream", action="store_true", help="Render each song block by block (see app.py --stream).")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="Frames per block in streaming mode.")
+    parser.add_argument("--threads", type=int, default=1, help="Threads per worker (see batch.py --threads).")
+    parser.add_argument("--precision", choices=PRECISIONS, default=get_precision(),
+                        help="Numeric precision of the DSP kernels (see app.py --precision).")
+    parser.add_argument("--fused-eq", action="store_true", help="Run the EQ filters as fused biquad cascades (see app.py --fused-eq).")
+    parser.add_argument("--preset", help="Chain preset for jobs that don't name their own (default: ../presets/default.json).")
+    parser.add_argument("--format", choices=tuple(OUTPUT_FORMATS), default="wav", help="Container of the output files (default: wav).")
+    parser.add_argument("--sample-format", choices=tuple(SAMPLE_FORMATS), default=DEFAULT_SAMPLE_FORMAT,
+                        help="Sample format of the output files (see app.py --sample-format).")
+    parser.add_argument("--flac-level", type=int, choices=range(9), metavar="0-8", help="FLAC compression level (see app.py --flac-level).")
+    parser.add_argument("--loudness-target", nargs="?", type=float, const=DEFAULT_LOUDNESS_TARGET, metavar="LUFS",
+                        help="Loudness normalize the summed and buss outputs (see app.py --loudness-target).")
+    parser.add_argument("--true-peak-ceiling", type=float, default=DEFAULT_TRUE_PEAK_CEILING, metavar="DBTP",
+                        help="True peak the loudness normalization stays under (see app.py --true-peak-ceiling).")
+    parser.add_argument("--measure-loudness", action="store_true",
+                        help="Measure the outputs' loudness and report it with each job (see app.py --measure-loudness).")
+    parser.add_argument("--qc", action="store_true", help="Save a QC report of every job next to its outputs (see app.py --qc).")
+    parser.add_argument("--stage-cache", nargs="?", const=STAGE_CACHE_DIR, metavar="DIR",
+                        help="Cache stage outputs and only re-run what changed (see app.py --stage-cache). Not with --stream.")
+    parser.add_argument("--stage-cache-max-mb", type=float, help="Size cap of the stage cache (see app.py --stage-cache-max-mb).")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args()
+    if args.stage_cache and args.stream:
+        parser.error("--stage-cache works on whole-file renders, not with --stream.")
+    try:
+        output_format("out." + args.format, args.sample_format, args.flac_level)
+    except ValueError as e:
+        parser.error(str(e))
+
+    options = batch.worker_options(args.out, stream=args.stream, block_size=args.block_size, threads=args.threads,
+                                   precision=args.precision, fused_eq=args.fused_eq, preset=args.preset,
+                                   container=args.format, sample_format=args.sample_format, compression_level=args.flac_level,
+                                   stage_cache=args.stage_cache,
+                                   stage_cache_max_bytes=None if args.stage_cache_max_mb is None else int(args.stage_cache_max_mb * 2**20),
+                                   loudness_target=args.loudness_target, true_peak_ceiling=args.true_peak_ceiling,
+                                   measure_loudness=args.measure_loudness, qc=args.qc)
+    service = RenderService(options, args.jobs)
+    # Stop cleanly on SIGTERM (e.g. from a process manager) as on Ctrl-C. Set after the
+    # pool has started, so the workers keep the default handler.
+    signal.signal(signal.SIGTERM, _terminate)
+    server = make_server(service, args.host, args.port, args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Render service on http://{host}:{port}/ with {args.jobs} workers, outputs in {args.out}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Content-addressed cache of stage outputs, for fast re-renders after a parameter tweak.
+#
+# Every stage output of a whole-file render (fx.process_song with cache=) is stored as an
+# .npy file named by a key that hashes everything the output depends on:
+#
+#   input key   hash of the input file's content and the render sample rate
+#   stage key   hash(previous key, the stage's preset entry, sample rate, precision,
+#               fused_eq, and the source of the code that runs it)
+#
+# so a stage's key changes exactly when its input, its parameters or its code do, and so
+# does every key after it. A re-render looks for the last stage of each chain whose output
+# is cached, loads it (memory-mapped, copy-on-write) and only runs the stages after it.
+# Changing the buss compressor's threshold re-runs the compressor and the stages after it,
+# not the instrumental and vocal chains.
+#
+# The cache is capped at max_bytes; once over, the least recently used entries (by file
+# mtime, which a hit refreshes) are deleted. Several processes can share a directory:
+# entries are written under a temporary name and renamed into place.
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+# Default location and size cap; $STAGE_CACHE_DIR and $STAGE_CACHE_MAX_MB override them.
+STAGE_CACHE_DIR = os.environ.get("STAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "audiopostproc_stages"))
+STAGE_CACHE_MAX_BYTES = int(float(os.environ.get("STAGE_CACHE_MAX_MB", 4096)) * 2**20)
+
+def combine(*parts):
+    """
+    Hash strings (keys, fingerprints) into one key.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+_source_hashes = {}
+
+def source_hash(*modules):
+    """
+    Hash of the source files of modules (module objects), cached per process.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for module in modules:
+        path = module.__file__
+        if path not in _source_hashes:
+            with open(path, "rb") as f:
+                _source_hashes[path] = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        digest.update(_source_hashes[path].encode())
+    return digest.hexdigest()
+
+class StageCache:
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        Parameters:
+            directory (str): Where entries live (default: STAGE_CACHE_DIR).
+            max_bytes (int): Size cap of the directory (default: STAGE_CACHE_MAX_BYTES).
+        """
+        self.directory = directory or STAGE_CACHE_DIR
+        self.max_bytes = STAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        """
+        The cached array for key as a copy-on-write memory map, None on a miss.
+        """
+        path = self._path(key)
+        try:
+            audio = np.asarray(np.load(path, mmap_mode="c"))
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # Missing, or evicted/truncated by another process in between.
+            self.misses += 1
+            return None
+        self.hits += 1
+        return audio
+
+    def put(self, key, audio):
+        """
+        Store audio under key, then evict old entries if the cache is over its cap.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, audio)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".npy", ".tmp")):
+                os.remove(entry.path)
@@ -1,10 +1,368 @@
+import os
+import queue
+import struct
+import hashlib
+import tempfile
+import threading
+import numpy as np
 from pedalboard.io import AudioFile
+from profiling import stage
+from dsp_scripts.loudness import LoudnessMeter, normalization_gain
+from dsp_scripts.qc import QCMeter
+
+# Resampled inputs are cached here as .npy files keyed by the file's content hash and the
+# target rate, so a stem that needs resampling is only resampled once. Set
+# $RESAMPLE_CACHE_DIR to move the cache, or to an empty string to turn it off.
+RESAMPLE_CACHE_DIR = os.environ.get("RESAMPLE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "audiopostproc_resampled"))
 
 def open_file(file_path, samplerate):
+    """
+    Read a whole file as a (channels, frames) float32 array at samplerate.
+
+    A WAV already at samplerate is memory-mapped instead of decoded (see MappedWav); a mono
+    float32 WAV comes back as a zero-copy, copy-on-write view of the file. Other files at
+    samplerate are decoded without the resampler, and the rest are resampled through the
+    on-disk cache in RESAMPLE_CACHE_DIR.
+    """
+    wav = open_mapped_wav(file_path)
+    if wav is not None and wav.samplerate == samplerate:
+        with wav:
+            return wav.read(wav.frames)
+    with AudioFile(file_path) as f:
+        if f.samplerate == samplerate:
+            return f.read(f.frames)
+    return open_resampled(file_path, samplerate)
+
+def open_file_stream(file_path, samplerate):
+    # Returns the open (resampled) file so the caller can f.read(block_size) until f.tell() == f.frames.
+    # Like open_file, WAVs at samplerate are memory-mapped and nothing at samplerate is resampled.
+    wav = open_mapped_wav(file_path)
+    if wav is not None and wav.samplerate == samplerate:
+        return wav
+    f = AudioFile(file_path)
+    if f.samplerate == samplerate:
+        return f
+    return f.resampled_to(samplerate)
+
+# Output encodings. The container follows the file extension; the sample format maps to
+# Pedalboard's bit_depth (a 32-bit WAV is written as float). FLAC is integer only and takes
+# a compression level from 0 (fastest) to 8 (smallest).
+SAMPLE_FORMATS = {"int16": 16, "int24": 24, "float32": 32}
+OUTPUT_FORMATS = {"wav": ("int16", "int24", "float32"), "flac": ("int16", "int24")}
+DEFAULT_SAMPLE_FORMAT = "int16"
+
+def output_format(file_path, sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None):
+    """
+    Check an output encoding and return its container ("wav" or "flac").
+
+    Raises:
+        ValueError: For an unknown extension, a sample format the container can't hold,
+                    or a compression level on anything but FLAC.
+    """
+    container = os.path.splitext(file_path)[1].lower().lstrip(".")
+    if container not in OUTPUT_FORMATS:
+        raise ValueError(f"Can't write {file_path}: output files must be one of {', '.join('.' + c for c in OUTPUT_FORMATS)}.")
+    if sample_format not in OUTPUT_FORMATS[container]:
+        raise ValueError(f"{container.upper()} output supports sample formats {', '.join(OUTPUT_FORMATS[container])}, "
+                         f"not {sample_format!r}.")
+    if compression_level is not None and (container != "flac" or not 0 <= compression_level <= 8):
+        raise ValueError("compression_level is a FLAC setting from 0 to 8.")
+    return container
+
+def open_file_writer(file_path, samplerate, channels=1, sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None):
+    # Returns a file open for writing, blocks are written with f.write(block) as they are produced.
+    output_format(file_path, sample_format, compression_level)
+    return AudioFile(file_path, 'w', samplerate, channels, bit_depth=SAMPLE_FORMATS[sample_format],
+                     quality=compression_level)
+
+def save_file(audio, file_path, samplerate, channels=1, sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None):
+    with open_file_writer(file_path, samplerate, channels, sample_format, compression_level) as f:
+        f.write(audio)
+
+# Blocks a BackgroundWriter holds before write() blocks the producer.
+WRITER_QUEUE_BLOCKS = 8
+
+class BackgroundWriter:
+    def __init__(self, file_path, samplerate, channels=1, sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None,
+                 name=None, max_pending=WRITER_QUEUE_BLOCKS, qc=False):
+        """
+        An output file encoded and written on its own thread.
+
+        write(block) queues a (channels, frames) block and returns at once, so rendering the
+        next block overlaps with encoding this one. Once max_pending blocks are waiting it
+        blocks until the writer catches up (back-pressure), which bounds the memory held by
+        a fast producer. Blocks are written in order and are not copied: don't modify a block
+        after handing it over. write(block, release) calls release(block) on the writer thread
+        once the block is written (or dropped after an error), e.g. to give it back to a
+        BufferArena. close() waits for everything to be written and re-raises the first write
+        error, if any.
+
+        Parameters:
+            name (str): Label for the writer thread and the profiled "encode.<name>" stage.
+            qc (bool): Run every block through a QCMeter (see dsp_scripts/qc.py) on the
+                       writer thread as it is encoded; its result() is in qc after close().
+        """
+        self.file_path = file_path
+        self.name = name or os.path.basename(file_path)
+        # Opened here so a bad path or format fails in the caller, not on the thread.
+        self.file = open_file_writer(file_path, samplerate, channels, sample_format, compression_level)
+        self.queue = queue.Queue(max_pending)
+        self.qc_meter = QCMeter(samplerate, channels) if qc else None
+        self.qc = None
+        self.error = None
+        self.frames_written = 0
+        self.thread = threading.Thread(target=self._run, name="writer." + self.name, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            block, release = item
+            if self.error is None:
+                # Once there is an error, keep draining so a blocked producer is released.
+                try:
+                    self._write_block(block)
+                except Exception as e:
+                    self.error = e
+            if release is not None:
+                release(block)
+        if self.error is None:
+            try:
+                self._finish()
+                if self.qc_meter is not None:
+                    self.qc = self.qc_meter.result()
+            except Exception as e:
+                self.error = e
+
+    def _write_block(self, block):
+        if self.qc_meter is not None:
+            stage("qc." + self.name, self.qc_meter.process_block, block)
+        stage("encode." + self.name, self.file.write, block)
+        self.frames_written += block.shape[-1]
+
+    def _finish(self):
+        # Runs on the writer thread after the last block, before close() returns.
+        pass
+
+    def write(self, block, release=None):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((block, release))
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+# Frames per block when a LoudnessWriter encodes its spill.
+NORMALIZE_BLOCK_FRAMES = 65536
+
+class LoudnessWriter(BackgroundWriter):
+    def __init__(self, file_path, samplerate, channels=1, sample_format=DEFAULT_SAMPLE_FORMAT, compression_level=None,
+                 name=None, max_pending=WRITER_QUEUE_BLOCKS, target_lufs=None, true_peak_ceiling=None, qc=False):
+        """
+        A BackgroundWriter that measures the loudness of what it writes (see
+        dsp_scripts/loudness.py) on its thread, and optionally normalizes it.
+
+        Without target_lufs blocks are encoded as they come and the measurement is free
+        QC. With it, blocks are metered and spilled to a temporary float32 file. Once the
+        last block is in, the gain that brings the programme to target_lufs (held down so
+        the true peak stays under true_peak_ceiling dBTP) is applied as the spill is
+        encoded. The audio is never held in memory and never makes a second pass through
+        the pipeline.
+
+        After close(), measurement holds the meter's result() for the input plus gain_db
+        and the output's integrated_lufs/true_peak_dbtp.
+        With qc, the QC meter sees the blocks as they are encoded, i.e. normalized.
+        """
+        self.meter = LoudnessMeter(samplerate, channels)
+        self.channels = channels
+        self.target_lufs = target_lufs
+        self.true_peak_ceiling = true_peak_ceiling
+        self.spill = tempfile.TemporaryFile() if target_lufs is not None else None
+        self.measurement = None
+        super().__init__(file_path, samplerate, channels, sample_format, compression_level, name, max_pending, qc)
+
+    def _write_block(self, block):
+        stage("loudness." + self.name, self.meter.process_block, block)
+        if self.spill is None:
+            super()._write_block(block)
+        else:
+            # Frame-major, so the spill can be read back in blocks of any size.
+            np.ascontiguousarray(block.T, dtype=np.float32).tofile(self.spill)
+
+    def _finish(self):
+        measurement = self.meter.result()
+        gain_db = 0.0
+        if self.spill is not None:
+            gain_db = normalization_gain(measurement, self.target_lufs, self.true_peak_ceiling)
+            gain = np.float32(10.0 ** (gain_db / 20.0))
+            self.spill.seek(0)
+            with self.spill:
+                while True:
+                    frames = np.fromfile(self.spill, dtype=np.float32, count=NORMALIZE_BLOCK_FRAMES * self.channels)
+                    if frames.size == 0:
+                        break
+                    block = np.ascontiguousarray(frames.reshape(-1, self.channels).T)
+                    block *= gain
+                    super()._write_block(block)
+        measurement["gain_db"] = gain_db
+        measurement["output_integrated_lufs"] = measurement["integrated_lufs"] + gain_db
+        measurement["output_true_peak_dbtp"] = measurement["true_peak_dbtp"] + gain_db
+        self.measurement = measurement
+
+def file_hash(file_path):
+    # Content hash of a file, read in 1 MiB chunks.
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+def open_resampled(file_path, samplerate):
+    """
+    Read a file resampled to samplerate, through the resample cache.
+
+    A cache hit is memory-mapped (copy-on-write) rather than read. Without a cache
+    directory this is a plain decode and resample.
+    """
+    if not RESAMPLE_CACHE_DIR:
+        with AudioFile(file_path).resampled_to(samplerate) as f:
+            return f.read(f.frames)
+    cache_file = os.path.join(RESAMPLE_CACHE_DIR, f"{file_hash(file_path)}_{samplerate:g}.npy")
+    if os.path.exists(cache_file):
+        return np.asarray(np.load(cache_file, mmap_mode="c"))
     with AudioFile(file_path).resampled_to(samplerate) as f:
         audio = f.read(f.frames)
+    # Write under a temporary name first so a concurrent reader never sees half a file.
+    os.makedirs(RESAMPLE_CACHE_DIR, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=RESAMPLE_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, audio)
+    os.replace(tmp_file, cache_file)
     return audio
 
-def save_file(audio, file_path, samplerate, channels=1):
-    with AudioFile(samplerate, 'w', file_path, channels) as f:
-        f.write(audio)
+# Memory-mapped WAV reading. The RIFF header is parsed here and the sample data mapped with
+# np.memmap, so opening a file costs the same whatever its length and the samples are paged
+# in by the OS as they are used. Integer samples are scaled exactly like Pedalboard's decoder
+# (v / (2**(bits-1) - 1) in float32), so the two read the same values.
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def open_mapped_wav(file_path):
+    """
+    Open a PCM (8/16/24/32-bit) or float (32/64-bit) WAV as a MappedWav, None for anything
+    else (other formats, compressed or RF64 WAVs), which is then left to Pedalboard.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+                return None
+            fmt = None
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    return None
+                chunk_id, size = struct.unpack("<4sI", chunk)
+                if chunk_id == b"fmt ":
+                    fmt = f.read(size)
+                    if size % 2:
+                        f.seek(1, os.SEEK_CUR)
+                elif chunk_id == b"data":
+                    data_offset = f.tell()
+                    break
+                else:
+                    f.seek(size + size % 2, os.SEEK_CUR)
+    except OSError:
+        return None
+    if fmt is None or len(fmt) < 16:
+        return None
+    format_tag, channels, samplerate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if format_tag == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # The sub-format GUID starts with the plain format tag.
+        format_tag = struct.unpack("<H", fmt[24:26])[0]
+    if format_tag == _WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        sample_dtype = np.dtype("<f4" if bits == 32 else "<f8")
+    elif format_tag == _WAVE_FORMAT_PCM and bits in (8, 16, 24, 32):
+        sample_dtype = np.dtype({8: "u1", 16: "<i2", 24: "u1", 32: "<i4"}[bits])
+    else:
+        return None
+    if channels == 0 or block_align != channels * bits // 8:
+        return None
+    # A data size past the end of the file (e.g. an unfinished recording) means "up to the end".
+    size = min(size, os.path.getsize(file_path) - data_offset)
+    frames = size // block_align
+    if frames == 0:
+        return None
+    return MappedWav(file_path, data_offset, frames, channels, samplerate, bits, sample_dtype)
+
+class MappedWav:
+    def __init__(self, file_path, offset, frames, channels, samplerate, bits, sample_dtype):
+        """
+        A WAV file's samples as a copy-on-write memory map, read like a Pedalboard AudioFile:
+        read(n) returns the next (channels, n) float32 block, tell() and frames the position
+        and length.
+
+        Float32 mono blocks are views of the map, with no copy at all. Other layouts are
+        converted to float32 (channels, frames) block by block, straight from the map.
+        Writing to a returned block changes the process' private copy, never the file.
+        """
+        self.file_path = file_path
+        self.frames = frames
+        self.num_channels = channels
+        self.samplerate = samplerate
+        self.bits = bits
+        values_per_frame = channels * 3 if bits == 24 else channels
+        self.samples = np.asarray(np.memmap(file_path, dtype=sample_dtype, mode="c", offset=offset,
+                                            shape=(frames, values_per_frame)))
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Blocks already handed out keep the mapping alive until they are dropped.
+        self.samples = None
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.position = min(max(int(position), 0), self.frames)
+
+    def read(self, num_frames):
+        block = self.samples[self.position:self.position + int(num_frames)]
+        self.position += block.shape[0]
+        if self.bits == 24:
+            raw = block.reshape(block.shape[0], self.num_channels, 3).astype(np.int32)
+            block = ((raw[..., 0] << 8) | (raw[..., 1] << 16) | (raw[..., 2] << 24)) >> 8
+        if block.dtype == np.float32:
+            return np.ascontiguousarray(block.T)
+        if block.dtype == np.float64:
+            return np.ascontiguousarray(block.T, dtype=np.float32)
+        if self.bits == 8:
+            # 8-bit WAV is unsigned with silence at 128.
+            block = block.astype(np.int16) - 128
+        scale = np.float32(1.0 / (2 ** (self.bits - 1) - 1))
+        audio = np.empty((self.num_channels, block.shape[0]), dtype=np.float32)
+        np.multiply(block.T, scale, out=audio, dtype=np.float32)
+        return audio
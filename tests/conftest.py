@@ -0,0 +1,6 @@
+# The modules import each other from src (e.g. "from dsp_scripts import ..."), as when run
+# from there.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
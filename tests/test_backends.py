@@ -0,0 +1,33 @@
+# Every registered backend of every effect against the effect's reference implementation
+# (see dsp_scripts/registry.py and reference.py), in both dtypes and at a few sizes, to the
+# same tolerance as python -m dsp_scripts.autotune --check.
+
+import numpy as np
+import pytest
+from dsp_scripts import registry
+from dsp_scripts.autotune import CHECK_FRAMES, CHECK_TOLERANCE, call, load_effects
+
+EFFECTS = load_effects()
+
+BACKENDS = [
+    (name, backend)
+    for name, effect in sorted(EFFECTS.items())
+    if effect.case is not None and registry.reference(name) is not None
+    for backend in sorted(effect.backends)
+    if effect.backends[backend] is not registry.reference(name)
+]
+
+@pytest.mark.parametrize("frames", [1, 1000, CHECK_FRAMES])
+@pytest.mark.parametrize("dtype", ["float32", "float64"])
+@pytest.mark.parametrize("effect, backend", BACKENDS)
+def test_backend_matches_reference(effect, backend, dtype, frames):
+    prepare, output = EFFECTS[effect].case(frames, np.dtype(dtype))
+    expected, _ = call(registry.reference(effect), prepare, output)
+    result, _ = call(EFFECTS[effect].backends[backend], prepare, output)
+    assert result.shape == expected.shape
+    error = np.max(np.abs(result.astype(np.float64) - expected))
+    assert error <= CHECK_TOLERANCE[dtype], f"{effect} {backend} {dtype}: max error {error:.2e}"
+
+def test_every_effect_has_a_reference():
+    # A backend without a reference would go unchecked.
+    assert [name for name in EFFECTS if registry.reference(name) is None] == []